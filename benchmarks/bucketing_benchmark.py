@@ -0,0 +1,90 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for shape bucketing with `jit(..., bucket_axes=...)`.
+
+Simulates inference traffic with ragged batch sizes and sequence lengths, and
+reports the number of compiled executables and the median and tail latencies of
+the requests, with and without bucketing. Compilations are counted separately
+for jitted functions (misses in the `xla_callable` cache) and for single
+primitives (misses in the `xla_primitive_callable` cache), as bucketing still
+pads DeviceArray arguments and slices the outputs with small operations that
+are compiled once per size.
+
+Run with `python benchmarks/bucketing_benchmark.py`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as onp
+
+import jax.numpy as np
+from jax import api, jit
+
+
+def model(params, x, length=None):
+  """Sums a one-layer MLP over the sequence (axis 1) of `x`."""
+  w1, w2 = params
+  h = np.tanh(np.dot(x, w1))
+  if length is not None:
+    h = np.where((np.arange(x.shape[1]) < length)[None, :, None], h, 0.)
+  return np.dot(np.sum(h, axis=1), w2)
+
+
+def bench(name, f, params, requests):
+  caches = ['jax.interpreters.xla.xla_callable',
+            'jax.interpreters.xla.xla_primitive_callable']
+  api.clear_caches()
+  misses = [api.cache_info()[cache]['misses'] for cache in caches]
+  times = []
+  for x in requests:
+    start = time.time()
+    onp.asarray(f(params, x))
+    times.append(time.time() - start)
+  jit_misses, prim_misses = [api.cache_info()[cache]['misses'] - m
+                             for cache, m in zip(caches, misses)]
+  times = 1e3 * onp.array(times)
+  print("{:>26}: {:4d} jit + {:4d} primitive compilations in {} requests, "
+        "p50 {:7.2f} ms, p99 {:7.2f} ms".format(
+            name, jit_misses, prim_misses, len(requests),
+            onp.percentile(times, 50), onp.percentile(times, 99)))
+
+
+def main():
+  rng = onp.random.RandomState(0)
+  features, hidden = 64, 256
+  params = (rng.randn(features, hidden).astype(onp.float32),
+            rng.randn(hidden, 8).astype(onp.float32))
+
+  ragged_batch = [rng.randn(rng.randint(1, 65), 16, features)
+                  .astype(onp.float32) for _ in range(500)]
+  bench("ragged batch", jit(model), params, ragged_batch)
+  bench("ragged batch, bucketed",
+        jit(lambda params, x, length: model(params, x), bucket_axes=(None, 0)),
+        params, ragged_batch)
+
+  ragged_seq = [rng.randn(8, rng.randint(1, 257), features).astype(onp.float32)
+                for _ in range(500)]
+  bench("ragged sequence", jit(model), params, ragged_seq)
+  bench("ragged sequence, bucketed",
+        jit(model, bucket_axes=(None, 1), bucket_sizes=(32, 64, 128, 256),
+            bucket_out_axes=None),
+        params, ragged_seq)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,78 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for the time taken by `import jax`.
+
+Times a few import statements in fresh interpreters, reporting the median wall
+time over several runs and the number of modules each one loads. Exits with a
+nonzero status if `import jax` takes longer than the budget, in milliseconds,
+given as the first command line argument.
+
+Run with `python benchmarks/import_benchmark.py [budget_ms]`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import subprocess
+import sys
+
+import numpy as onp
+
+
+STATEMENTS = [
+    "import numpy",
+    "import jax",
+    "import jax; jax.jit(lambda x: x)",
+    "import jax.scipy.special",
+    "import jax.numpy as np; np.einsum('i,i', np.ones(2), np.ones(2))",
+    "import jax.experimental.stax",
+]
+
+_TIMER = """
+import sys, time
+start = time.time()
+{}
+print(time.time() - start, len(sys.modules))
+"""
+
+
+def time_import(statement, reps=5):
+  times = []
+  for _ in range(reps):
+    out = subprocess.check_output(
+        [sys.executable, "-c", _TIMER.format(statement)])
+    seconds, num_modules = out.decode().split()
+    times.append(float(seconds))
+  return 1e3 * onp.median(times), int(num_modules)
+
+
+def main(argv):
+  budget = float(argv[1]) if len(argv) > 1 else None
+  results = {}
+  for statement in STATEMENTS:
+    ms, num_modules = results[statement] = time_import(statement)
+    print("{:>40}: {:8.1f} ms, {:5d} modules".format(statement, ms,
+                                                      num_modules))
+  if budget is not None:
+    ms, _ = results["import jax"]
+    if ms > budget:
+      print("import jax took {:.1f} ms, over the budget of {:.1f} ms".format(
+          ms, budget))
+      return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv))
@@ -0,0 +1,104 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for the jaxpr simplification passes in `jax.jaxpr_passes`.
+
+For jaxprs produced by `grad`, `vjp` and `vmap`, reports the number of equations
+left after each pass, and the time to trace, lower and compile the function
+with `jit` with the passes disabled and enabled.
+
+Run with `python benchmarks/jaxpr_passes_benchmark.py`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as onp
+
+import jax.numpy as np
+from jax import api, jit, grad, vjp, vmap
+from jax import jaxpr_passes
+from jax import profiler
+from jax.config import config
+
+
+def mlp_loss(params, x, y):
+  for w, b in params[:-1]:
+    x = np.tanh(np.dot(x, w) + b)
+  w, b = params[-1]
+  return np.mean((np.dot(x, w) + b - y) ** 2)
+
+
+def vjp_of_loss(params, x, y):
+  _, f_vjp = vjp(lambda params: mlp_loss(params, x, y), params)
+  return f_vjp(1.)
+
+
+def per_example_grads(params, x, y):
+  return vmap(grad(mlp_loss), (None, 0, 0))(params, x[:, None], y[:, None])
+
+
+def count_eqns(name, fun, args):
+  jaxpr = api.make_jaxpr(fun)(*args)
+  counts = [profiler.count_eqns(jaxpr)]
+  for pass_ in jaxpr_passes.default_passes:
+    jaxpr = pass_(jaxpr)
+    counts.append(profiler.count_eqns(jaxpr))
+  names = ['traced'] + [p.__name__ for p in jaxpr_passes.default_passes]
+  print("{:>20}: {}".format(name, ", ".join(
+      "{} {}".format(n, pass_name) for n, pass_name in zip(counts, names))))
+
+
+def compile_time(fun, args, optimize, reps=5):
+  config.update('jax_optimize_jaxprs', optimize)
+  times = []
+  for _ in range(reps):
+    api.clear_caches()
+    start = time.time()
+    jit(fun)(*args)
+    times.append(time.time() - start)
+  return 1e3 * onp.median(times)
+
+
+def main():
+  rng = onp.random.RandomState(0)
+  sizes = [32, 64, 64, 64, 1]
+  params = [(rng.randn(m, n).astype(onp.float32), onp.zeros(n, onp.float32))
+            for m, n in zip(sizes[:-1], sizes[1:])]
+  x = rng.randn(16, sizes[0]).astype(onp.float32)
+  y = rng.randn(16, 1).astype(onp.float32)
+
+  benchmarks = [("grad", grad(mlp_loss), (params, x, y)),
+                ("vjp", vjp_of_loss, (params, x, y)),
+                ("vmap of grad", per_example_grads, (params, x, y)),
+                ("grad of grad", grad(lambda x: np.sum(grad(
+                    lambda x: np.sum(np.tanh(np.tanh(x)) ** 2))(x))), (x,))]
+
+  print("Equation counts after each pass:")
+  for name, fun, args in benchmarks:
+    count_eqns(name, fun, args)
+
+  print("\nMedian time to trace and compile with jit:")
+  try:
+    for name, fun, args in benchmarks:
+      print("{:>20}: {:8.2f} ms without passes, {:8.2f} ms with passes".format(
+          name, compile_time(fun, args, False), compile_time(fun, args, True)))
+  finally:
+    config.update('jax_optimize_jaxprs', True)
+
+
+if __name__ == "__main__":
+  main()
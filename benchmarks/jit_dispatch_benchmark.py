@@ -0,0 +1,66 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmark for the per-call Python overhead of jitted functions.
+
+Compares `jit`, which hits a per-function signature cache on repeated calls,
+against the general dispatch path through `xla.xla_call`, which re-flattens
+arguments and re-hashes the `lu.memoize` key on every call.
+
+Run with `python benchmarks/jit_dispatch_benchmark.py`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import timeit
+
+import numpy as onp
+
+from jax import jit
+from jax import linear_util as lu
+from jax.api_util import flatten_fun
+from jax.interpreters import xla
+from jax.tree_util import tree_flatten, tree_unflatten
+
+
+def xla_call_dispatch(fun):
+  def f(*args):
+    args_flat, in_tree = tree_flatten((args, {}))
+    flat_fun, out_tree = flatten_fun(lu.wrap_init(fun), in_tree)
+    out = xla.xla_call(flat_fun, *args_flat, device_values=True)
+    return tree_unflatten(out_tree(), out)
+  return f
+
+
+def bench(name, f, args, number=2000, repeat=5):
+  f(*args)  # compile
+  times = timeit.repeat(lambda: f(*args), number=number, repeat=repeat)
+  print("{:>30}: {:8.2f} us/call".format(name, 1e6 * min(times) / number))
+
+
+def main():
+  def step(params, x):
+    w, b = params
+    return w * x + b
+
+  params = (onp.float32(2.), onp.float32(1.))
+  x = onp.ones((4,), onp.float32)
+  bench("xla_call dispatch", xla_call_dispatch(step), (params, x))
+  bench("jit signature cache", jit(step), (params, x))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,86 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory benchmark for `jax.checkpoint` on a deep MLP.
+
+Reverse-mode AD keeps the residuals of the forward pass alive until the
+backward pass consumes them. This reports the number and total size of those
+residuals (the constants of the linearized function) for a deep MLP, with and
+without checkpointing each layer, along with the time for a gradient step.
+
+Run with `python benchmarks/remat_benchmark.py`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import timeit
+
+import numpy as onp
+
+import jax.numpy as np
+from jax import checkpoint, grad, jit
+from jax import linear_util as lu
+from jax.core import JaxTuple
+from jax.interpreters import ad
+from jax.tree_util import tree_flatten, tree_unflatten
+
+
+def mlp(params, x, remat):
+  def layer(W, b, x):
+    return np.tanh(np.dot(x, W) + b)
+  if remat:
+    layer = checkpoint(layer)
+  for W, b in params:
+    x = layer(W, b, x)
+  return np.sum(x)
+
+
+def residual_bytes(consts):
+  total = 0
+  for c in consts:
+    if isinstance(c, JaxTuple):
+      total += residual_bytes(c)
+    else:
+      total += onp.size(c) * onp.result_type(c).itemsize
+  return total
+
+
+def bench(name, params, x, remat):
+  flat_params, tree = tree_flatten(params)
+  f_flat = lambda *flat_params: mlp(tree_unflatten(tree, flat_params), x, remat)
+  _, _, _, consts = ad.linearize(lu.wrap_init(f_flat), *flat_params)
+
+  g = jit(grad(lambda params: mlp(params, x, remat)))
+  run = lambda: tree_flatten(g(params))[0][-1].block_until_ready()
+  run()  # compile
+  times = timeit.repeat(run, number=10, repeat=3)
+  print("{:>16}: {:4d} residuals, {:8.2f} MB, {:8.2f} ms/grad".format(
+      name, len(consts), residual_bytes(consts) / 2 ** 20,
+      1e3 * min(times) / 10))
+
+
+def main():
+  depth, width, batch = 32, 512, 256
+  rng = onp.random.RandomState(0)
+  params = [(rng.randn(width, width).astype(onp.float32) / onp.sqrt(width),
+             onp.zeros(width, onp.float32)) for _ in range(depth)]
+  x = rng.randn(batch, width).astype(onp.float32)
+  bench("no checkpoint", params, x, remat=False)
+  bench("checkpoint", params, x, remat=True)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,140 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for flattening, unflattening and mapping over pytrees.
+
+Compares `jax.tree_util` against recursive reference implementations that
+build a nested treedef per node, as `tree_util` did before its treedefs were
+flattened, on large nested dict/list parameter trees.
+
+Run with `python benchmarks/tree_util_benchmark.py`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import timeit
+
+from jax import tree_util
+from jax.tree_util import node_types
+
+
+class _RecursiveTreeDef(object):
+  def __init__(self, node_type, node_data, children):
+    self.node_type = node_type
+    self.node_data = node_data
+    self.children = children
+
+  def __hash__(self):
+    return hash((self.node_type, self.node_data, tuple(self.children)))
+
+  def __eq__(self, other):
+    return (type(other) is _RecursiveTreeDef and
+            self.node_type == other.node_type and
+            self.node_data == other.node_data and
+            self.children == other.children)
+
+_leaf = object()
+
+def recursive_flatten(tree):
+  node_type = node_types.get(type(tree))
+  if node_type:
+    children, node_data = node_type.to_iterable(tree)
+    leaves, child_defs = [], []
+    for child in children:
+      child_leaves, child_def = recursive_flatten(child)
+      leaves.extend(child_leaves)
+      child_defs.append(child_def)
+    return leaves, _RecursiveTreeDef(node_type, node_data, child_defs)
+  else:
+    return [tree], _leaf
+
+def recursive_unflatten(treedef, xs):
+  return _recursive_unflatten(iter(xs), treedef)
+
+def _recursive_unflatten(xs, treedef):
+  if treedef is _leaf:
+    return next(xs)
+  children = [_recursive_unflatten(xs, child) for child in treedef.children]
+  return treedef.node_type.from_iterable(treedef.node_data, children)
+
+def recursive_map(f, tree):
+  node_type = node_types.get(type(tree))
+  if node_type:
+    children, node_data = node_type.to_iterable(tree)
+    return node_type.from_iterable(node_data,
+                                   [recursive_map(f, c) for c in children])
+  else:
+    return f(tree)
+
+def recursive_multimap(f, tree, *rest):
+  node_type = node_types.get(type(tree))
+  if node_type:
+    children, node_data = node_type.to_iterable(tree)
+    all_children = [children]
+    for other in rest:
+      other_children, other_node_data = node_type.to_iterable(other)
+      assert node_types.get(type(other)) == node_type
+      assert other_node_data == node_data
+      all_children.append(other_children)
+    return node_type.from_iterable(
+        node_data, [recursive_multimap(f, *xs) for xs in zip(*all_children)])
+  else:
+    return f(tree, *rest)
+
+
+def make_tree(depth, width):
+  """Nested dicts of lists of (weight, bias) tuples, like stax parameters."""
+  if depth == 0:
+    return [(1., 2.) for _ in range(width)]
+  return {'layer{}'.format(i): make_tree(depth - 1, width)
+          for i in range(width)}
+
+
+def bench(name, fun, number):
+  seconds = min(timeit.repeat(fun, number=number, repeat=3)) / number
+  print("{:>40}: {:9.1f} us".format(name, 1e6 * seconds))
+  return seconds
+
+
+def main():
+  for depth, width in [(1, 10), (2, 10), (3, 10), (2, 40)]:
+    tree = make_tree(depth, width)
+    leaves, treedef = tree_util.tree_flatten(tree)
+    _, ref_treedef = recursive_flatten(tree)
+    number = max(1, 20000 // len(leaves))
+    print("depth {}, width {}: {} leaves".format(depth, width, len(leaves)))
+    pairs = [
+        ("tree_flatten", lambda: tree_util.tree_flatten(tree),
+         lambda: recursive_flatten(tree)),
+        ("tree_unflatten", lambda: tree_util.tree_unflatten(treedef, leaves),
+         lambda: recursive_unflatten(ref_treedef, leaves)),
+        ("tree_map", lambda: tree_util.tree_map(abs, tree),
+         lambda: recursive_map(abs, tree)),
+        ("tree_multimap", lambda: tree_util.tree_multimap(max, tree, tree),
+         lambda: recursive_multimap(max, tree, tree)),
+        ("hash(treedef)", lambda: hash(treedef), lambda: hash(ref_treedef)),
+        ("treedef == treedef",
+         lambda: treedef == tree_util.tree_structure(tree),
+         lambda: ref_treedef == recursive_flatten(tree)[1]),
+    ]
+    for name, new, old in pairs:
+      t_new = bench(name, new, number)
+      t_old = bench(name + " (recursive)", old, number)
+      print("{:>40}: {:9.2f}x".format("speedup", t_old / t_new))
+    print()
+
+
+if __name__ == "__main__":
+  main()
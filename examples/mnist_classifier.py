@@ -27,7 +27,7 @@ import numpy.random as npr
 
 import jax.numpy as np
 from jax.config import config
-from jax import jit, grad, random
+from jax import jit, grad, random, prefetch_to_device
 from jax.experimental import optimizers
 from jax.experimental import stax
 from jax.experimental.stax import Dense, Relu, LogSoftmax
@@ -70,7 +70,8 @@ if __name__ == "__main__":
       for i in range(num_batches):
         batch_idx = perm[i * batch_size:(i + 1) * batch_size]
         yield train_images[batch_idx], train_labels[batch_idx]
-  batches = data_stream()
+  # Transfer batches to the device in the background while the model trains.
+  batches = prefetch_to_device(data_stream())
 
   opt_init, opt_update, get_params = optimizers.momentum(step_size, mass=momentum_mass)
 
@@ -27,7 +27,7 @@ import time
 import numpy as onp
 import numpy.random as npr
 
-from jax import jit, grad, pmap
+from jax import jit, grad, pmap, prefetch_to_device
 from jax.config import config
 from jax.scipy.special import logsumexp
 from jax.lib import xla_bridge
@@ -96,7 +96,8 @@ if __name__ == "__main__":
         images = images.reshape(shape_prefix + images.shape[1:])
         labels = labels.reshape(shape_prefix + labels.shape[1:])
         yield images, labels
-  batches = data_stream()
+  # Shard each batch across the devices in the background while training.
+  batches = prefetch_to_device(data_stream(), devices=range(num_devices))
 
   @partial(pmap, axis_name='batch')
   def spmd_update(params, batch):
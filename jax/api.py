@@ -29,15 +29,23 @@ from __future__ import print_function
 import itertools
 import operator as op
 import os
+import sys
+import threading
+import weakref
 from warnings import warn
 
 import numpy as onp
 from contextlib import contextmanager
 from distutils.util import strtobool
+import six
 from six.moves import reduce
 
 from . import core
 from . import linear_util as lu
+from . import memory
+from . import profiler
+from . import util
+from . import warmup
 from .core import pack, eval_jaxpr
 from .api_util import (pytree_fun_to_jaxtupletree_fun, pytree_to_jaxtupletree,
                        pytree_fun_to_flatjaxtuple_fun, apply_jaxtree_fun, wraps,
@@ -46,7 +54,7 @@ from .tree_util import (process_pytree, node_types, build_tree, PyTreeDef,
                         tree_map, tree_flatten, tree_unflatten, tree_structure,
                         tree_transpose, leaf)
 from .util import (unzip2, unzip3, curry, partial, safe_map, safe_zip,
-                   WrapHashably, Hashable, prod)
+                   WrapHashably, Hashable, prod, LRUCache)
 from .lib.xla_bridge import canonicalize_dtype, device_count
 from .abstract_arrays import ShapedArray
 from .interpreters import partial_eval as pe
@@ -66,7 +74,8 @@ flags.DEFINE_bool("jax_disable_jit",
                   "Disable JIT compilation and just call original Python.")
 
 
-def jit(fun, static_argnums=()):
+def jit(fun, static_argnums=(), donate_argnums=(), bucket_axes=None,
+        bucket_sizes=None, bucket_out_axes=0):
   """Sets up `fun` for just-in-time compilation with XLA.
 
   Args:
@@ -84,6 +93,28 @@ def jit(fun, static_argnums=()):
       different values for these constants will trigger recompilation. If the
       jitted function is called with fewer positional arguments than indicated
       by `static_argnums` then an error is raised. Defaults to ().
+    donate_argnums: A tuple of ints specifying which positional arguments to
+      donate to the computation. XLA may reuse the device memory of donated
+      arguments for outputs with the same shape and dtype, e.g. to update
+      optimizer state in place. Donated DeviceArrays can't be used after the
+      call, and doing so raises an error. Donation only applies to top-level
+      calls, not to calls inside other transformations. Defaults to ().
+    bucket_axes: Optional int, or tuple with one int or None per positional
+      argument, specifying an axis of the arguments along which to pad them up
+      to a bucket size (see `bucket_sizes`). All bucketed axes must have the
+      same size. `fun` is called with the padded (with zeros) arguments and
+      the unpadded size as an extra int32 keyword argument `length`, e.g. to
+      mask out the padding. `fun` itself is compiled once per bucket rather
+      than once per size, but padding DeviceArray arguments and slicing the
+      outputs are small device operations that are still compiled once per
+      size (numpy arguments are padded on the host). Defaults to None, meaning
+      no bucketing.
+    bucket_sizes: Optional increasing sequence of bucket sizes. Sizes beyond
+      the largest bucket aren't padded. Defaults to powers of two.
+    bucket_out_axes: The axis of the outputs of `fun` to slice the padding off,
+      None to return the outputs as they are, or a tuple with one int or None
+      per output if `fun` returns a tuple. Each sliced output must have the
+      bucket size along its axis, otherwise an error is raised. Defaults to 0.
 
   Returns:
     A wrapped version of `fun`, set up for just-in-time compilation.
@@ -100,10 +131,38 @@ def jit(fun, static_argnums=()):
   >>> print(selu(x))
   [-0.54485154  0.27744263 -0.29255125 -0.91421586 -0.62452525 -0.2474813
    -0.8574326  -0.7823267   0.7682731   0.59566754]
+
+  Jitted functions can also be lowered and compiled ahead of time, for given
+  argument shapes and dtypes:
+
+  >>> spec = jax.ShapeDtypeStruct((10,), jax.numpy.float32)
+  >>> compiled = selu.lower(spec).compile()
+  >>> print(compiled(x))
+
+  With `bucket_axes`, calls with batches of size 5 to 8 all share one
+  executable:
+
+  >>> from functools import partial
+  >>> @partial(jax.jit, bucket_axes=0, bucket_out_axes=None)
+  ... def mean(x, length):
+  ...   mask = jax.numpy.arange(x.shape[0]) < length
+  ...   return jax.numpy.sum(jax.numpy.where(mask, x, 0)) / length
   """
-  return _jit(fun, static_argnums)
+  if bucket_axes is not None:
+    return _bucketed_jit(fun, static_argnums, donate_argnums, bucket_axes,
+                         bucket_sizes, bucket_out_axes)
+  return _jit(fun, static_argnums, donate_argnums=donate_argnums)
+
+def _jit(fun, static_argnums, device_values=True, donate_argnums=()):
+  if isinstance(donate_argnums, int):
+    donate_argnums = (donate_argnums,)
+  if set(donate_argnums) & set(static_argnums):
+    raise ValueError("jit arguments can't be both static and donated, got "
+                     "static_argnums={} and donate_argnums={}."
+                     .format(static_argnums, donate_argnums))
+
+  options = (fun, tuple(static_argnums), tuple(donate_argnums), device_values)
 
-def _jit(fun, static_argnums, device_values=True):
   @wraps(fun)
   def f_jitted(*args, **kwargs):
     if _jit_is_disabled or config.read('jax_disable_jit'):
@@ -112,19 +171,366 @@ def _jit(fun, static_argnums, device_values=True):
       msg = ("Jitted function has static_argnums={} but was called with only {}"
              " positional arguments.")
       raise TypeError(msg.format(static_argnums, len(args)))
-    f = lu.wrap_init(fun)
     dyn_argnums = [i for i in range(len(args)) if i not in static_argnums]
-    f, dyn_args = _argnums_partial(f, dyn_argnums, args)
+    dyn_args = tuple(args[i] for i in dyn_argnums)
     args_flat, in_tree = tree_flatten((dyn_args, kwargs))
+
+    top_level = not (core.trace_stack.upward or core.trace_stack.downward)
+    sig = top_level and _jit_signature(static_argnums, args, in_tree, args_flat)
+    key = sig and (options, sig, _jit_flag_state())
+    # Recorded before the fast path, so that signatures compiled before
+    # recording started are recorded too.
+    if top_level and warmup.is_recording():
+      warmup.record_jit(fun, static_argnums, donate_argnums, device_values,
+                        args, kwargs)
+    if key:
+      entry = _jit_fast_path_cache.get(key)
+      compiled_fun = entry and entry[0]()
+      if compiled_fun is not None:
+        out_tree = entry[1]
+        if profiler.is_enabled():
+          profiler.record_cache_hit(
+              'jit', getattr(fun, '__name__', '<unnamed function>'))
+        return _execute_jitted(compiled_fun, out_tree, fun, dyn_argnums,
+                               in_tree, args, args_flat)
+
+    f = lu.wrap_init(fun)
+    f, dyn_args = _argnums_partial(f, dyn_argnums, args)
     _check_args(args_flat)
     flat_fun, out_tree = flatten_fun(f, in_tree)
-    out = xla.xla_call(flat_fun, *args_flat, device_values=device_values)
-    return tree_unflatten(out_tree(), out)
+    if not top_level:
+      out = xla.xla_call(flat_fun, *args_flat, device_values=device_values)
+      return tree_unflatten(out_tree(), out)
+
+    # With no transformations being traced there are no tracers to handle, so
+    # we can skip xla.xla_call and go straight to the compiled function.
+    device_values_ = FLAGS.jax_device_values and device_values
+    donated_invars = _donated_invars(donate_argnums, dyn_argnums, dyn_args,
+                                     kwargs)
+    with core.new_sublevel():
+      compiled_fun = xla.xla_callable(flat_fun, device_values_, donated_invars,
+                                      *map(xla.abstractify, args_flat))
+    if key:
+      _jit_fast_path_cache.put(key, (weakref.ref(compiled_fun), out_tree()))
+    return _execute_jitted(compiled_fun, out_tree(), fun, dyn_argnums, in_tree,
+                           args, args_flat)
+
+  def lower(*args, **kwargs):
+    """Lowers the jitted function for the given argument shapes and dtypes.
+
+    Args:
+      *args, **kwargs: arguments as for the jitted function, except that array
+        arguments can be given as `ShapeDtypeStruct`s instead of arrays.
+
+    Returns:
+      A `Lowered` object, whose `compile` method compiles the function without
+      the need to call it on real data.
+    """
+    if static_argnums and max(static_argnums) >= len(args):
+      msg = ("Jitted function has static_argnums={} but was lowered with only "
+             "{} positional arguments.")
+      raise TypeError(msg.format(static_argnums, len(args)))
+    dyn_argnums = [i for i in range(len(args)) if i not in static_argnums]
+    dyn_args = tuple(args[i] for i in dyn_argnums)
+    args_flat, in_tree = tree_flatten((dyn_args, kwargs))
+    avals = tuple(map(_lowering_aval, args_flat))
+    f = lu.wrap_init(fun)
+    f, _ = _argnums_partial(f, dyn_argnums, args)
+    flat_fun, out_tree = flatten_fun(f, in_tree)
+    donated_invars = _donated_invars(donate_argnums, dyn_argnums, dyn_args,
+                                     kwargs)
+    with core.new_sublevel():
+      built_c, pval, aliased_invars, hoisted, nreps = xla.lower_callable(
+          flat_fun, donated_invars, *avals)
+    static_args = tuple(_wrap_hashably(args[i]) for i in static_argnums)
+    device_values_ = FLAGS.jax_device_values and device_values
+    return Lowered(flat_fun, built_c, pval, aliased_invars, donated_invars,
+                   hoisted, device_values_, in_tree, out_tree(), avals,
+                   static_argnums, static_args, nreps)
+
+  def precompile(*args, **kwargs):
+    # Lowers on the calling thread and returns a thunk that compiles (which can
+    # run concurrently with other compilations) and returns a thunk that adds
+    # the executable to the compilation cache. Used by jax.warmup.
+    lowered = lower(*args, **kwargs)
+    def compile_():
+      compiled_fun = lowered.compile()._compiled_fun
+      return partial(xla.xla_callable.insert, compiled_fun, lowered._fun,
+                     lowered._device_values, lowered._donated_invars,
+                     *lowered._avals)
+    return compile_
 
   jitted_name =  "jit({}, static_argnums={})"
   f_jitted.__name__ = jitted_name.format(f_jitted.__name__, static_argnums)
+  f_jitted.lower = lower
+  f_jitted._precompile = precompile
   return f_jitted
 
+# Maps jit options, call signatures (see _jit_signature) and the global flags
+# affecting tracing and compilation (see _jit_flag_state) to
+# (compiled_fun, out_tree) pairs so that repeated top-level calls can skip the
+# tracing bookkeeping. compiled_fun is only weakly referenced: the executables
+# are owned, and counted against the byte budget, by xla.xla_callable's cache,
+# so an entry evicted from there is dropped here too.
+_jit_fast_path_cache = LRUCache('jax.api.jit_fast_path')
+
+def _jit_flag_state():
+  return (FLAGS.jax_enable_x64, FLAGS.jax_device_values, FLAGS.jax_debug_nans)
+
+def _jit_signature(static_argnums, args, in_tree, args_flat):
+  """Returns a hashable key for a top-level jit call, or None.
+
+  The key identifies the compiled executable to use for the call, namely the
+  argument tree structure, the type, shape and dtype of each argument leaf, and
+  the values of the static arguments. Returns None if some leaf has a type for
+  which we don't know how to form a signature cheaply.
+  """
+  leaf_sigs = []
+  for x in args_flat:
+    sig_fun = _leaf_signature_fns.get(type(x))
+    if sig_fun is None:
+      return None
+    leaf_sigs.append(sig_fun(x))
+  static_args = tuple(_wrap_hashably(args[i]) for i in static_argnums)
+  return in_tree, tuple(leaf_sigs), static_args
+
+def _donated_invars(donate_argnums, dyn_argnums, dyn_args, kwargs):
+  """Returns a tuple of bools marking the donated leaves of the jit arguments."""
+  if not donate_argnums:
+    return ()
+  donated = []
+  for i, arg in zip(dyn_argnums, dyn_args):
+    donated.extend([i in donate_argnums] * len(tree_flatten(arg)[0]))
+  donated.extend([False] * len(tree_flatten(kwargs)[0]))
+  return tuple(donated)
+
+def _array_leaf_signature(x):
+  return type(x), x.shape, x.dtype
+
+def _scalar_leaf_signature(x):
+  return type(x)
+
+_leaf_signature_fns = {
+    t: _array_leaf_signature if issubclass(t, (onp.ndarray, onp.generic))
+    else _scalar_leaf_signature for t in xla.array_types}
+_leaf_signature_fns[xla.DeviceArray] = _array_leaf_signature
+
+class ShapeDtypeStruct(object):
+  """Shape and dtype of an array argument, for `lower`-ing jitted functions."""
+  __slots__ = ["shape", "dtype"]
+
+  def __init__(self, shape, dtype):
+    self.shape = tuple(shape)
+    self.dtype = onp.dtype(dtype)
+
+  def __repr__(self):
+    return "ShapeDtypeStruct(shape={}, dtype={})".format(self.shape,
+                                                         self.dtype.name)
+
+def _lowering_aval(x):
+  if isinstance(x, ShapeDtypeStruct):
+    return ShapedArray(x.shape, canonicalize_dtype(x.dtype))
+  elif isinstance(x, core.Tracer):
+    raise TypeError("Jitted functions can't be lowered for traced arguments.")
+  else:
+    return xla.abstractify(x)
+
+
+class Lowered(object):
+  """A jitted function lowered to an XLA computation for fixed argument types.
+
+  Created by the `lower` method of jitted functions.
+  """
+
+  def __init__(self, fun, built_c, pval, aliased_invars, donated_invars,
+               hoisted, device_values, in_tree, out_tree, avals, static_argnums,
+               static_args, nreps=1):
+    self._fun = fun
+    self._built_c = built_c
+    self._pval = pval
+    self._aliased_invars = aliased_invars
+    self._donated_invars = donated_invars
+    self._hoisted = hoisted
+    self._device_values = device_values
+    self._in_tree = in_tree
+    self._out_tree = out_tree
+    self._avals = avals
+    self._static_argnums = static_argnums
+    self._static_args = static_args
+    self._nreps = nreps
+
+  def computation(self):
+    """The built XLA computation."""
+    return self._built_c
+
+  def as_hlo_text(self):
+    """The HLO of the computation, as text."""
+    return self._built_c.GetHloText()
+
+  def as_serialized_hlo(self):
+    """The HLO module of the computation, as a serialized HloModuleProto."""
+    return self._built_c.GetSerializedProto()
+
+  def compile(self):
+    """Compiles the computation, returning a `Compiled` callable."""
+    param_avals = self._avals + tuple(map(xla.abstractify, self._hoisted))
+    compiled = xla.compile_computation(self._built_c, param_avals, self._nreps)
+    compiled_fun = xla.compiled_callable(
+        compiled, self._built_c, self._pval, self._device_values,
+        self._donated_invars, self._aliased_invars, self._hoisted,
+        profiler.function_name(self._fun), self._nreps)
+    return Compiled(compiled_fun, self)
+
+
+class Compiled(object):
+  """A jitted function compiled ahead of time for fixed argument types.
+
+  Calling it runs the executable directly, without tracing, provided that the
+  arguments have the same tree structure, shapes and dtypes (and the same
+  static argument values) as those it was lowered for.
+  """
+
+  def __init__(self, compiled_fun, lowered):
+    self._compiled_fun = compiled_fun
+    self._lowered = lowered
+
+  @property
+  def nbytes(self):
+    """Estimated size of the executable (see xla.computation_size)."""
+    return self._compiled_fun.nbytes
+
+  def as_hlo_text(self):
+    return self._lowered.as_hlo_text()
+
+  def __call__(self, *args, **kwargs):
+    lowered = self._lowered
+    static_argnums = lowered._static_argnums
+    if static_argnums and max(static_argnums) >= len(args):
+      msg = ("Compiled function has static_argnums={} but was called with only "
+             "{} positional arguments.")
+      raise TypeError(msg.format(static_argnums, len(args)))
+    static_args = tuple(_wrap_hashably(args[i]) for i in static_argnums)
+    if static_args != lowered._static_args:
+      raise ValueError("Compiled function called with different static "
+                       "arguments than it was lowered for.")
+    dyn_args = tuple(x for i, x in enumerate(args) if i not in static_argnums)
+    args_flat, in_tree = tree_flatten((dyn_args, kwargs))
+    if in_tree != lowered._in_tree:
+      msg = ("Compiled function called with argument structure {} but was "
+             "lowered for {}.")
+      raise TypeError(msg.format(in_tree, lowered._in_tree))
+    _check_args(args_flat)
+    avals = tuple(map(xla.abstractify, args_flat))
+    if avals != lowered._avals:
+      msg = ("Compiled function called with argument types {} but was lowered "
+             "for {}.")
+      raise TypeError(msg.format(", ".join(map(str, avals)),
+                                 ", ".join(map(str, lowered._avals))))
+    out = self._compiled_fun(*args_flat)
+    return tree_unflatten(lowered._out_tree, out)
+
+
+def _bucketed_jit(fun, static_argnums, donate_argnums, bucket_axes,
+                  bucket_sizes, out_axes):
+  if bucket_sizes is not None:
+    bucket_sizes = sorted(bucket_sizes)
+  jitted_fun = _jit(fun, static_argnums, donate_argnums=donate_argnums)
+
+  @wraps(fun)
+  def f_bucketed(*args, **kwargs):
+    if isinstance(bucket_axes, int):
+      axes = (bucket_axes,) * len(args)
+    else:
+      axes = tuple(bucket_axes)
+    if len(axes) != len(args):
+      msg = ("bucket_axes specification must be an int or a tuple with one "
+             "entry per positional argument, got {} for {} arguments.")
+      raise ValueError(msg.format(bucket_axes, len(args)))
+    if any(axis is not None and i in static_argnums
+           for i, axis in enumerate(axes)):
+      raise ValueError("jit arguments can't be both static and bucketed.")
+
+    leaves = [(leaf, axis) for arg, axis in zip(args, axes) if axis is not None
+              for leaf in tree_flatten(arg)[0]]
+    sizes = set(onp.shape(leaf)[axis] for leaf, axis in leaves)
+    if len(sizes) != 1:
+      msg = "bucketed axes must all have the same size, got sizes {}."
+      raise ValueError(msg.format(sorted(sizes)))
+    length, = sizes
+
+    # Under a transformation the shapes are fixed by the caller anyway.
+    if (_jit_is_disabled or config.read('jax_disable_jit') or
+        any(isinstance(leaf, core.Tracer) for leaf, _ in leaves)):
+      return jitted_fun(*args, length=length, **kwargs)
+
+    size = _bucket_size(length, bucket_sizes)
+    args = [arg if axis is None
+            else tree_map(partial(_pad_axis, axis, size), arg)
+            for arg, axis in zip(args, axes)]
+    out = jitted_fun(*args, length=onp.int32(length), **kwargs)
+    if out_axes is None or length == size:
+      return out
+    if isinstance(out_axes, int):
+      return tree_map(partial(_slice_axis, out_axes, length, size), out)
+    if not isinstance(out, (tuple, list)) or len(out) != len(out_axes):
+      msg = ("bucket_out_axes specification must be an int, None or a tuple "
+             "with one entry per output, got {} for output {}.")
+      raise ValueError(msg.format(out_axes, tree_structure(out)))
+    return type(out)(out_i if axis is None
+                     else tree_map(partial(_slice_axis, axis, length, size),
+                                   out_i)
+                     for out_i, axis in zip(out, out_axes))
+
+  f_bucketed._precompile = jitted_fun._precompile
+  return f_bucketed
+
+def _bucket_size(length, bucket_sizes):
+  if bucket_sizes is None:
+    return 1 << max(length - 1, 0).bit_length()
+  for size in bucket_sizes:
+    if size >= length:
+      return size
+  return length
+
+# Host arrays are padded on the host, as they are transferred anyway. Padding
+# DeviceValues and slicing the outputs are applied op-by-op on the device, so
+# those small executables are compiled once per size by the primitive cache.
+
+def _pad_axis(axis, size, x):
+  from .lax import lax  # lax imports api
+  shape = onp.shape(x)
+  if shape[axis] == size:
+    return x
+  padding_config = [(0, 0, 0)] * len(shape)
+  padding_config[axis] = (0, size - shape[axis], 0)
+  if not isinstance(x, xla.DeviceValue):
+    return onp.pad(x, [(lo, hi) for lo, hi, _ in padding_config], 'constant')
+  return lax.pad(x, lax._const(x, 0), padding_config)
+
+def _slice_axis(axis, length, size, x):
+  from .lax import lax  # lax imports api
+  shape = onp.shape(x)
+  if not -len(shape) <= axis < len(shape) or shape[axis] != size:
+    msg = ("bucket_out_axes names axis {} of an output of shape {}, which "
+           "doesn't have the bucket size {}; use None for outputs that "
+           "shouldn't be sliced.")
+    raise ValueError(msg.format(axis, shape, size))
+  return lax.slice_in_dim(x, 0, length, axis=axis % len(shape))
+
+def _execute_jitted(compiled_fun, out_tree, fun, dyn_argnums, in_tree, args,
+                    args_flat):
+  try:
+    out = compiled_fun(*args_flat)
+  except FloatingPointError:
+    exc_info = sys.exc_info()
+    if FLAGS.jax_debug_nans_localize:
+      # The fast path doesn't trace the function, so we trace it afresh here.
+      f, _ = _argnums_partial(lu.wrap_init(fun), dyn_argnums, args)
+      flat_fun, _ = flatten_fun(f, in_tree)
+      xla.localize_nans(flat_fun, args_flat)
+    six.reraise(*exc_info)
+  return tree_unflatten(out_tree, out)
+
 
 @contextmanager
 def disable_jit():
@@ -167,6 +573,45 @@ def disable_jit():
 _jit_is_disabled = False
 
 
+def clear_caches():
+  """Clear all of JAX's in-memory compilation caches.
+
+  This releases the compiled executables (and the device memory for any
+  constants embedded in them) held for `jit`, `pmap` and op-by-op primitive
+  application. Later calls recompile as needed, or hit the persistent
+  compilation cache if it is enabled.
+
+  The caches are also bounded, evicting their least recently used entries once
+  they exceed the `jax_cache_max_entries` entries or `jax_cache_max_bytes`
+  bytes of (estimated) executable size.
+  """
+  util.clear_caches()
+
+def cache_info():
+  """Statistics of JAX's in-memory compilation caches.
+
+  Returns:
+    A dict mapping cache names, like 'jax.interpreters.xla.xla_callable', to
+    dicts with the number of 'hits', 'misses' and 'evictions' since the cache
+    was created, and its current number of 'entries' and estimated 'bytes'.
+  """
+  return util.cache_info()
+
+def memory_stats():
+  """Statistics of the device memory held by live DeviceValues, per device.
+
+  Only values created while tracking is enabled, e.g. within a
+  `jax.memory.tracking()` context, are accounted for. See `jax.memory` for
+  per-value snapshots and peak tracking.
+
+  Returns:
+    A dict mapping device numbers to dicts with the number of 'live_values'
+    holding memory on the device, their 'bytes_in_use', the
+    'peak_bytes_in_use', and the 'host_bytes' of host copies they've cached.
+  """
+  return memory.stats()
+
+
 def xla_computation(fun, static_argnums=()):
   def pv_like(x):
     aval = xla.abstractify(x)
@@ -485,27 +930,87 @@ def vmap(fun, in_axes=0, out_axes=0):
 
 
 def pmap(fun, axis_name=None):
-  """Set up SPMD function for JIT compilation and parallel execution with XLA."""
+  """Set up SPMD function for JIT compilation and parallel execution with XLA.
+
+  If `axis_name` is a tuple of names, `fun` is mapped over a device mesh with
+  one axis per name, whose shape is given by the leading `len(axis_name)` axes
+  of the arguments. Collectives like `psum`, `ppermute` and `pswapaxes` can then
+  operate over any one of the mesh axes, or over a tuple of them. For example,
+  with 8 devices
+
+    pmap(f, axis_name=('data', 'model'))(np.ones((2, 4, 3)))
+
+  runs `f` on a 2x4 mesh, in which `lax.psum(x, 'model')` sums over the 4
+  devices sharing an index along 'data'.
+  """
   axis_name = _TempAxisName() if axis_name is None else axis_name
+  mesh_ndim = len(axis_name) if type(axis_name) is tuple else None
 
   @wraps(fun)
   def f_jitted(*args, **kwargs):
-    axis_size = _pmap_axis_size(args)
     f = lu.wrap_init(fun)
     args_flat, in_tree = tree_flatten((args, kwargs))
     _check_args(args_flat)
+    if mesh_ndim is None:
+      axis_size = mesh_shape = _pmap_axis_size(args)
+      mesh_params = {}
+    else:
+      mesh_shape = _pmap_mesh_shape(args, mesh_ndim)
+      axis_size = prod(mesh_shape)
+      mesh_params = {'mesh_shape': mesh_shape}
+      args_flat = map(partial(pxla.merge_mesh_axes, mesh_ndim), args_flat)
     flat_fun, out_tree = flatten_fun(f, in_tree)
-    out = pxla.xla_pmap(flat_fun, *args_flat,
-                        axis_name=axis_name, axis_size=axis_size)
-    return tree_unflatten(out_tree(), out)
+    if core.trace_stack.upward or core.trace_stack.downward:
+      out = pxla.xla_pmap(flat_fun, *args_flat, axis_name=axis_name,
+                          axis_size=axis_size, **mesh_params)
+      return _split_mesh_axes(mesh_params, tree_unflatten(out_tree(), out))
+
+    # As in jit, at the top level we can go straight to the compiled function.
+    if warmup.is_recording():
+      warmup.record_pmap(fun, axis_name, args, kwargs)
+    with core.new_sublevel():
+      compiled_fun = pxla.parallel_callable(
+          flat_fun, axis_name, mesh_shape,
+          *map(partial(pxla.abstractify, axis_size), args_flat))
+    out = tree_unflatten(out_tree(), compiled_fun(*args_flat))
+    return _split_mesh_axes(mesh_params, out)
+
+  def precompile(*args, **kwargs):
+    # See the precompile function of jit.
+    args_flat, in_tree = tree_flatten((args, kwargs))
+    global_avals = map(_lowering_aval, args_flat)
+    if mesh_ndim is None:
+      axis_size = mesh_shape = _pmap_axis_size_from_avals(global_avals)
+    else:
+      mesh_shape = _pmap_mesh_shape_from_avals(global_avals, mesh_ndim)
+      axis_size = prod(mesh_shape)
+      global_avals = [ShapedArray((axis_size,) + aval.shape[mesh_ndim:],
+                                  aval.dtype) for aval in global_avals]
+    avals = tuple(pxla._shard_aval(axis_size, aval) for aval in global_avals)
+    flat_fun, _ = flatten_fun(lu.wrap_init(fun), in_tree)
+    with core.new_sublevel():
+      built_c, pval, nrep = pxla.lower_parallel(flat_fun, axis_name, mesh_shape,
+                                                *avals)
+    def compile_():
+      compiled = pxla.compile_replicated(built_c, nrep, avals)
+      compiled_fun = pxla.parallel_compiled_callable(
+          compiled, built_c, pval, nrep, mesh_shape,
+          profiler.function_name(flat_fun))
+      return partial(pxla.parallel_callable.insert, compiled_fun, flat_fun,
+                     axis_name, mesh_shape, *avals)
+    return compile_
 
   namestr = "pmap({}, axis_name={})".format
   f_jitted.__name__ = namestr(f_jitted.__name__, axis_name)
+  f_jitted._precompile = precompile
   return f_jitted
 
 def _pmap_axis_size(args):
   leaves, _ = tree_flatten(args)
-  axis_sizes = reduce(set.union, map(_axis_size, leaves), set())
+  return _pmap_axis_size_from_avals(map(_leaf_aval, leaves))
+
+def _pmap_axis_size_from_avals(avals):
+  axis_sizes = reduce(set.union, map(_aval_axis_size, avals), set())
   if len(axis_sizes) == 0:
     raise ValueError("pmap requires a leading axis to map over.")
   if len(axis_sizes) > 1:
@@ -513,12 +1018,36 @@ def _pmap_axis_size(args):
     raise ValueError(msg.format(axis_sizes))
   return axis_sizes.pop()
 
-def _axis_size(x):
+def _pmap_mesh_shape(args, mesh_ndim):
+  leaves, _ = tree_flatten(args)
+  return _pmap_mesh_shape_from_avals(map(_leaf_aval, leaves), mesh_ndim)
+
+def _pmap_mesh_shape_from_avals(avals, mesh_ndim):
+  mesh_shapes = set()
+  for aval in avals:
+    if isinstance(aval, core.AbstractTuple):
+      raise TypeError("pmap over a device mesh doesn't support tuple arguments.")
+    if len(aval.shape) < mesh_ndim:
+      msg = "pmap over a {}-dimensional device mesh requires {} leading axes."
+      raise ValueError(msg.format(mesh_ndim, mesh_ndim))
+    mesh_shapes.add(tuple(aval.shape[:mesh_ndim]))
+  if len(mesh_shapes) == 0:
+    raise ValueError("pmap requires a leading axis to map over.")
+  if len(mesh_shapes) > 1:
+    msg = "pmap requires all arguments to have the same mesh axes, got {}."
+    raise ValueError(msg.format(mesh_shapes))
+  return mesh_shapes.pop()
+
+def _split_mesh_axes(mesh_params, out):
+  if not mesh_params:
+    return out
+  return tree_map(partial(pxla.split_mesh_axes, mesh_params['mesh_shape']), out)
+
+def _leaf_aval(x):
   if isinstance(x, core.Tracer):
-    aval = x.aval
+    return x.aval
   else:
-    aval = xla.abstractify(x)
-  return _aval_axis_size(aval)
+    return xla.abstractify(x)
 
 def _aval_axis_size(aval):
   if isinstance(aval, core.AbstractTuple):
@@ -819,6 +1348,99 @@ device_put = jit(lambda x: x)
 device_get = _jit(lambda x: x, (), device_values=False)
 
 
+def prefetch_to_device(iterator, size=2, devices=None):
+  """Transfers the elements of `iterator` to the device ahead of their use.
+
+  A background thread draws elements from `iterator` and transfers them to the
+  device, keeping up to `size` of them in flight, so that host-to-device copies
+  overlap with the computations consuming earlier elements.
+
+  For example, in a training loop:
+
+  >>> batches = prefetch_to_device(data_stream(), size=2)
+  >>> for batch in batches:
+  >>>   opt_state = update(opt_state, batch)
+
+  Args:
+    iterator: an iterator whose elements are pytrees of arrays.
+    size: the number of elements to transfer ahead of the one being consumed.
+    devices: optional, a sequence of device numbers. If given, each array leaf
+      is split along its leading axis, whose size must equal the number of
+      devices, and the ith slice is placed on `devices[i]`, as for `pmap`.
+
+  Returns:
+    An iterator over the elements of `iterator` with each array leaf replaced by
+    a DeviceArray on device 0 or, if `devices` is given, by a
+    ShardedDeviceArray. Exceptions raised by `iterator` are re-raised when the
+    element that would have followed is requested.
+  """
+  if size < 1:
+    raise ValueError("prefetch_to_device size must be positive, got {}."
+                     .format(size))
+  devices = None if devices is None else tuple(devices)
+  prefetched = six.moves.queue.Queue(maxsize=size)
+  stopped = threading.Event()
+
+  def put(item):
+    # Gives up once the consumer has gone away, so the thread can exit.
+    while not stopped.is_set():
+      try:
+        prefetched.put(item, timeout=0.1)
+        return True
+      except six.moves.queue.Full:
+        pass
+    return False
+
+  def produce():
+    try:
+      for x in iterator:
+        if not put((True, _transfer_to_device(x, devices))):
+          return
+    except BaseException:  # pylint: disable=broad-except
+      put((False, sys.exc_info()))
+    else:
+      put((False, None))
+
+  thread = threading.Thread(target=produce, name="jax-prefetch")
+  thread.daemon = True
+  thread.start()
+  return _consume_prefetched(prefetched, stopped)
+
+def _consume_prefetched(prefetched, stopped):
+  try:
+    while True:
+      has_value, value = prefetched.get()
+      if not has_value:
+        if value is not None:
+          six.reraise(*value)
+        return
+      yield value
+  finally:
+    stopped.set()
+
+def _transfer_to_device(x, devices):
+  leaves, treedef = tree_flatten(x)
+  leaves = map(xla.canonicalize_pyval_dtype, leaves)
+  avals = map(xla.abstractify, leaves)
+  if devices is None:
+    bufs = xla.device_put_many([(leaf, 0) for leaf in leaves])
+    out = [xla.DeviceArray((a.shape, a.dtype, a.ndim, prod(a.shape)), buf)
+           for a, buf in zip(avals, bufs)]
+  else:
+    for a in avals:
+      if not a.shape or a.shape[0] != len(devices):
+        msg = ("prefetch_to_device got {} devices but an array of shape {}, "
+               "whose leading axis should have one entry per device.")
+        raise ValueError(msg.format(len(devices), a.shape))
+    shards = [(leaf[i], device_num) for leaf in leaves
+              for i, device_num in enumerate(devices)]
+    bufs = xla.device_put_many(shards)
+    n = len(devices)
+    out = [pxla.ShardedDeviceArray(a, bufs[i * n:(i + 1) * n])
+           for i, a in enumerate(avals)]
+  return tree_unflatten(treedef, out)
+
+
 def _argnums_partial(f, dyn_argnums, args):
   if isinstance(dyn_argnums, int):
     dyn_argnums = (dyn_argnums,)
@@ -909,6 +1531,46 @@ def jarrett(fun):
   return new_fun
 
 
+def checkpoint(fun):
+  """Mark a function's intermediates for recomputation in reverse-mode AD.
+
+  When differentiated with `grad` or `vjp`, the returned function doesn't save
+  its intermediate values (residuals) from the forward pass. Instead they're
+  recomputed from the function's inputs when needed in the backward pass. This
+  trades extra computation for a lower peak memory, which matters most for deep
+  networks where the stored activations of every layer dominate memory use.
+
+  The result composes with `jit`, `vmap`, `grad`, and `lax.scan`, and without
+  differentiation it behaves just like `fun`.
+
+  Args:
+    fun: Function whose residuals should be recomputed rather than saved. Its
+      arguments and return value should be arrays, scalars, or (nested)
+      standard Python containers (tuple/list/dict) thereof. It's traced with
+      abstract arguments, so it can't use Python control flow on their values.
+
+  Returns:
+    A wrapped version of `fun` with the same value.
+
+  In the following example, the backward pass of `g` recomputes `sin(x)` and
+  `sin(sin(x))` instead of storing them.
+
+  >>> g = jax.checkpoint(lambda x: np.sin(np.sin(np.sin(x))))
+  >>> jax.grad(g)(2.0)
+  array(-0.18009877, dtype=float32)
+  """
+  @wraps(fun)
+  def fun_remat(*args, **kwargs):
+    args_flat, in_tree = tree_flatten((args, kwargs))
+    _check_args(args_flat)
+    flat_fun, out_tree = flatten_fun(lu.wrap_init(fun), in_tree)
+    out = pe.remat_call(flat_fun, *args_flat)
+    return tree_unflatten(out_tree(), out)
+  return fun_remat
+
+remat = checkpoint
+
+
 # This function mostly exists for making slides about JAX.
 def _make_graphviz(fun):
   """Adapts `fun` to return a graphviz dot string of its program representation.
@@ -0,0 +1,56 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Exchange of arrays with other libraries through DLPack, without copying.
+
+For example, to hand a DeviceArray to a library accepting DLPack capsules:
+
+>>> capsule = jax.dlpack.to_dlpack(x)
+>>> y = jax.dlpack.from_dlpack(other_library.to_dlpack(z))
+
+The memory is shared, so it shouldn't be modified through the other library
+while JAX may still read it. Both functions raise NotImplementedError if the
+installed jaxlib doesn't support DLPack.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as onp
+
+from .interpreters import xla
+from .lib import xla_bridge as xb
+
+
+def to_dlpack(x):
+  """Returns a DLPack capsule sharing the memory of the DeviceArray `x`."""
+  if not isinstance(x, xla.DeviceArray):
+    raise TypeError("to_dlpack expects a DeviceArray, got {}.".format(type(x)))
+  return xb.buffer_to_dlpack(x.device_buffer)
+
+def from_dlpack(capsule):
+  """Returns a DeviceArray sharing the memory of the DLPack capsule `capsule`.
+
+  The array must have a dtype that JAX supports with the current setting of the
+  jax_enable_x64 flag.
+  """
+  buf = xb.dlpack_to_buffer(capsule)
+  shape = buf.shape()
+  dtype = shape.element_type()
+  if xb.canonicalize_dtype(dtype) != str(onp.dtype(dtype)):
+    msg = ("from_dlpack got an array of dtype {}, which isn't supported unless "
+           "the jax_enable_x64 flag is set.")
+    raise TypeError(msg.format(dtype))
+  return xla.DeviceArray(xla.xla_shape_to_result_shape(shape), buf)
@@ -616,4 +616,21 @@ primitive_transposes[core.call_p] = partial(call_transpose, call_p)
 primitive_transposes[pe.compiled_call_p] = partial(call_transpose, pe.compiled_call_p)
 
 
+def remat_transpose(params, jaxpr, consts, freevar_vals, args, ct):
+  jaxpr, = jaxpr
+  assert not consts[0] and not freevar_vals[0]  # closure-converted by pe
+  if ct is zero:
+    return zero, ()
+  # Recompute the primal values the linear part of `jaxpr` depends on, then
+  # transpose only that linear part.
+  in_pvals = [pe.PartialVal((None, x)) if x is not None
+              else pe.PartialVal((aval, core.unit))
+              for x, aval in zip(args, params['in_avals'])]
+  fun = wrap_init(partial(core.eval_jaxpr, jaxpr, (), ()))
+  lin_jaxpr, _, lin_consts = pe.trace_to_jaxpr(fun, in_pvals, instantiate=True)
+  _, cts_out = backward_pass(lin_jaxpr, lin_consts, (), args, ct)
+  return cts_out, ()
+primitive_transposes[pe.remat_call_p] = remat_transpose
+
+
 tree_to_jaxtuples = partial(process_pytree, pack)
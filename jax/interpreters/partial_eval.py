@@ -21,7 +21,7 @@ from collections import namedtuple, Counter, defaultdict
 
 from .. import core
 from .. import linear_util as lu
-from ..abstract_arrays import ShapedArray, ConcreteArray
+from ..abstract_arrays import ShapedArray, ConcreteArray, raise_to_shaped
 from ..linear_util import thunk, transformation, transformation_with_aux
 from ..util import unzip2, safe_zip, safe_map, toposort, partial
 from ..core import (Trace, Tracer, new_master, Jaxpr, JaxprEqn, Literal,
@@ -104,6 +104,8 @@ class JaxprTrace(Trace):
     return JaxprTracer(self, pval, eqn)
 
   def process_call(self, call_primitive, f, tracers, params):
+    if call_primitive in call_partial_eval_rules:
+      return call_partial_eval_rules[call_primitive](self, f, tracers, params)
     if call_primitive in map_primitives:
       return self.process_map(call_primitive, f, tracers, params)
     in_pvs, in_consts = unzip2([t.pval for t in tracers])
@@ -661,3 +663,58 @@ def _split_avals(second_component, aval):
 
 
 custom_partial_eval_rules = {}
+call_partial_eval_rules = {}
+
+
+def _remat_partial_eval(trace, f, tracers, params):
+  # Unlike the generic call rule, we don't let the known part of the call save
+  # its intermediates as residuals for the unknown part. Instead we stage out
+  # the whole computation, including the parts that depend only on known
+  # inputs, so that they are recomputed when the unknown part is evaluated
+  # (e.g. in the backward pass of reverse-mode AD).
+  in_avals = [raise_to_shaped(t.aval) for t in tracers]
+  in_pvals = [PartialVal((aval, unit)) for aval in in_avals]
+  with core.new_sublevel():
+    fun = trace_to_subjaxpr(f, trace.master, True)
+    jaxpr, (out_pval, consts, env) = fun.call_wrapped(in_pvals)
+
+  # Compute the known outputs as the generic rule would, but drop the residuals.
+  # If no inputs are known there's nothing to compute, and skipping it avoids
+  # retracing nested remat calls at every level.
+  in_pvs, in_consts = unzip2([t.pval for t in tracers])
+  if all(isinstance(pv, AbstractValue) for pv in in_pvs):
+    out_pv, out_const = out_pval
+  else:
+    fun = lu.wrap_init(partial(core.eval_jaxpr, jaxpr, consts, env))
+    fun, aux = partial_eval(fun, trace, in_pvs)
+    out_const, _ = remat_call_p.bind(fun, *in_consts)
+    out_pv, _, _ = aux()
+    if out_pv is None:
+      return JaxprTracer(trace, PartialVal((None, out_const)), unit)
+
+  # Closure-convert the traced jaxpr so that the eqn below refers only to its
+  # inputs, which are all available at transpose time.
+  const_tracers = map(trace.new_instantiated_const, consts)
+  env_tracers = map(trace.full_raise, env)
+  in_tracers = map(trace.instantiate_const, tracers)
+  lifted_jaxpr = jaxpr.copy()
+  lifted_jaxpr.constvars = []
+  lifted_jaxpr.freevars = []
+  lifted_jaxpr.invars = list(it.chain(jaxpr.constvars, jaxpr.freevars,
+                                      jaxpr.invars))
+  invars = tuple(it.chain(const_tracers, env_tracers, in_tracers))
+  lifted_avals = [raise_to_shaped(t.aval)
+                  for t in it.chain(const_tracers, env_tracers)]
+  params = dict(params, in_avals=tuple(lifted_avals + in_avals))
+  eqn = JaxprEqn(invars, None, remat_call_p, ((lifted_jaxpr, (), ()),),
+                 False, False, params)
+  return JaxprTracer(trace, PartialVal((out_pv, out_const)), eqn)
+
+def _remat_call_impl(f, *args, **params):
+  return f.call_wrapped(*args)
+
+remat_call_p = Primitive('remat_call')
+remat_call = partial(core.call_bind, remat_call_p)
+remat_call_p.def_custom_bind(remat_call)
+remat_call_p.def_impl(_remat_call_impl)
+call_partial_eval_rules[remat_call_p] = _remat_partial_eval
@@ -18,6 +18,7 @@ from __future__ import print_function
 
 from collections import namedtuple
 import itertools as it
+from multiprocessing.pool import ThreadPool
 import operator as op
 
 import numpy as onp
@@ -28,11 +29,15 @@ from .. import core
 from .. import ad_util
 from .. import tree_util
 from .. import linear_util as lu
+from .. import memory
+from .. import profiler
+from ..jaxpr_passes import optimize_jaxpr
 from ..abstract_arrays import ConcreteArray, ShapedArray
-from ..util import partial, unzip2, concatenate, prod, memoize_unary
+from ..util import partial, unzip2, concatenate, prod, memoize, memoize_unary
 from ..lib import xla_bridge as xb
+from ..lib import compilation_cache
 from .xla import (xla_shape, xla_destructure, translation_rule,
-                  xla_shape_to_result_shape, jaxpr_computation)
+                  xla_shape_to_result_shape)
 from .partial_eval import trace_to_subjaxpr, merge_pvals, JaxprTrace, PartialVal
 from .batching import dimsize, broadcast
 from . import partial_eval as pe
@@ -44,7 +49,6 @@ from . import ad
 ### util
 
 
-# TODO(mattjj, phawkins): improve re-distribution not to copy to host
 def shard_arg(device_ordinals, axis_size, arg):
   """Shard an argument data array arg along its leading axis.
 
@@ -63,18 +67,67 @@ def shard_arg(device_ordinals, axis_size, arg):
   """
   nrep = len(device_ordinals)
   assignments = assign_shards_to_replicas(nrep, axis_size)
-  if (type(arg) in (ShardedDeviceArray, ShardedDeviceTuple)
-      and nrep == len(arg.device_buffers)):
-    _, ids = onp.unique(assignments, return_index=True)
-    get_shard = memoize_unary(lambda i: arg.device_buffers[i].to_py())
-    return [buf if buf.device() == device_ordinals[r]
-            else xla.device_put(get_shard(i), device_ordinals[r])
-            for r, (i, buf) in enumerate(zip(assignments, arg.device_buffers))]
+  t = type(arg)
+  if t in (ShardedDeviceArray, ShardedDeviceTuple):
+    arg._check_not_donated()
+  if (t is ShardedDeviceTuple or
+      t is ShardedDeviceArray and arg.sharded_ndim == 1):
+    return _reshard(device_ordinals, axis_size, assignments, arg)
+  elif t is xla.DeviceArray and arg.device_buffer.device() == 0:
+    shard_bufs = _split_leading_axis(arg)
+    return [shard_bufs[i] if device_num == 0
+            else xb.copy_to_device(shard_bufs[i], device_num)
+            for i, device_num in zip(assignments, device_ordinals)]
   else:
+    # slicing an ndarray produces a view, so host data is only copied once
     shards = [(_slice(arg, assignments[i]), device_ordinals[i])
               for i in range(len(assignments))]
     return xla.device_put_many(shards)
 
+def _reshard(device_ordinals, axis_size, assignments, arg):
+  """Places the shards of a sharded value on the devices for a computation.
+
+  Shards already resident on a device are reused for the replica running there,
+  regardless of how many replicas produced `arg`, and other shards are copied
+  from whichever device holds them.
+  """
+  nsrc = len(arg.device_buffers)
+  src_assignments = assign_shards_to_replicas(nsrc, axis_size)
+  shard_bufs = [{} for _ in range(axis_size)]  # shard -> device_num -> buffer
+  for i, buf in zip(src_assignments, arg.device_buffers):
+    shard_bufs[i].setdefault(buf.device(), buf)
+
+  any_buf = lambda i: next(iter(shard_bufs[i].values()))
+  get_shard = memoize_unary(lambda i: any_buf(i).to_py())
+  def place_shard(i, device_num):
+    if device_num in shard_bufs[i]:
+      return shard_bufs[i][device_num]
+    elif xb.device_copy_supported(any_buf(i)):
+      return xb.copy_to_device(any_buf(i), device_num)
+    else:
+      return xb.device_put(get_shard(i), device_num)
+
+  return [place_shard(i, device_num)
+          for i, device_num in zip(assignments, device_ordinals)]
+
+def _split_leading_axis(x):
+  """Splits a DeviceArray on device 0 into one buffer per leading-axis index."""
+  compiled = _split_leading_axis_computation(x.shape, x.dtype)
+  return compiled.Execute([x.device_buffer]).destructure()
+
+@memoize
+def _split_leading_axis_computation(shape, dtype):
+  c = xb.make_computation_builder("split_leading_axis")
+  arg_shape = xb.Shape.array_shape(dtype, shape)
+  x = c.ParameterWithShape(arg_shape)
+  rest = list(shape[1:])
+  zeros = [0] * len(rest)
+  shards = [c.Reshape(c.Slice(x, [i] + zeros, [i + 1] + rest), None, rest)
+            for i in range(shape[0])]
+  built_c = c.Build(c.Tuple(*shards))
+  return compilation_cache.compile(built_c, [arg_shape],
+                                   xb.get_compile_options())
+
 def _slice(x, i):
   """Return the ith slice of a JaxType (tuple or array)."""
   if isinstance(x, core.JaxTuple):
@@ -180,7 +233,7 @@ def replica_groups(nrep, mesh_spec, mesh_axes):
       (prod(onp.take(full_spec, mesh_axes)), -1))
   return tuple(map(tuple, groups.T))
 
-def xla_shard(c, sizes, x):
+def xla_shard(c, axis_size, x):
   """Analog of shard_arg that performs sharding within an XLA computation."""
   def _xla_shard(shape, x):
     if shape.is_tuple():
@@ -191,7 +244,7 @@ def xla_shard(c, sizes, x):
 
   def shard_array(shape, x):
     dims = list(shape.dimensions())
-    assert dims[0] == sizes[-1]
+    assert dims[0] == axis_size
     start_indices = _xla_shard_start_indices(c, dims[0], len(dims))
     return c.Reshape(c.DynamicSlice(x, start_indices, [1] + dims[1:]),
                      None, dims[1:])
@@ -226,6 +279,23 @@ def xla_unshard(c, device_groups, x):
 
 AxisEnv = namedtuple("AxisEnv", ["nreps", "names", "sizes"])
 
+def mesh_axes(axis_name, axis_size):
+  """Returns the lists of names and sizes of the axes mapped by an xla_pmap.
+
+  `axis_size` is an int, or for a device mesh a tuple of the sizes of the axes
+  named by the tuple `axis_name`. Replicas are laid out on the mesh in row-major
+  order, matching the order of the mapped (flattened) leading axis.
+  """
+  if type(axis_size) is tuple:
+    assert type(axis_name) is tuple and len(axis_name) == len(axis_size)
+    return list(axis_name), list(axis_size)
+  else:
+    return [axis_name], [axis_size]
+
+def mesh_size(axis_size):
+  """The size of the leading axis mapped by an xla_pmap over `axis_size`."""
+  return prod(axis_size) if type(axis_size) is tuple else axis_size
+
 def axis_read(axis_env, axis_name):
   return max(i for i, name in enumerate(axis_env.names) if name == axis_name)
 
@@ -236,23 +306,31 @@ def axis_groups(axis_env, name):
     mesh_axes = (axis_read(axis_env, name),)
   return replica_groups(axis_env.nreps, axis_env.sizes, mesh_axes)
 
-def compile_replicated(jaxpr, axis_name, axis_size, consts, *abstract_args):
-  num_replicas = axis_size * jaxpr_replicas(jaxpr)
-  axis_env = AxisEnv(num_replicas, [axis_name], [axis_size])
+def lower_replicated(jaxpr, axis_name, axis_size, consts, *abstract_args):
+  """Builds the replicated XLA computation for `jaxpr`.
+
+  Returns:
+    A pair of the built computation and its number of replicas.
+  """
+  names, sizes = mesh_axes(axis_name, axis_size)
+  num_replicas = prod(sizes) * jaxpr_replicas(jaxpr)
+  axis_env = AxisEnv(num_replicas, names, sizes)
   arg_shapes = list(map(xla_shape, abstract_args))
-  built_c = replicated_comp(jaxpr, axis_env, consts, (), *arg_shapes)
-  result_shape = xla_shape_to_result_shape(built_c.GetReturnValueShape())
-  compiled = built_c.Compile(arg_shapes, xb.get_compile_options(num_replicas),
-                             backend=xb.get_backend())
-  return compiled, num_replicas, result_shape
+  with profiler.phase('lower'):
+    built_c = replicated_comp(jaxpr, axis_env, consts, (), *arg_shapes)
+  profiler.annotate_hlo(built_c)
+  return built_c, num_replicas
 
-def jaxpr_replicas(jaxpr):
-  return _max(eqn.params['axis_size'] * jaxpr_replicas(eqn.bound_subjaxprs[0][0])
-              for eqn in jaxpr.eqns if eqn.primitive is xla_pmap_p)
-def _max(itr): return max(list(itr) or [1])
+def compile_replicated(built_c, num_replicas, abstract_args):
+  with profiler.phase('compile'):
+    return compilation_cache.compile(built_c, map(xla_shape, abstract_args),
+                                     xb.get_compile_options(num_replicas))
+
+jaxpr_replicas = xla.jaxpr_replicas
 
 def replicated_comp(jaxpr, ax_env, const_vals, freevar_shapes, *arg_shapes):
   assert not any(type(invar) in (tuple, list) for invar in jaxpr.invars)
+  jaxpr = optimize_jaxpr(jaxpr)
   c = xb.make_computation_builder("replicated_computation")
 
   def read(v):
@@ -265,8 +343,8 @@ def replicated_comp(jaxpr, ax_env, const_vals, freevar_shapes, *arg_shapes):
     assert node is not None
     env[v] = node
 
-  def axis_env_extend(name, size):
-    return AxisEnv(ax_env.nreps, ax_env.names + [name], ax_env.sizes + [size])
+  def axis_env_extend(names, sizes):
+    return AxisEnv(ax_env.nreps, ax_env.names + names, ax_env.sizes + sizes)
 
   env = {}
   write(core.unitvar, c.Tuple())
@@ -291,8 +369,9 @@ def replicated_comp(jaxpr, ax_env, const_vals, freevar_shapes, *arg_shapes):
     elif eqn.bound_subjaxprs:
       if eqn.primitive is xla_pmap_p:
         name, size = eqn.params['axis_name'], eqn.params['axis_size']
-        new_env = axis_env_extend(name, size)
-        in_shards = tuple(map(partial(xla_shard, c, new_env.sizes), in_nodes))
+        mesh_shape = eqn.params.get('mesh_shape', size)
+        new_env = axis_env_extend(*mesh_axes(name, mesh_shape))
+        in_shards = tuple(map(partial(xla_shard, c, size), in_nodes))
         (subjaxpr, const_bindings, freevar_bindings), = eqn.bound_subjaxprs
         subc = replicated_comp(
             subjaxpr, new_env, (),
@@ -302,9 +381,11 @@ def replicated_comp(jaxpr, ax_env, const_vals, freevar_shapes, *arg_shapes):
         sharded_result = xla.xla_call_translation_rule(c, subfun, *in_shards)
         ans = xla_unshard(c, axis_groups(new_env, name), sharded_result)
       else:
+        # subjaxprs, e.g. of a jit within a pmap or of a jit containing a pmap,
+        # share the axis environment so their collectives can refer to it
         subcs = [
-            jaxpr_computation(
-                subjaxpr, (),
+            replicated_comp(
+                subjaxpr, ax_env, (),
                 tuple(map(c.GetShape, map(read, const_bindings + freevar_bindings))),
                 *map(c.GetShape, in_nodes))
             for subjaxpr, const_bindings, freevar_bindings in eqn.bound_subjaxprs]
@@ -351,20 +432,29 @@ class ShardedDeviceTuple(xla.DeviceTuple):
     self.device_buffers = device_buffers
     self.axis_size = axis_size
     self.aval = aval
+    if memory._enabled:
+      shard_nbytes = xla.aval_nbytes(aval) // axis_size
+      memory.register(self, [(buf.device(), shard_nbytes)
+                             for buf in device_buffers])
 
   # To destructure, we destructure the constituent buffers on each device, then
   # logically concatenate those shards across devices producing one logically
   # concatenated result per element. The logical concatenation is performed with
   # the result handler logic applied to the elements.
   def __iter__(self):
+    self._check_not_donated()
     all_bufs = zip(*[buf.destructure() for buf in self.device_buffers])
     handlers = map(partial(tuple_element_handler, self.axis_size), self.aval)
-    elts = [handler(bufs) for handler, bufs in zip(handlers, all_bufs)]
+    with memory.transfer(self):
+      elts = [handler(bufs) for handler, bufs in zip(handlers, all_bufs)]
     return iter(elts)
 
   def __len__(self):
     return len(self.aval)
 
+  def block_until_ready(self):
+    return self  # replicated computations are executed synchronously
+
   def __repr__(self):
     return 'ShardedDeviceTuple(len={length})'.format(length=len(self))
 
@@ -400,27 +490,93 @@ class ShardedDeviceArray(xla.DeviceArray):
   The number of device buffers underlying a ShardedDeviceArray instance is equal
   to the number of replicas of the computation that produced it. Each buffer
   represents a shard of the original array, meaning a slice along its leading
-  axis. These component buffers reside on distinct devices, but need not
-  represent distinct logical shards. The correspondence can be computed with
-  the assign_shards_to_replicas function.
+  axis, or along its leading `sharded_ndim` axes for the result of a pmap over a
+  device mesh, in which case shards are ordered row-major. These component
+  buffers reside on distinct devices, but need not represent distinct logical
+  shards. The correspondence can be computed with the assign_shards_to_replicas
+  function.
   """
-  __slots__ = ["device_buffers"]
+  __slots__ = ["device_buffers", "sharded_ndim"]
 
-  def __init__(self, aval, device_buffers):
+  def __init__(self, aval, device_buffers, sharded_ndim=1):
     self.device_buffers = device_buffers
+    self.sharded_ndim = sharded_ndim
     self.shape, self.dtype = aval.shape, aval.dtype
     self.ndim, self.size = len(aval.shape), prod(aval.shape)
     self._npy_value = None
+    if memory._enabled:
+      shard_nbytes = (prod(aval.shape[sharded_ndim:])
+                      * onp.dtype(aval.dtype).itemsize)
+      memory.register(self, [(buf.device(), shard_nbytes)
+                             for buf in device_buffers])
+
+  def _shard_assignments(self):
+    self._check_not_donated()
+    return assign_shards_to_replicas(
+        len(self.device_buffers), prod(self.shape[:self.sharded_ndim]))
+
+  def _shard_buffers(self):
+    """Returns one device buffer for each index along the sharded axes."""
+    _, ids = onp.unique(self._shard_assignments(), return_index=True)
+    return [self.device_buffers[i] for i in ids]
+
+  def _shard(self, buf):
+    shard_shape = self.shape[self.sharded_ndim:]
+    result_shape = (shard_shape, self.dtype, len(shard_shape), prod(shard_shape))
+    # the shards share their buffers with this array, so they can't be donated
+    return xla.mark_shared_buffer(xla.DeviceArray(result_shape, buf))
+
+  @property
+  def shards(self):
+    """A list of DeviceArrays, one per index along the sharded leading axes.
+
+    Each element is backed by the device buffer already holding that shard, so
+    accessing a shard doesn't transfer data from any other device.
+    """
+    return [self._shard(buf) for buf in self._shard_buffers()]
 
   @property
   def _value(self):
     if self._npy_value is None:
-      npy_shards = [buf.to_py() for buf in self.device_buffers]
-      assignments = assign_shards_to_replicas(len(npy_shards), self.shape[0])
-      _, ids = onp.unique(assignments, return_index=True)
-      self._npy_value = onp.stack([npy_shards[i] for i in ids])
+      bufs = self._shard_buffers()
+      npy_value = onp.empty(self.shape, self.dtype)
+      flat_value = npy_value.reshape((-1,) + self.shape[self.sharded_ndim:])
+      def fetch(i):
+        flat_value[i] = bufs[i].to_py()
+      if len(bufs) > 1:
+        _get_transfer_pool().map(fetch, range(len(bufs)))
+      else:
+        fetch(0)
+      npy_value.flags.writeable = False
+      self._npy_value = npy_value
     return self._npy_value
 
+  def __getitem__(self, idx):
+    # an integer index along the leading axis only needs the buffer holding it
+    if (self.sharded_ndim == 1
+        and isinstance(idx, six.integer_types + (onp.integer,))
+        and not isinstance(idx, bool)):
+      if not -self.shape[0] <= idx < self.shape[0]:
+        raise IndexError("index {} is out of bounds for axis 0 with size {}"
+                         .format(idx, self.shape[0]))
+      replica = list(self._shard_assignments()).index(idx % self.shape[0])
+      return self._shard(self.device_buffers[replica])
+    else:
+      return super(ShardedDeviceArray, self).__getitem__(idx)
+
+  def block_until_ready(self):
+    return self  # replicated computations are executed synchronously
+
+# Device-to-host transfers of the shards of a ShardedDeviceArray are issued from
+# a thread pool so that they proceed concurrently.
+_transfer_pool = None
+
+def _get_transfer_pool():
+  global _transfer_pool
+  if _transfer_pool is None:
+    _transfer_pool = ThreadPool()
+  return _transfer_pool
+
 core.pytype_aval_mappings[ShardedDeviceArray] = ConcreteArray
 xla.pytype_aval_mappings[ShardedDeviceArray] = \
     xla.pytype_aval_mappings[xla.DeviceArray]
@@ -431,12 +587,51 @@ xb.register_constant_handler(ShardedDeviceArray,
                              xla._device_array_constant_handler)
 
 
+def merge_mesh_axes(mesh_ndim, x):
+  """Reshapes the leading `mesh_ndim` axes of `x` into one mapped axis.
+
+  A ShardedDeviceArray sharded over those axes keeps its device buffers, and
+  other device values are reshaped on the device.
+  """
+  if type(x) is ShardedDeviceArray and x.sharded_ndim == mesh_ndim:
+    aval = ShapedArray((prod(x.shape[:mesh_ndim]),) + x.shape[mesh_ndim:],
+                       x.dtype)
+    with memory.untracked():  # x still accounts for the buffers
+      return _rewrap_sharded(x, aval, 1)
+  else:
+    shape = onp.shape(x)
+    return _reshape(x, (prod(shape[:mesh_ndim]),) + shape[mesh_ndim:])
+
+def split_mesh_axes(mesh_shape, x):
+  """Inverse of `merge_mesh_axes`: reshapes the leading axis of `x` into the
+  axes of the device mesh `mesh_shape`."""
+  if (isinstance(x, core.JaxTuple) or
+      isinstance(getattr(x, 'aval', None), core.AbstractTuple)):
+    raise TypeError("pmap over a device mesh doesn't support tuple outputs.")
+  if type(x) is ShardedDeviceArray and x.sharded_ndim == 1:
+    aval = ShapedArray(tuple(mesh_shape) + x.shape[1:], x.dtype)
+    with memory.transfer(x):
+      return _rewrap_sharded(x, aval, len(mesh_shape))
+  else:
+    return _reshape(x, tuple(mesh_shape) + onp.shape(x)[1:])
+
+def _reshape(x, shape):
+  if isinstance(x, (onp.ndarray, onp.generic)):
+    return onp.reshape(x, shape)
+  from ..lax import lax  # lax imports the interpreters
+  return lax.reshape(x, shape)
+
+def _rewrap_sharded(x, aval, sharded_ndim):
+  return ShardedDeviceArray(aval, x.device_buffers, sharded_ndim)
+
+
 def xla_pmap_impl(fun, *args, **params):
   axis_name = params.pop('axis_name')
   axis_size = params.pop('axis_size')
+  mesh_shape = params.pop('mesh_shape', axis_size)
   assert not params
   abstract_args = map(partial(abstractify, axis_size), args)
-  compiled_fun = parallel_callable(fun, axis_name, axis_size, *abstract_args)
+  compiled_fun = parallel_callable(fun, axis_name, mesh_shape, *abstract_args)
   return compiled_fun(*args)
 
 def abstractify(axis_size, x):
@@ -451,20 +646,45 @@ def _shard_aval(axis_size, aval):
   else:
     raise TypeError(type(aval))
 
-@lu.memoize
+@profiler.instrument_cache('pmap', lambda fun, *_: profiler.function_name(fun))
+@partial(lu.memoize, sizeof=lambda fun: fun.nbytes)
 def parallel_callable(fun, axis_name, axis_size, *avals):
+  built_c, pval, nrep = lower_parallel(fun, axis_name, axis_size, *avals)
+  compiled = compile_replicated(built_c, nrep, avals)
+  return parallel_compiled_callable(compiled, built_c, pval, nrep, axis_size,
+                                    profiler.function_name(fun))
+
+def lower_parallel(fun, axis_name, axis_size, *avals):
+  """Traces `fun` on per-replica `avals` and builds its XLA computation.
+
+  `axis_size` is the size of the mapped axis, or a tuple of the sizes of the
+  device mesh axes named by `axis_name` (see `mesh_axes`).
+
+  Returns:
+    A triple of the built computation, the output PartialVal, and the number
+    of replicas.
+  """
   pvals = [PartialVal((aval, core.unit)) for aval in avals]
   with core.new_master(JaxprTrace, True) as master:
-    jaxpr, (pval, consts, env) = trace_to_subjaxpr(fun, master, False).call_wrapped(pvals)
+    with profiler.phase('trace'):
+      jaxpr, (pval, consts, env) = trace_to_subjaxpr(fun, master, False).call_wrapped(pvals)
     assert not env
-    out = compile_replicated(jaxpr, axis_name, axis_size, consts, *avals)
-    compiled, nrep, shard_result_shape = out
+    profiler.annotate_jaxpr(jaxpr)
+    built_c, nrep = lower_replicated(jaxpr, axis_name, axis_size, consts, *avals)
     del master, consts, jaxpr, env
+  return built_c, pval, nrep
+
+def parallel_compiled_callable(compiled, built_c, pval, nrep, axis_size,
+                               name=None):
+  shard_result_shape = xla_shape_to_result_shape(built_c.GetReturnValueShape())
+  axis_size = mesh_size(axis_size)
   handle_arg = partial(shard_arg, compiled.DeviceOrdinals(), axis_size)
   handle_replica_result = xla.result_handler(shard_result_shape)
   handle_full_result = sharded_result_handler(axis_size, merged_aval(pval))
-  return partial(execute_replicated, compiled, pval, nrep,
-                 handle_arg, handle_replica_result, handle_full_result)
+  return xla._sized(partial(execute_replicated, name, compiled, pval, nrep,
+                           handle_arg, handle_replica_result,
+                           handle_full_result),
+                    xla.computation_size(built_c))
 
 def merged_aval(pval):
   pv, const = pval
@@ -477,12 +697,15 @@ def merged_aval(pval):
   else:
     raise TypeError(type(pv))
 
-def execute_replicated(compiled, pval, nrep, handle_in,
+def execute_replicated(name, compiled, pval, nrep, handle_in,
                        handle_replica_result, handle_full_result, *args):
   input_bufs = zip(*map(handle_in, args)) if args else [[]] * nrep
   out_bufs = compiled.ExecutePerReplica(list(input_bufs))
   results = [merge_pvals(handle_replica_result(buf), pval) for buf in out_bufs]
-  return handle_full_result(results)
+  out = handle_full_result(results)
+  if memory._enabled:
+    memory.set_origin(out, ('pmap', name))
+  return out
 
 
 xla_pmap_p = core.Primitive('xla_pmap')
@@ -491,8 +714,9 @@ xla_pmap_p.def_custom_bind(xla_pmap)
 xla_pmap_p.def_impl(xla_pmap_impl)
 ad.primitive_transposes[xla_pmap_p] = partial(ad.map_transpose, xla_pmap_p)
 pe.map_primitives.add(xla_pmap_p)
-# TODO(mattjj): enable pjit inside jit, maybe by merging xla_pmap and xla_call
-# xla.translations[xla_pmap_p] = xla.xla_call_translation_rule
+# An xla_pmap within a jit is lowered by replicated_comp rather than by a
+# translation rule, as it needs the enclosing computation to be replicated (see
+# xla.lower_jaxpr).
 
 
 parallel_translation_rules = {}
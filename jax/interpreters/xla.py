@@ -18,13 +18,17 @@ from __future__ import print_function
 
 from collections import namedtuple, defaultdict
 from distutils.util import strtobool
+import functools
 import itertools as it
 import operator as op
 import os
+import sys
+import threading
+import weakref
 
 import numpy as onp
 import six
-from six.moves import xrange
+from six.moves import queue, xrange
 
 from ..config import flags
 from .. import core
@@ -35,6 +39,10 @@ from ..abstract_arrays import ConcreteArray, ShapedArray, make_shaped_array, arr
 from ..core import AbstractTuple, JaxTuple, pack, valid_jaxtype, Literal
 from ..util import partial, partialmethod, memoize, unzip2, concatenate, safe_map, prod
 from ..lib import xla_bridge as xb
+from ..lib import compilation_cache
+from .. import memory
+from .. import profiler
+from ..jaxpr_passes import optimize_jaxpr
 from . import partial_eval as pe
 from . import ad
 
@@ -45,23 +53,57 @@ flags.DEFINE_bool('jax_device_values',
 flags.DEFINE_bool('jax_debug_nans',
                   strtobool(os.getenv('JAX_DEBUG_NANS', "False")),
                   'Add nan checks to every operation.')
+flags.DEFINE_bool('jax_debug_nans_localize',
+                  strtobool(os.getenv('JAX_DEBUG_NANS_LOCALIZE', "True")),
+                  'When jax_debug_nans finds a nan in the output of a '
+                  'jit-compiled function, find the primitive that produced it '
+                  'by bisecting the function\'s equations.')
+flags.DEFINE_bool('jax_async_dispatch',
+                  strtobool(os.getenv('JAX_ASYNC_DISPATCH', "False")),
+                  'Execute computations on a background thread, returning '
+                  'values backed by pending device buffers.')
+flags.DEFINE_bool('jax_lazy_eager',
+                  strtobool(os.getenv('JAX_LAZY_EAGER', "False")),
+                  'Record primitives applied to DeviceArrays outside of jit '
+                  'and execute them as one fused computation when a result '
+                  'is needed.')
+flags.DEFINE_integer('jax_lazy_eager_max_ops',
+                     int(os.getenv('JAX_LAZY_EAGER_MAX_OPS', "256")),
+                     'Maximum number of primitives recorded in lazy eager mode '
+                     'before they are executed.')
+flags.DEFINE_integer('jax_hoist_constants_min_bytes',
+                     int(os.getenv('JAX_HOIST_CONSTANTS_MIN_BYTES',
+                                   str(2 ** 20))),
+                     'Arrays closed over by jit-compiled functions that are at '
+                     'least this large are passed to the executable as '
+                     'parameters instead of being embedded in the '
+                     'computation. Disabled if negative.')
 
 def apply_primitive(prim, *args, **kwargs):
+  if _lazy_eager_enabled():
+    out = _lazy_apply_primitive(prim, args, kwargs)
+    if out is not None:
+      return out
   abstract_args = map(abstractify, args)
   compiled_fun = xla_primitive_callable(prim, *abstract_args, **kwargs)
   return compiled_fun(*args)
 
-@memoize
+@profiler.instrument_cache('primitive', lambda prim, *_, **__: prim.name)
+@partial(memoize, sizeof=lambda fun: fun.nbytes)
 def xla_primitive_callable(prim, *abstract_args, **kwargs):
   shapes = tuple(map(xla_shape, abstract_args))
-  built_c = primitive_computation(prim, *shapes, **kwargs)
+  with profiler.phase('lower'):
+    built_c = primitive_computation(prim, *shapes, **kwargs)
+  profiler.annotate_hlo(built_c)
   result_shape = xla_shape_to_result_shape(built_c.GetReturnValueShape())
   handle_result = result_handler(result_shape)
-  compiled = built_c.Compile(shapes, xb.get_compile_options(),
-                             backend=xb.get_backend())
-  return partial(execute_compiled_primitive, prim.name, compiled, handle_result)
+  with profiler.phase('compile'):
+    compiled = compilation_cache.compile(built_c, shapes,
+                                        xb.get_compile_options())
+  return _sized(partial(execute_compiled_primitive, prim.name, compiled,
+                        built_c, handle_result), computation_size(built_c))
 
-@memoize
+@partial(memoize, sizeof=lambda built_c: computation_size(built_c))
 def primitive_computation(prim, *shapes, **kwargs):
   c = xb.make_computation_builder("primitive_computation")
   xla_args = map(c.ParameterWithShape, shapes)
@@ -73,30 +115,164 @@ def primitive_computation(prim, *shapes, **kwargs):
     prim.abstract_eval(*map(aval_from_xla_shape, shapes), **kwargs)
     raise e
 
+def computation_size(built_c):
+  """Size of the serialized HLO of `built_c`.
+
+  The compilation caches use this as an estimate of the memory held by the
+  executables compiled from `built_c`, which includes any embedded constants.
+  """
+  return len(built_c.GetSerializedProto())
+
+def _sized(fun, nbytes):
+  fun.nbytes = nbytes
+  return fun
+
 def aval_from_xla_shape(shape):
   if shape.is_tuple():
     return AbstractTuple(map(aval_from_xla_shape, shape.tuple_shapes()))
   else:
     return ShapedArray(shape.dimensions(), shape.element_type())
 
-def execute_compiled_primitive(name, compiled, result_handler, *args):
-  input_bufs = [device_put(x) for x in args]
-  out_buf = compiled.Execute(input_bufs)
-  check_nans(name, out_buf)
-  return result_handler(out_buf)
+def execute_compiled_primitive(name, compiled, built_c, result_handler, *args):
+  if FLAGS.jax_debug_nans:
+    out = result_handler(execute_checked(name, compiled, built_c, args))
+  elif _async_dispatch_enabled():
+    out = result_handler(execute_async(compiled, args))
+  else:
+    input_bufs = [device_put(x) for x in args]
+    out = result_handler(compiled.Execute(input_bufs))
+  if memory._enabled:
+    memory.set_origin(out, ('primitive', name))
+  return out
 
-def check_nans(name, buf):
-  FLAGS.jax_debug_nans and _check_nans(name, buf.shape(), buf)
 
-def _check_nans(name, xla_shape, buf):
-  if xla_shape.is_tuple():
-    _map(partial(_check_nans, name), xla_shape.tuple_shapes(), buf.destructure())
+# With jax_debug_nans enabled, computations are executed with an extra scalar
+# output that says whether any floating-point result contains a nan or inf, so
+# that only that flag, rather than every result, is copied back to the host.
+# The checked executable calls the original computation, which XLA inlines, and
+# is cached separately so that toggling the flag doesn't touch the other
+# compilation caches. Once a jit-compiled computation has produced a nan,
+# localize_nans finds the offending primitive by bisecting the equations of the
+# traced jaxpr.
+
+def execute_checked(name, compiled, built_c, args, nreps=1):
+  """Executes `compiled`, raising FloatingPointError if it produces a nan.
+
+  Args:
+    name: a description of the computation for the error message.
+    compiled: the executable built from `built_c`, run if there's nothing to
+      check.
+    built_c: the built computation.
+    args: the arguments, matching the parameters of `built_c`.
+    nreps: the number of replicas `built_c` runs on.
+
+  Returns:
+    The output buffer.
+  """
+  checked = nan_checked_executable(built_c, tuple(map(abstractify, args)),
+                                   nreps)
+  if checked is None:
+    return _execute(compiled, args, nreps)
+  out_buf, flag_buf = _execute(checked, args, nreps).destructure()
+  if flag_buf.to_py():
+    msg = "invalid value (nan or inf) encountered in {}"
+    raise FloatingPointError(msg.format(name))
+  return out_buf
+
+@memoize
+def nan_checked_executable(built_c, abstract_args, nreps=1):
+  """Compiles `built_c` to also return whether its outputs have nans or infs.
+
+  Returns:
+    An executable, replicated `nreps` times, whose output is a pair of the
+    output of `built_c` and a scalar bool, or None if `built_c` has no
+    floating-point outputs.
+  """
+  return _nan_checked_executable(built_c, abstract_args, nreps)
+
+def _nan_checked_executable(built_c, abstract_args, nreps=1):
+  c = xb.make_computation_builder("nan_checked_computation")
+  params = [c.ParameterWithShape(xla_shape(a)) for a in abstract_args]
+  out = c.Call(built_c, params)
+  flag = _any_nonfinite(c, out)
+  if flag is None:
+    return None
+  return compile_computation(c.Build(c.Tuple(out, flag)), abstract_args, nreps)
+
+def _any_nonfinite(c, x):
+  """Builds a scalar bool that's true if a floating-point array in `x` has a
+  nan or inf, or returns None if `x` has no floating-point arrays."""
+  shape = c.GetShape(x)
+  if shape.is_tuple():
+    flags = [_any_nonfinite(c, elt) for elt in xla_destructure(c, x)]
+    flags = [flag for flag in flags if flag is not None]
+    return functools.reduce(c.Or, flags) if flags else None
+  elif onp.issubdtype(shape.element_type(), onp.floating):
+    dims = tuple(range(len(shape.dimensions())))
+    return c.Reduce(c.Not(c.IsFinite(x)), c.Constant(onp.array(False)),
+                    _or_computation(), dims)
   else:
-    if onp.issubdtype(xla_shape.element_type(), onp.floating):
-      pyval = buf.to_py()
-      if onp.any(onp.isnan(pyval)):
-        msg = "invalid value (nan) encountered in {}"
-        raise FloatingPointError(msg.format(name))
+    return None
+
+def _or_computation():
+  c = xb.make_computation_builder("or")
+  scalar = xb.Shape.array_shape(onp.dtype(onp.bool_), ())
+  c.Or(c.ParameterWithShape(scalar), c.ParameterWithShape(scalar))
+  return c.Build()
+
+def localize_nans(fun, args):
+  """Raises FloatingPointError naming the primitive in `fun` producing a nan.
+
+  Traces `fun` to a jaxpr and bisects over prefixes of its equations, executing
+  each prefix with a check of all of its intermediate values, to find the
+  first equation whose output has a nan or inf on `args`. That equation may
+  produce a harmless inf that's handled later, rather than the nan in the
+  output of `fun`. The prefixes aren't memoized, as each is only executed once.
+  Only the top-level equations are searched, so e.g. a nested jit is reported as
+  an xla_call. Returns normally if no equation produces a nan or inf, for
+  example when one is passed in as an argument, or if `fun` contains an
+  xla_pmap, whose prefixes would have to be replicated.
+  """
+  # The stores of `fun` are filled in when it's first traced, so trace a copy.
+  transforms = [(gen, gen_args, None if store is None else lu.Store())
+                for gen, gen_args, store in fun.transforms]
+  fun = lu.WrappedFun(fun.f, transforms, fun.params)
+  pvals = [pe.PartialVal((abstractify(x), core.unit)) for x in args]
+  jaxpr, _, consts = pe.trace_to_jaxpr(fun, pvals)
+  jaxpr = optimize_jaxpr(jaxpr)
+  if _contains_map(jaxpr):
+    return
+  lo, hi = 0, len(jaxpr.eqns)
+  if not _prefix_has_nans(jaxpr, consts, args, hi):
+    return
+  # The first lo equations produce no nans but the first hi do.
+  while hi - lo > 1:
+    mid = (lo + hi) // 2
+    if _prefix_has_nans(jaxpr, consts, args, mid):
+      hi = mid
+    else:
+      lo = mid
+  msg = ("invalid value (nan or inf) encountered in {} (equation {} of {} in "
+         "the jit-compiled computation; this is the first equation with a nan "
+         "or inf in its output, which may not be the one causing a nan in the "
+         "result)")
+  raise FloatingPointError(msg.format(jaxpr.eqns[lo].primitive, hi,
+                                      len(jaxpr.eqns)))
+
+def _prefix_has_nans(jaxpr, consts, args, num_eqns):
+  eqns = jaxpr.eqns[:num_eqns]
+  outvar = pe.Var(0, "_nan_check")
+  outvars = [v for eqn in eqns for v in eqn.outvars]
+  pack_eqn = core.JaxprEqn(outvars, [outvar], core.pack_p, (), False, False, {})
+  prefix = core.Jaxpr(jaxpr.constvars, jaxpr.freevars, jaxpr.invars, outvar,
+                      list(eqns) + [pack_eqn])
+  abstract_args = tuple(map(abstractify, args))
+  built_c = jaxpr_computation(prefix, consts, (), *map(xla_shape, abstract_args))
+  checked = _nan_checked_executable(built_c, abstract_args)
+  if checked is None:
+    return False
+  _, flag_buf = checked.Execute([device_put(x) for x in args]).destructure()
+  return bool(flag_buf.to_py())
 
 def device_put(x, device_num=0):
   """Place a Python value `x` on device number `device_num`.
@@ -128,9 +304,7 @@ def device_put(x, device_num=0):
     if x.device_buffer.device() == device_num:
       return x.device_buffer
     else:
-      # TODO(phawkins): perform a direct device-to-device copy rather than
-      # bouncing via the host.
-      return device_put(x.device_buffer.to_py(), device_num)
+      return xb.copy_to_device(x.device_buffer, device_num)
   elif isinstance(x, DeviceConstant):
     return instantiate_device_constant(x, device_num=device_num)
   elif isinstance(x, (DeviceArray, onp.ndarray)):
@@ -166,10 +340,10 @@ def device_put_many(xs_and_devices):
     if t is DeviceArray or t is DeviceTuple:
       if x.device_buffer.device() == device_num:
         outputs[i] = x.device_buffer
+      elif xb.device_copy_supported(x.device_buffer):
+        outputs[i] = xb.copy_to_device(x.device_buffer, device_num)
       else:
         transfer_indices.append(i)
-        # TODO(phawkins): perform a direct device-to-device copy rather than
-        # bouncing via the host.
         transfers.append((x.device_buffer.to_py(), device_num))
     elif isinstance(x, DeviceConstant):
       outputs[i] = instantiate_device_constant(x, device_num=device_num)
@@ -189,6 +363,297 @@ def device_put_many(xs_and_devices):
   return outputs
 
 
+
+# With async dispatch enabled (the jax_async_dispatch flag), executing a compiled
+# computation doesn't wait for the device. Instead we enqueue the execution on a
+# single background thread and immediately return a DeviceValue backed by a
+# _PendingBuffer, so that Python can go on tracing and dispatching the next
+# computation while the device is busy. The thread runs work items in FIFO
+# order, so a computation consuming a pending buffer is executed only after the
+# computation producing it. Host values are transferred on the calling thread
+# so that later mutation of e.g. numpy arguments can't race with the transfer.
+# Reading a value back to the host, or calling block_until_ready, waits for the
+# pending buffer. Since NaN checking reads a flag computed on the device,
+# jax_debug_nans implies synchronous dispatch.
+
+def _async_dispatch_enabled():
+  return FLAGS.jax_async_dispatch and not FLAGS.jax_debug_nans
+
+class _PendingBuffer(object):
+  """A placeholder for a device buffer being computed on the dispatch thread.
+
+  Attribute access waits for the buffer and forwards to it, so a _PendingBuffer
+  can be used anywhere a device buffer is expected.
+  """
+  __slots__ = ["_ready", "_buffer", "_exc_info"]
+
+  def __init__(self):
+    self._ready = threading.Event()
+    self._buffer = None
+    self._exc_info = None
+
+  def set_result(self, buf):
+    self._buffer = buf
+    self._ready.set()
+
+  def set_exception(self, exc_info):
+    self._exc_info = exc_info
+    self._ready.set()
+
+  def result(self):
+    self._ready.wait()
+    if self._exc_info is not None:
+      six.reraise(*self._exc_info)
+    return self._buffer
+
+  def __getattr__(self, name):
+    return getattr(self.result(), name)
+
+class _Dispatcher(object):
+  """Runs work items in FIFO order on a single daemon thread."""
+
+  def __init__(self):
+    self._queue = queue.Queue()
+    self._thread = None
+    self._lock = threading.Lock()
+
+  def submit(self, fun, pending_bufs):
+    """Enqueues `fun`, whose returned sequence resolves `pending_bufs`."""
+    if self._thread is None:
+      with self._lock:
+        if self._thread is None:
+          thread = threading.Thread(target=self._run, name="jax-dispatch")
+          thread.daemon = True
+          thread.start()
+          self._thread = thread
+    self._queue.put((fun, pending_bufs))
+
+  def _run(self):
+    while True:
+      fun, pending_bufs = self._queue.get()
+      try:
+        bufs = fun()
+      except BaseException:  # pylint: disable=broad-except
+        exc_info = sys.exc_info()
+        for pending in pending_bufs:
+          pending.set_exception(exc_info)
+      else:
+        for pending, buf in zip(pending_bufs, bufs):
+          pending.set_result(buf)
+      del fun, pending_bufs
+
+_dispatcher = _Dispatcher()
+
+def execute_async(compiled, args, freed_invars=(), nreps=1):
+  """Enqueues the execution of `compiled` and returns a _PendingBuffer."""
+  if nreps > 1:
+    # Every replica needs its own copy of the arguments, so pending arguments
+    # are waited for here rather than on the dispatch thread.
+    replica_bufs = _replicate(compiled, args)
+    out_buf = _PendingBuffer()
+    _dispatcher.submit(lambda: [compiled.ExecutePerReplica(replica_bufs)[0]],
+                       [out_buf])
+    return out_buf
+  input_bufs = [x._device_buffer if _is_pending(x) else device_put(x)
+                for x in args]
+  def execute():
+    bufs = [b.result() if type(b) is _PendingBuffer else b for b in input_bufs]
+    out_buf = compiled.Execute(bufs)
+    if freed_invars:
+      _free_donated_buffers(bufs, freed_invars)
+    return [out_buf]
+  out_buf = _PendingBuffer()
+  _dispatcher.submit(execute, [out_buf])
+  return out_buf
+
+def destructure_async(pending_buf, num_elements):
+  """Returns a list of _PendingBuffers for the elements of a pending tuple."""
+  elt_bufs = [_PendingBuffer() for _ in range(num_elements)]
+  _dispatcher.submit(lambda: pending_buf.result().destructure(), elt_bufs)
+  return elt_bufs
+
+def _is_pending(x):
+  return type(getattr(x, "_device_buffer", None)) is _PendingBuffer
+
+
+# With lazy eager mode enabled (via the jax_lazy_eager flag), primitives applied
+# to DeviceArrays outside of any transformation aren't executed right away.
+# Instead they're recorded in a per-thread _LazyGraph and return DeviceArrays
+# backed by _LazyBuffers. When a buffer is needed, e.g. to read a value back to
+# the host or to pass it to a jit-compiled function, the whole graph is compiled
+# into a single XLA computation, which is cached on the graph's structure, and
+# executed. Only results still referenced by live DeviceArrays are returned from
+# that computation, so intermediates never get materialized. Graphs are also
+# flushed once they reach jax_lazy_eager_max_ops primitives. Errors from XLA are
+# raised when a value is needed, rather than by the primitive producing it.
+
+def _lazy_eager_enabled():
+  return (FLAGS.jax_lazy_eager and FLAGS.jax_device_values
+          and not FLAGS.jax_debug_nans)
+
+class _LazyBuffer(object):
+  """A placeholder for a device buffer computed when its _LazyGraph is flushed.
+
+  Attribute access flushes the graph and forwards to the buffer, so a
+  _LazyBuffer can be used anywhere a device buffer is expected.
+
+  With memory tracking enabled, `tracked` is a (weakref to the DeviceArray,
+  footprint, origin) triple to register with jax.memory once the buffer has
+  been computed, since until then it holds no device memory.
+  """
+  __slots__ = ["graph", "index", "_buffer", "tracked", "__weakref__"]
+
+  def __init__(self, graph, index):
+    self.graph = graph
+    self.index = index
+    self._buffer = None
+    self.tracked = None
+
+  def result(self):
+    if self._buffer is None:
+      self.graph.flush()
+      if self.graph.exc_info is not None:
+        six.reraise(*self.graph.exc_info)
+    return self._buffer
+
+  def __getattr__(self, name):
+    return getattr(self.result(), name)
+
+class _LazyGraph(object):
+  """A sequence of recorded primitive applications.
+
+  Equations are represented as (primitive, params, in_refs) triples, where each
+  element of in_refs is either ('in', i), referring to input i, or ('eqn', j),
+  referring to the output of equation j.
+  """
+
+  def __init__(self):
+    self.inputs = []
+    self.input_avals = []
+    self.input_ids = {}
+    self.eqns = []
+    self.outputs = []
+    self.flushed = False
+    self.exc_info = None
+    self.lock = threading.Lock()
+
+  def ref(self, x):
+    buf = getattr(x, "_device_buffer", None)
+    if type(buf) is _LazyBuffer:
+      if buf.graph is self:
+        return ('eqn', buf.index)
+      buf.result()  # flush other graphs now, so graphs never depend cyclically
+    i = self.input_ids.get(id(x))
+    if i is None:
+      i = self.input_ids[id(x)] = len(self.inputs)
+      self.inputs.append(x)
+      self.input_avals.append(abstractify(x))
+    return ('in', i)
+
+  def record(self, prim, params, args):
+    """Records an equation and returns its output, or None if flushed."""
+    with self.lock:
+      if self.flushed:
+        return None
+      in_refs = tuple(map(self.ref, args))
+      self.eqns.append((prim, params, in_refs))
+      out_buf = _LazyBuffer(self, len(self.outputs))
+      self.outputs.append(weakref.ref(out_buf))
+      return out_buf
+
+  def flush(self):
+    with self.lock:
+      if self.flushed:
+        return
+      self.flushed = True
+      live = [(i, ref()) for i, ref in enumerate(self.outputs)]
+      live = [(i, buf) for i, buf in live if buf is not None]
+      try:
+        if live:
+          out_indices, out_bufs = unzip2(live)
+          compiled = _lazy_callable(tuple(self.eqns), tuple(self.input_avals),
+                                    tuple(out_indices))
+          for out_buf, buf in zip(out_bufs, compiled(*self.inputs)):
+            out_buf._buffer = buf
+            _register_lazy_output(out_buf)
+      except BaseException:  # pylint: disable=broad-except
+        self.exc_info = sys.exc_info()
+        raise
+      finally:
+        self.inputs, self.input_avals, self.input_ids = [], [], {}
+        self.eqns, self.outputs = [], []
+
+_lazy_graphs = threading.local()
+
+def _lazy_apply_primitive(prim, args, params):
+  """Records `prim` in the current graph, or returns None if it's ineligible."""
+  if not any(isinstance(x, DeviceArray) for x in args):
+    return None
+  if not all(type(x) in array_types or isinstance(x, DeviceArray)
+             for x in args):
+    return None
+  params = tuple(sorted(params.items()))
+  try:
+    hash(params)
+  except TypeError:
+    return None
+  try:
+    translation_rule(prim)
+    out_aval = prim.abstract_eval(*map(abstractify, args), **dict(params))
+  except NotImplementedError:
+    return None
+  if type(out_aval) is not ShapedArray:
+    return None
+
+  graph = getattr(_lazy_graphs, 'current', None)
+  out_buf = graph and graph.record(prim, params, args)
+  if out_buf is None:
+    graph = _lazy_graphs.current = _LazyGraph()
+    out_buf = graph.record(prim, params, args)
+  shape, dtype = out_aval.shape, xb.canonicalize_dtype(out_aval.dtype)
+  with memory.untracked():  # registered once it's computed
+    out = DeviceArray((shape, dtype, len(shape), prod(shape)), out_buf)
+  if memory._enabled:
+    footprint = [(0, prod(shape) * onp.dtype(dtype).itemsize)]
+    out_buf.tracked = (weakref.ref(out), footprint, ('primitive', prim.name))
+  if len(graph.eqns) >= FLAGS.jax_lazy_eager_max_ops:
+    graph.flush()
+  return out
+
+def _register_lazy_output(out_buf):
+  if out_buf.tracked is not None:
+    ref, footprint, origin = out_buf.tracked
+    out = ref()
+    if out is not None:
+      memory.register(out, footprint)
+      memory.set_origin(out, origin)
+
+@profiler.instrument_cache('primitive', lambda *_: 'lazy_eager_computation')
+@partial(memoize, sizeof=lambda fun: fun.nbytes)
+def _lazy_callable(eqns, input_avals, out_indices):
+  with profiler.phase('lower'):
+    c = xb.make_computation_builder("lazy_eager_computation")
+    inputs = [c.ParameterWithShape(xla_shape(aval)) for aval in input_avals]
+    outs = []
+    for prim, params, in_refs in eqns:
+      operands = [inputs[i] if kind == 'in' else outs[i] for kind, i in in_refs]
+      outs.append(translation_rule(prim)(c, *operands, **dict(params)))
+    built_c = c.Build(c.Tuple(*[outs[i] for i in out_indices]))
+  profiler.annotate(num_eqns=len(eqns))
+  profiler.annotate_hlo(built_c)
+  with profiler.phase('compile'):
+    compiled = compilation_cache.compile(built_c, map(xla_shape, input_avals),
+                                        xb.get_compile_options())
+  return _sized(partial(_execute_lazy, compiled, len(out_indices)),
+                computation_size(built_c))
+
+def _execute_lazy(compiled, num_outputs, *args):
+  if _async_dispatch_enabled():
+    return destructure_async(execute_async(compiled, args), num_outputs)
+  input_bufs = [device_put(x) for x in args]
+  return compiled.Execute(input_bufs).destructure()
+
+
 # When we execute an XLA computation, we get a raw device buffer back and need
 # to package it into a suitable Python object to return to the user. To avoid
 # unnecessary device-to-host transfers, we typically return a DeviceValue that
@@ -244,12 +709,64 @@ def pyval_result_handler(result_shape):
     raise TypeError(t)
 
 
-def compile_jaxpr(jaxpr, const_vals, *abstract_args):
+def lower_jaxpr(jaxpr, const_vals, donated_invars, *abstract_args):
+  """Builds the XLA computation for `jaxpr`, aliasing donated arguments.
+
+  A jaxpr containing an xla_pmap is built into a computation replicated over the
+  devices it maps over (see jaxpr_replicas), in which everything outside the
+  xla_pmap runs redundantly on every replica. Every call then copies each
+  argument to every replica's device: device_put_many reuses a DeviceArray's
+  buffer on its own device and copies it to the others, but host values are
+  transferred once per replica. Donated arguments aren't aliased in that case.
+
+  Returns:
+    A triple of the built computation, a tuple of bools marking which donated
+    arguments could be aliased to an output, and the number of replicas.
+  """
   arg_shapes = list(map(xla_shape, abstract_args))
-  built_c = jaxpr_computation(jaxpr, const_vals, (), *arg_shapes)
-  result_shape = xla_shape_to_result_shape(built_c.GetReturnValueShape())
-  return built_c.Compile(arg_shapes, xb.get_compile_options(),
-                         backend=xb.get_backend()), result_shape
+  nreps = jaxpr_replicas(jaxpr)
+  with profiler.phase('lower'):
+    if _contains_map(jaxpr):
+      from . import pxla  # pxla depends on this module
+      built_c = pxla.replicated_comp(jaxpr, pxla.AxisEnv(nreps, [], []),
+                                     const_vals, (), *arg_shapes)
+      aliased_invars = (False,) * len(donated_invars)
+    else:
+      c, out = jaxpr_computation_builder(jaxpr, const_vals, (), *arg_shapes)
+      if any(donated_invars):
+        aliased_invars = set_up_aliases(c, c.GetShape(out), arg_shapes,
+                                        donated_invars)
+      else:
+        aliased_invars = donated_invars
+      built_c = c.Build(out)
+  profiler.annotate_hlo(built_c)
+  return built_c, aliased_invars, nreps
+
+def jaxpr_replicas(jaxpr):
+  """The number of replicas a computation built from `jaxpr` runs on.
+
+  That's the product of the sizes of the nested map primitives (i.e. xla_pmap)
+  in `jaxpr`, including those within its subjaxprs, or 1 if it has none.
+  """
+  return max([1] + [_eqn_replicas(eqn) for eqn in jaxpr.eqns])
+
+def _contains_map(jaxpr):
+  return any(eqn.primitive in pe.map_primitives or
+             any(_contains_map(sub) for sub, _, _ in eqn.bound_subjaxprs)
+             for eqn in jaxpr.eqns)
+
+def _eqn_replicas(eqn):
+  nreps = max([1] + [jaxpr_replicas(subjaxpr)
+                     for subjaxpr, _, _ in eqn.bound_subjaxprs])
+  if eqn.primitive in pe.map_primitives:
+    return eqn.params['axis_size'] * nreps
+  else:
+    return nreps
+
+def compile_computation(built_c, abstract_args, nreps=1):
+  with profiler.phase('compile'):
+    return compilation_cache.compile(built_c, map(xla_shape, abstract_args),
+                                     xb.get_compile_options(nreps))
 
 def build_jaxpr(jaxpr, const_vals, *abstract_args):
   arg_shapes = list(map(xla_shape, abstract_args))
@@ -257,7 +774,13 @@ def build_jaxpr(jaxpr, const_vals, *abstract_args):
   return built_c
 
 def jaxpr_computation(jaxpr, const_vals, freevar_shapes, *arg_shapes):
+  c, out = jaxpr_computation_builder(jaxpr, const_vals, freevar_shapes,
+                                     *arg_shapes)
+  return c.Build(out)
+
+def jaxpr_computation_builder(jaxpr, const_vals, freevar_shapes, *arg_shapes):
   assert not any(type(invar) in (tuple, list) for invar in jaxpr.invars)
+  jaxpr = optimize_jaxpr(jaxpr)
   c = xb.make_computation_builder("jaxpr_computation")
 
   def read(v):
@@ -299,11 +822,51 @@ def jaxpr_computation(jaxpr, const_vals, freevar_shapes, *arg_shapes):
     c.GetShape(ans)  # force xla to do shape error checking
     out_nodes = xla_destructure(c, ans) if eqn.destructure else [ans]
     _map(write, eqn.outvars, out_nodes)
-  return c.Build(read(jaxpr.outvar))
+  return c, read(jaxpr.outvar)
 
 def _map(f, *xs):
   return tuple(map(f, *xs))
 
+def set_up_aliases(c, out_shape, arg_shapes, donated_invars):
+  """Lets XLA write outputs into the buffers of donated parameters.
+
+  Each array in a donated parameter is aliased to the first output array not
+  already aliased that has the same shape and dtype.
+
+  Returns:
+    A tuple of bools, one per parameter, indicating which parameters had some
+    part aliased to an output.
+  """
+  if not hasattr(c, "SetUpAlias"):
+    return (False,) * len(arg_shapes)  # not supported by this jaxlib
+  unused_outputs = defaultdict(list)
+  for output_index, shape in _array_subshapes(out_shape):
+    unused_outputs[_shape_key(shape)].append(output_index)
+  aliased_invars = []
+  for param_number, (shape, donated) in enumerate(zip(arg_shapes,
+                                                      donated_invars)):
+    aliased = False
+    if donated:
+      for param_index, subshape in _array_subshapes(shape):
+        outputs = unused_outputs.get(_shape_key(subshape))
+        if outputs:
+          c.SetUpAlias(outputs.pop(0), param_number, param_index)
+          aliased = True
+    aliased_invars.append(aliased)
+  return tuple(aliased_invars)
+
+def _array_subshapes(shape, index=()):
+  """Yields (index, shape) pairs for the array subshapes of an XLA shape."""
+  if shape.is_tuple():
+    for i, subshape in enumerate(shape.tuple_shapes()):
+      for pair in _array_subshapes(subshape, index + (i,)):
+        yield pair
+  else:
+    yield list(index), shape
+
+def _shape_key(shape):
+  return shape.element_type(), tuple(shape.dimensions())
+
 def xla_destructure(c, ans):
   num_elements = len(c.GetShape(ans).tuple_shapes())
   return [c.GetTupleElement(ans, i) for i in range(num_elements)]
@@ -405,10 +968,53 @@ for t in array_types:
 
 class DeviceValue(object):
   """A DeviceValue represents a value backed by device memory."""
-  __slots__ = ["device_buffer"]
+  __slots__ = ["_device_buffer", "__weakref__"]
   def __init__(self, device_buffer):
     self.device_buffer = device_buffer
 
+  @property
+  def device_buffer(self):
+    buf = self._device_buffer
+    if type(buf) is _LazyBuffer:
+      buf = self._device_buffer = buf.result()
+    if type(buf) is _PendingBuffer:
+      buf = self._device_buffer = buf.result()
+    elif buf is _donated_buffer:
+      self._check_not_donated()
+    return buf
+
+  def _check_not_donated(self):
+    if getattr(self, "_device_buffer", None) is _donated_buffer:
+      msg = ("{} was donated to a jit-compiled computation and can't be used "
+             "anymore.")
+      raise RuntimeError(msg.format(type(self).__name__))
+
+  @device_buffer.setter
+  def device_buffer(self, buf):
+    self._device_buffer = buf
+
+  def block_until_ready(self):
+    """Waits for the computation producing this value, then returns it.
+
+    Only has an effect with asynchronous dispatch (the jax_async_dispatch flag),
+    in which case it's useful for timing and for surfacing errors promptly.
+    """
+    self.device_buffer  # waits on a pending buffer
+    return self
+
+def _buffer_device(buf):
+  # Pending and lazy buffers are computed on device 0, and asking them for their
+  # device would wait for them.
+  if type(buf) is _PendingBuffer or type(buf) is _LazyBuffer:
+    return 0
+  return buf.device()
+
+def aval_nbytes(aval):
+  """The number of bytes of the arrays of an abstract array or tuple."""
+  if type(aval) is AbstractTuple:
+    return sum(map(aval_nbytes, aval))
+  return prod(aval.shape) * onp.dtype(aval.dtype).itemsize
+
 class DeviceTuple(DeviceValue):
   """A DeviceTuple is a JaxTuple backed by a single device memory buffer."""
   __slots__ = ["aval", "result_shapes"]
@@ -416,11 +1022,19 @@ class DeviceTuple(DeviceValue):
   def __init__(self, result_shape, device_buffer):
     self.device_buffer = device_buffer
     self.aval, self.result_shapes = result_shape
+    if memory._enabled:
+      memory.register(self, [(_buffer_device(device_buffer),
+                              aval_nbytes(self.aval))])
 
   def __iter__(self):
-    bufs = self.device_buffer.destructure()
+    buf = self._device_buffer
+    if type(buf) is _PendingBuffer:
+      bufs = destructure_async(buf, len(self))
+    else:
+      bufs = buf.destructure()
     handlers = map(device_persistent_result_handler, self.result_shapes)
-    elts = [handler(buf) for handler, buf in zip(handlers, bufs)]
+    with memory.transfer(self):
+      elts = [handler(buf) for handler, buf in zip(handlers, bufs)]
     return iter(elts)
 
   def __len__(self):
@@ -464,15 +1078,26 @@ class DeviceArray(DeviceValue):
     self.device_buffer = device_buffer
     self.shape, self.dtype, self.ndim, self.size = result_shape
     self._npy_value = None
+    if memory._enabled:
+      memory.register(self, [(_buffer_device(device_buffer),
+                              self.size * onp.dtype(self.dtype).itemsize)])
 
-  # TODO make device_buffer a property, make the _npy_value writeable, invalidate
+  # TODO make the _npy_value writeable, invalidate
   @property
   def _value(self):
     if self._npy_value is None:
-      self._npy_value = self.device_buffer.to_py()
-      self._npy_value.flags.writeable = False
+      buf = self.device_buffer
+      npy_value = xb.host_view(buf)  # zero-copy on the CPU backend
+      if npy_value is None:
+        npy_value = buf.to_py()
+        npy_value.flags.writeable = False
+      self._npy_value = npy_value
     return self._npy_value
 
+  @property
+  def __array_interface__(self):
+    return self._value.__array_interface__
+
   def copy(self):
     """Returns an ndarray (backed by host memory, not device memory)."""
     return onp.asarray(self)
@@ -561,6 +1186,9 @@ class DeviceConstant(DeviceArray):
   def constant_handler(c, constant_instance, canonicalize_types=True):
     assert False
 
+  def block_until_ready(self):
+    return self  # instantiated lazily, so there's nothing to wait for
+
 def instantiate_device_constant(const, cutoff=1e6, device_num=0):
   # dispatch an XLA Computation to build the constant on the device if it's
   # large, or alternatively build it on the host and transfer it if it's small
@@ -588,34 +1216,221 @@ def xla_shape(x):
 
 def xla_call_impl(fun, *args, **params):
   device_values = FLAGS.jax_device_values and params.pop('device_values')
-  compiled_fun = xla_callable(fun, device_values, *map(abstractify, args))
+  compiled_fun = xla_callable(fun, device_values, (), *map(abstractify, args))
   try:
     return compiled_fun(*args)
   except FloatingPointError:
-    print("Invalid value encountered in the output of a jit function. "
-          "Calling the de-optimized version.")
-    return fun.call_wrapped(*args)  # probably won't return
+    exc_info = sys.exc_info()
+    if FLAGS.jax_debug_nans_localize:
+      localize_nans(fun, args)
+    six.reraise(*exc_info)
+
+
+@profiler.instrument_cache('jit', lambda fun, *_: profiler.function_name(fun))
+@partial(lu.memoize, sizeof=lambda fun: fun.nbytes)
+def xla_callable(fun, device_values, donated_invars, *abstract_args):
+  built_c, pval, aliased_invars, hoisted, nreps = lower_callable(
+      fun, donated_invars, *abstract_args)
+  compiled = compile_computation(
+      built_c, abstract_args + tuple(map(abstractify, hoisted)), nreps)
+  return compiled_callable(compiled, built_c, pval, device_values,
+                           donated_invars, aliased_invars, hoisted,
+                           profiler.function_name(fun), nreps)
+
+def lower_callable(fun, donated_invars, *abstract_args):
+  """Traces `fun` on `abstract_args` and builds its XLA computation.
 
-
-@lu.memoize
-def xla_callable(fun, device_values, *abstract_args):
+  Returns:
+    A tuple of the built computation, the output PartialVal to merge with the
+    computation's results, the aliased donated arguments (see lower_jaxpr), the
+    hoisted constants to pass as extra trailing arguments (see hoist_consts),
+    and the number of replicas the computation runs on.
+  """
   pvals = [pe.PartialVal((aval, core.unit)) for aval in abstract_args]
   with core.new_master(pe.JaxprTrace, True) as master:
-    jaxpr, (pval, consts, env) = pe.trace_to_subjaxpr(fun, master, False).call_wrapped(pvals)
+    with profiler.phase('trace'):
+      jaxpr, (pval, consts, env) = pe.trace_to_subjaxpr(fun, master, False).call_wrapped(pvals)
     assert not env  # no subtraces here (though cond might eventually need them)
-    compiled, result_shape = compile_jaxpr(jaxpr, consts, *abstract_args)
+    profiler.annotate_jaxpr(jaxpr)
+    jaxpr, consts, hoisted = hoist_consts(jaxpr, consts)
+    built_c, aliased_invars, nreps = lower_jaxpr(
+        jaxpr, consts, donated_invars,
+        *(tuple(abstract_args) + tuple(map(abstractify, hoisted))))
     del master, consts, jaxpr, env
+  return built_c, pval, aliased_invars, hoisted, nreps
+
+def hoist_consts(jaxpr, consts):
+  """Turns the large array constants of `jaxpr` into trailing parameters.
+
+  Constants embedded in a computation are copied into the HLO, which makes it
+  slow to build, compile and cache. Those of at least
+  jax_hoist_constants_min_bytes bytes are instead placed on device once and
+  passed to the executable on every call. Smaller ones are left in the
+  computation, where XLA can constant-fold them.
+
+  Returns:
+    A triple of the new jaxpr, its remaining constants, and a tuple of
+    DeviceArrays for the hoisted constants, which the jaxpr takes as extra
+    invars after its original ones.
+  """
+  min_bytes = FLAGS.jax_hoist_constants_min_bytes
+  hoist = [min_bytes >= 0 and _is_hoistable(x, min_bytes) for x in consts]
+  if not any(hoist):
+    return jaxpr, consts, ()
+  kept = [(v, x) for v, x, h in zip(jaxpr.constvars, consts, hoist) if not h]
+  hoisted = [(v, x) for v, x, h in zip(jaxpr.constvars, consts, hoist) if h]
+  kept_vars, kept_consts = unzip2(kept) if kept else ((), ())
+  hoisted_vars, hoisted_consts = unzip2(hoisted)
+  jaxpr = core.Jaxpr(list(kept_vars), jaxpr.freevars,
+                     list(jaxpr.invars) + list(hoisted_vars), jaxpr.outvar,
+                     jaxpr.eqns)
+  return jaxpr, list(kept_consts), tuple(map(_device_resident, hoisted_consts))
+
+def _is_hoistable(x, min_bytes):
+  # DeviceConstants and Python scalars are cheap to embed, so aren't hoisted.
+  return ((type(x) is DeviceArray or type(x) is onp.ndarray) and
+          prod(x.shape) * onp.dtype(x.dtype).itemsize >= max(min_bytes, 1))
+
+def _device_resident(x):
+  if type(x) is DeviceArray:
+    return x
+  aval = abstractify(x)
+  return DeviceArray((aval.shape, aval.dtype, len(aval.shape), prod(aval.shape)),
+                     device_put(x))
+
+def compiled_callable(compiled, built_c, pval, device_values, donated_invars,
+                      aliased_invars, hoisted=(), name=None, nreps=1):
+  result_shape = xla_shape_to_result_shape(built_c.GetReturnValueShape())
   if device_values:
     handle_result = device_persistent_result_handler(result_shape)
   else:
     handle_result = pyval_result_handler(result_shape)
-  return partial(execute_compiled, compiled, pval, handle_result)
-
-def execute_compiled(compiled, pval, handle_result, *args):
-  input_bufs = [device_put(x) for x in args]
-  out_buf = compiled.Execute(input_bufs)
-  check_nans("jit-compiled computation", out_buf)
-  return pe.merge_pvals(handle_result(out_buf), pval)
+  # Donated buffers that XLA didn't alias to an output can be freed right away.
+  freed_invars = tuple(donated and not aliased for donated, aliased
+                       in zip(donated_invars, aliased_invars))
+  if donated_invars and hoisted:
+    donated_invars = donated_invars + (False,) * len(hoisted)
+    freed_invars = freed_invars + (False,) * len(hoisted)
+  fun = partial(execute_compiled, name, compiled, built_c, pval, handle_result,
+                donated_invars, freed_invars, nreps)
+  nbytes = computation_size(built_c)
+  if hoisted:
+    fun = partial(_execute_with_consts, fun, hoisted)
+    nbytes += sum(prod(x.shape) * x.dtype.itemsize for x in hoisted)
+  return _sized(fun, nbytes)
+
+def _execute_with_consts(fun, consts, *args):
+  return fun(*(args + consts))
+
+def execute_compiled(name, compiled, built_c, pval, handle_result,
+                     donated_invars, freed_invars, nreps, *args):
+  if donated_invars:
+    _check_donated_args(args, donated_invars)
+    in_args = _copy_host_aliased_args(args, donated_invars)
+  else:
+    in_args = args
+  if FLAGS.jax_debug_nans:
+    # The checked executable doesn't alias donated buffers, so they're dropped
+    # when the donated arguments are invalidated rather than freed here.
+    out_buf = execute_checked("jit-compiled computation", compiled, built_c,
+                              in_args, nreps)
+  elif _async_dispatch_enabled():
+    out_buf = execute_async(compiled, in_args, freed_invars, nreps)
+  elif nreps > 1:
+    # Donated arguments aren't aliased in replicated computations, so there's
+    # nothing to free.
+    out_buf = _execute(compiled, in_args, nreps)
+  else:
+    input_bufs = [device_put(x) for x in in_args]
+    out_buf = compiled.Execute(input_bufs)
+    if donated_invars:
+      _free_donated_buffers(input_bufs, freed_invars)
+  if donated_invars:
+    _invalidate_donated_args(args, donated_invars)
+  out = handle_result(out_buf)
+  if memory._enabled:
+    memory.set_origin(out, ('jit', name))
+  return pe.merge_pvals(out, pval)
+
+def _execute(compiled, args, nreps):
+  if nreps > 1:
+    return compiled.ExecutePerReplica(_replicate(compiled, args))[0]
+  return compiled.Execute([device_put(x) for x in args])
+
+def _replicate(compiled, args):
+  """Returns the input buffers of each replica of `compiled`, one per argument.
+
+  A computation containing an xla_pmap runs everything outside of it
+  redundantly on every replica, so each replica gets all of the arguments and,
+  as xla_pmap gathers its results onto all the replicas it maps over, computes
+  the same result. Only that of the first replica is used.
+  """
+  device_ordinals = compiled.DeviceOrdinals()
+  bufs = device_put_many([(x, device_num) for device_num in device_ordinals
+                          for x in args])
+  nargs = len(args)
+  return [bufs[i * nargs:(i + 1) * nargs] for i in range(len(device_ordinals))]
+
+
+# Arguments donated to a computation (see the donate_argnums option of jit) give
+# up their device buffers, which XLA may reuse for outputs of the same shape and
+# dtype. The DeviceValues passed as donated arguments are invalidated, so that
+# using them again raises an error rather than reading clobbered memory.
+
+def _check_donated_args(args, donated_invars):
+  donated = [x for x, d in zip(args, donated_invars)
+             if d and isinstance(x, DeviceValue)]
+  donated_ids = set(map(id, donated))
+  if (len(donated_ids) < len(donated) or
+      any(id(x) in donated_ids for x, d in zip(args, donated_invars) if not d)):
+    raise ValueError("A donated argument can't also be passed as another "
+                     "argument to the same computation.")
+  if any(map(_shares_buffer, donated)):
+    raise ValueError("A DeviceArray that shares its device buffer with another "
+                     "value, like a shard of a ShardedDeviceArray, can't be "
+                     "donated.")
+
+# DeviceArrays that share their device buffer with another live value, like the
+# shards of a ShardedDeviceArray, by id. Donating one would free the buffer
+# under the other value.
+_shared_buffer_values = {}
+
+def mark_shared_buffer(x):
+  key = id(x)
+  _shared_buffer_values[key] = weakref.ref(
+      x, lambda _: _shared_buffer_values.pop(key, None))
+  return x
+
+def _shares_buffer(x):
+  ref = _shared_buffer_values.get(id(x))
+  return ref is not None and ref() is x
+
+def _copy_host_aliased_args(args, donated_invars):
+  # On the CPU backend a donated buffer may share memory with a numpy array, a
+  # host view of a DeviceArray or an array placed without copying, that would
+  # see the computation's outputs written into it. Such arguments are copied.
+  return tuple(onp.array(x) if donated and _aliases_host_array(x) else x
+               for x, donated in zip(args, donated_invars))
+
+def _aliases_host_array(x):
+  if type(x) is DeviceArray:
+    return xb.is_host_view(x._npy_value)
+  return xb.may_alias_host_array(x)
+
+def _free_donated_buffers(input_bufs, freed_invars):
+  for buf, freed in zip(input_bufs, freed_invars):
+    if freed and hasattr(buf, "delete"):
+      buf.delete()
+
+def _invalidate_donated_args(args, donated_invars):
+  for x, donated in zip(args, donated_invars):
+    if donated and isinstance(x, DeviceValue):
+      memory.unregister(x)
+      x._device_buffer = _donated_buffer
+      if isinstance(x, DeviceArray):
+        x._npy_value = None
+
+_donated_buffer = object()
 
 
 def xla_call_translation_rule(c, subc_a1, *a2, **params):
@@ -628,4 +1443,5 @@ xla_call_p.def_custom_bind(xla_call)
 xla_call_p.def_impl(xla_call_impl)
 
 translations[xla_call_p] = xla_call_translation_rule
+translations[pe.remat_call_p] = xla_call_translation_rule
 ad.primitive_transposes[xla_call_p] = partial(ad.call_transpose, xla_call_p)
@@ -0,0 +1,226 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Simplification passes over jaxprs.
+
+Jaxprs produced by tracing, and especially by linearization and batching,
+contain pack/unpack pairs of tuples, duplicate subexpressions, and dead
+equations. `optimize_jaxpr` removes them before a jaxpr is lowered to XLA, by
+running each pass in `default_passes`. Jaxprs transposed by eager `grad` calls
+aren't optimized, since that would add Python overhead to every call rather
+than once per compilation:
+
+  - `eliminate_tuples`: unpacking a freshly packed tuple, or repacking all the
+    elements of an unpacked tuple, is replaced by the original values,
+  - `fold_literals`: equations whose operands are all literals are evaluated,
+    for primitives with a rule in `folding_rules`,
+  - `eliminate_common_subexpressions`: equations applying the same primitive
+    with the same parameters to the same operands are merged,
+  - `eliminate_dead_code`: equations whose outputs aren't used are removed.
+
+The passes never change a jaxpr's constvars, freevars or invars, and return new
+jaxprs rather than modifying their input.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from distutils.util import strtobool
+
+import numpy as onp
+
+from .core import Literal, Jaxpr, pack_p, identity_p
+from .config import flags
+from .lib import xla_bridge as xb
+
+FLAGS = flags.FLAGS
+flags.DEFINE_bool('jax_optimize_jaxprs',
+                  strtobool(os.getenv('JAX_OPTIMIZE_JAXPRS', "True")),
+                  'Simplify jaxprs before lowering them to XLA.')
+
+# Maps primitives to functions evaluating them on (canonicalized) numpy scalars,
+# for primitives without parameters.
+folding_rules = {}
+
+
+def optimize_jaxpr(jaxpr, passes=None):
+  """Simplify `jaxpr` with `passes`, if the jax_optimize_jaxprs flag is set.
+
+  Args:
+    jaxpr: a `core.Jaxpr`.
+    passes: optional sequence of functions from jaxprs to jaxprs, applied in
+      order. Defaults to `default_passes`. If given, the passes are applied
+      regardless of the flag.
+  """
+  if passes is None:
+    if not FLAGS.jax_optimize_jaxprs:
+      return jaxpr
+    passes = default_passes
+  for pass_ in passes:
+    jaxpr = pass_(jaxpr)
+  return jaxpr
+
+
+def eliminate_tuples(jaxpr):
+  env = {}
+  eqns = []
+  packed = {}    # outvar of a pack -> its operands
+  unpacked = {}  # outvar of an unpack -> (tuple var, index, number of elements)
+  for eqn in jaxpr.eqns:
+    eqn = _substitute(eqn, env)
+    if _is_simple(eqn) and eqn.primitive is identity_p:
+      invar, = eqn.invars
+      if not eqn.destructure and type(invar) is not Literal:
+        env[eqn.outvars[0]] = invar
+        continue
+      elif (eqn.destructure and type(invar) is not Literal
+            and invar in packed):
+        elts = packed[invar]
+        if len(elts) == len(eqn.outvars):
+          env.update(zip(eqn.outvars, elts))
+          continue
+      if eqn.destructure and type(invar) is not Literal:
+        n = len(eqn.outvars)
+        unpacked.update((v, (invar, i, n)) for i, v in enumerate(eqn.outvars))
+    elif _is_simple(eqn) and eqn.primitive is pack_p:
+      if all(type(v) is not Literal for v in eqn.invars):
+        sources = [unpacked.get(v) for v in eqn.invars]
+        if (sources and None not in sources and
+            sources == [(sources[0][0], i, len(sources))
+                        for i in range(len(sources))]):
+          env[eqn.outvars[0]] = sources[0][0]
+          continue
+        packed[eqn.outvars[0]] = tuple(eqn.invars)
+    eqns.append(eqn)
+  return _replace_eqns(jaxpr, eqns, env)
+
+def fold_literals(jaxpr):
+  # Literals can only replace variables used as operands of other equations.
+  restricted = _restricted_uses(jaxpr)
+  env = {}
+  eqns = []
+  for eqn in jaxpr.eqns:
+    eqn = _substitute(eqn, env)
+    rule = folding_rules.get(eqn.primitive)
+    if (rule and _is_simple(eqn) and not eqn.destructure and not eqn.params
+        and all(type(v) is Literal for v in eqn.invars)
+        and eqn.outvars[0] not in restricted):
+      ans = rule(*[_canonicalize(v.val) for v in eqn.invars])
+      if onp.ndim(ans) == 0:
+        env[eqn.outvars[0]] = Literal(ans)
+        continue
+    eqns.append(eqn)
+  return _replace_eqns(jaxpr, eqns, env)
+
+def eliminate_common_subexpressions(jaxpr):
+  env = {}
+  eqns = []
+  seen = {}
+  for eqn in jaxpr.eqns:
+    eqn = _substitute(eqn, env)
+    if not eqn.bound_subjaxprs:
+      try:
+        key = (eqn.primitive, tuple(map(_operand_key, eqn.invars)),
+               eqn.restructure, eqn.destructure, len(eqn.outvars),
+               tuple(sorted(eqn.params.items())))
+        prev = seen.get(key)
+      except TypeError:  # unhashable literals or parameters
+        pass
+      else:
+        if prev is not None:
+          env.update(zip(eqn.outvars, prev.outvars))
+          continue
+        seen[key] = eqn
+    eqns.append(eqn)
+  return _replace_eqns(jaxpr, eqns, env)
+
+def eliminate_dead_code(jaxpr):
+  live = set(_vars([jaxpr.outvar]))
+  eqns = []
+  for eqn in jaxpr.eqns[::-1]:
+    if any(v in live for v in eqn.outvars):
+      eqns.append(eqn)
+      live.update(_eqn_operands(eqn))
+  return _replace_eqns(jaxpr, eqns[::-1], {})
+
+default_passes = (eliminate_tuples, fold_literals,
+                  eliminate_common_subexpressions, eliminate_dead_code)
+
+
+def _is_simple(eqn):
+  return not eqn.bound_subjaxprs and not eqn.restructure
+
+def _vars(xs):
+  for x in xs:
+    if type(x) is tuple:
+      for v in _vars(x):
+        yield v
+    elif type(x) is not Literal:
+      yield x
+
+def _eqn_operands(eqn):
+  for v in _vars(eqn.invars):
+    yield v
+  for _, const_bindings, freevar_bindings in eqn.bound_subjaxprs:
+    for v in _vars(const_bindings):
+      yield v
+    for v in _vars(freevar_bindings):
+      yield v
+
+def _restricted_uses(jaxpr):
+  uses = set(_vars([jaxpr.outvar]))
+  for eqn in jaxpr.eqns:
+    if eqn.restructure:
+      uses.update(_vars(eqn.invars))
+    for _, const_bindings, freevar_bindings in eqn.bound_subjaxprs:
+      uses.update(_vars(const_bindings))
+      uses.update(_vars(freevar_bindings))
+  return uses
+
+def _substitute(eqn, env):
+  if not env:
+    return eqn
+  read = lambda v: v if type(v) is Literal else env.get(v, v)
+  if not eqn.restructure:
+    invars = list(map(read, eqn.invars))
+  else:
+    invars = [tuple(map(read, v)) if type(v) is tuple else read(v)
+              for v in eqn.invars]
+  bound_subjaxprs = [(subjaxpr, list(map(read, const_bindings)),
+                      list(map(read, freevar_bindings)))
+                     for subjaxpr, const_bindings, freevar_bindings
+                     in eqn.bound_subjaxprs]
+  return eqn._replace(invars=invars, bound_subjaxprs=bound_subjaxprs)
+
+def _replace_eqns(jaxpr, eqns, env):
+  outvar = jaxpr.outvar
+  if type(outvar) is not Literal:
+    outvar = env.get(outvar, outvar)
+  return Jaxpr(jaxpr.constvars, jaxpr.freevars, jaxpr.invars, outvar, eqns)
+
+def _operand_key(v):
+  if type(v) is Literal:
+    # Keyed on the bits rather than by equality, which would merge -0. with 0.
+    # and never match a NaN with itself.
+    val = onp.asarray(v.val)
+    return (Literal, type(v.val), val.dtype, val.shape, val.tobytes())
+  elif type(v) is tuple:
+    return tuple(map(_operand_key, v))
+  else:
+    return v
+
+def _canonicalize(x):
+  return onp.asarray(x, xb.canonicalize_dtype(onp.result_type(x)))[()]
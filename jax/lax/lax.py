@@ -33,6 +33,7 @@ from .. import core
 from .. import ad_util
 from .. import api
 from .. import linear_util as lu
+from .. import jaxpr_passes
 from ..config import flags
 from ..core import Primitive
 from ..abstract_arrays import (UnshapedArray, ShapedArray, ConcreteArray,
@@ -1641,6 +1642,13 @@ ad.defjvp_zero(le_p)
 lt_p = binop(_fixed_dtype(onp.bool_), [_any, _any], 'lt')
 ad.defjvp_zero(lt_p)
 
+jaxpr_passes.folding_rules.update({
+    neg_p: onp.negative, add_p: onp.add, sub_p: onp.subtract,
+    mul_p: onp.multiply, max_p: onp.maximum, min_p: onp.minimum,
+    eq_p: onp.equal, ne_p: onp.not_equal, ge_p: onp.greater_equal,
+    gt_p: onp.greater, le_p: onp.less_equal, lt_p: onp.less,
+})
+
 
 def _convert_element_type_shape_rule(operand, new_dtype, old_dtype):
   return operand.shape
@@ -20,6 +20,7 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as onp
+import six
 
 from jax import api
 from jax import core
@@ -35,7 +36,7 @@ from jax.interpreters import partial_eval as pe
 from jax.interpreters import xla
 from jax.interpreters import ad
 from jax.util import partial, unzip2, safe_map, safe_zip
-from jax.tree_util import build_tree, tree_unflatten
+from jax.tree_util import build_tree, tree_unflatten, tree_map, tree_multimap
 from jax import ad_util
 
 map = safe_map
@@ -44,7 +45,7 @@ zip = safe_zip
 
 ### fori_loop and while_loop
 
-def fori_loop(lower, upper, body_fun, init_val):
+def fori_loop(lower, upper, body_fun, init_val, max_steps=None):
   """Loop from ``lower`` to ``upper`` by reduction to ``while_loop``.
 
   The type signature in brief is
@@ -55,20 +56,23 @@ def fori_loop(lower, upper, body_fun, init_val):
 
   The semantics of ``fori_loop`` are given by this Python implementation::
 
-    def fori_loop(lower, upper, body_fun, init_val):
+    def fori_loop(lower, upper, body_fun, init_val, max_steps=None):
       val = init_val
       for i in range(lower, upper):
         val = body_fun(i, val)
       return val
 
   Unlike that Python version, ``fori_loop`` is implemented in terms of a call to
-  ``while_loop``. See the docstring for ``while_loop`` for more information.
+  ``while_loop``. See the docstring for ``while_loop`` for more information,
+  including on ``max_steps``, which makes the loop reverse-mode differentiable.
 
   Args:
     lower: an integer representing the loop index lower bound (inclusive)
     upper: an integer representing the loop index upper bound (exclusive)
     body_fun: function of type ``(int, a) -> a``.
     init_val: initial loop carry value of type ``a``.
+    max_steps: optional static upper bound on ``upper - lower``, passed through
+      to ``while_loop``.
 
   Returns:
     Loop value from the final iteration, of type ``a``.
@@ -81,11 +85,12 @@ def fori_loop(lower, upper, body_fun, init_val):
     i, x = loop_carry
     return lax.add(i, lax._const(i, 1)), body_fun(i, x)
 
-  _, result = while_loop(while_cond_fun, while_body_fun, (lower, init_val))
+  _, result = while_loop(while_cond_fun, while_body_fun, (lower, init_val),
+                         max_steps=max_steps)
   return result
 
 
-def while_loop(cond_fun, body_fun, init_val):
+def while_loop(cond_fun, body_fun, init_val, max_steps=None):
   """Call ``body_fun`` repeatedly in a loop while ``cond_fun`` is True.
 
   The type signature in brief is
@@ -109,7 +114,14 @@ def while_loop(cond_fun, body_fun, init_val):
 
   Another difference from using Python-native loop constructs is that
   ``while_loop`` is not reverse-mode differentiable because XLA computations
-  require static bounds on memory requirements.
+  require static bounds on memory requirements. Passing a static ``max_steps``
+  provides such a bound: the loop then runs for exactly ``max_steps``
+  iterations, where iterations after ``cond_fun`` first returns False leave
+  the carry unchanged, and supports reverse-mode differentiation. Iterations
+  are grouped into nested ``scan``s whose bodies are rematerialized (see
+  ``jax.checkpoint``), so that the backward pass stores only
+  O(log(max_steps)) loop carries at the cost of O(log(max_steps)) forward
+  recomputations of each iteration.
 
   Args:
     cond_fun: function of type ``a -> Bool``.
@@ -117,10 +129,16 @@ def while_loop(cond_fun, body_fun, init_val):
     init_val: value of type ``a``, a type that can be a scalar, array, or any
       pytree (nested Python tuple/list/dict) thereof, representing the initial
       loop carry value.
+    max_steps: optional non-negative Python int bounding the number of
+      iterations. If ``cond_fun`` is still True after ``max_steps`` iterations,
+      the loop stops there anyway.
 
   Returns:
     The output from the final iteration of body_fun, of type ``a``.
   """
+  if max_steps is not None:
+    return _bounded_while_loop(cond_fun, body_fun, init_val, max_steps)
+
   init_val_flat, in_tree = pytree_to_jaxtupletree(init_val)
   flat_body_fun, out_tree = pytree_fun_to_jaxtupletree_fun(lu.wrap_init(body_fun), (in_tree,))
   flat_cond_fun, _ = pytree_fun_to_jaxtupletree_fun(lu.wrap_init(cond_fun), (in_tree,))
@@ -276,6 +294,40 @@ def _while_loop_batching_rule(batched_args, batch_dims, cond_consts,
 
   return while_loop(batched_cond_fun, batched_body_fun, init_val), init_val_bd
 
+def _bounded_while_loop(cond_fun, body_fun, init_val, max_steps):
+  if (not isinstance(max_steps, six.integer_types + (onp.integer,))
+      or isinstance(max_steps, bool)):
+    msg = "while_loop max_steps must be a non-negative int, got {}."
+    raise TypeError(msg.format(max_steps))
+  if max_steps < 0:
+    msg = "while_loop max_steps must be non-negative, got {}."
+    raise ValueError(msg.format(max_steps))
+
+  def step(val):
+    pred = cond_fun(val)
+    return tree_multimap(partial(lax.select, pred), body_fun(val), val)
+
+  # canonicalize dtypes so that the carry types match the body's output types
+  init_val = tree_map(lambda x: lax.convert_element_type(x, lax._dtype(x)),
+                      init_val)
+  return _checkpointed_loop(step, init_val, int(max_steps))
+
+def _checkpointed_loop(step, val, num_steps):
+  # Binary recursive checkpointing: run num_steps // 2 steps twice, using a scan
+  # over a rematerialized body, then run the odd step out, if any. Under
+  # reverse-mode AD each level saves only two carries.
+  if num_steps < 2:
+    return step(val) if num_steps else val
+  half, odd = divmod(num_steps, 2)
+
+  @api.checkpoint
+  def run_half(val):
+    return _checkpointed_loop(step, val, half)
+
+  val, _ = scan(lambda val, x: (run_half(val), x), val, onp.zeros(2, onp.int32))
+  return step(val) if odd else val
+
+
 def _jaxtupletree_select(pred, on_true, on_false):
   aval = core.get_aval(on_true)
   if type(aval) is core.AbstractTuple:
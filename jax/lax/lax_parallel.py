@@ -161,8 +161,17 @@ def _pswapaxes_serial_pmap_rule(vals, axes, axis):
   perm[axis] = axis_in
   return lax.transpose(x, perm), axis_in
 
+def _pswapaxes_translation_rule(c, x, device_groups, axis):
+  group_size = len(device_groups[0])
+  if c.GetShape(x).dimensions()[axis] != group_size:
+    msg = ("pswapaxes requires axis {} to have the size {} of the named axis, "
+           "got shape {}.")
+    raise ValueError(msg.format(axis, group_size, c.GetShape(x).dimensions()))
+  return c.AllToAll(x, axis, axis, device_groups)
+
 pswapaxes_p = PmapPrimitive('pswapaxes')
 parallel.serial_pmap_primitive_rules[pswapaxes_p] = _pswapaxes_serial_pmap_rule
+pxla.parallel_translation_rules[pswapaxes_p] = _pswapaxes_translation_rule
 
 
 def _psplit_serial_pmap_rule(vals, axes, axis):
@@ -0,0 +1,296 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent on-disk cache for compiled XLA computations.
+
+The in-memory caches in jax.interpreters.xla only live as long as the process,
+so every new process pays the full compilation cost again. When the
+`jax_compilation_cache_dir` flag is set, every call to `compile` below first
+looks for an entry in that directory keyed by a fingerprint of the HLO, the
+argument shapes, the compile options, and the backend platform. The HLO is
+fingerprinted in a canonical text form (see `canonical_hlo`), since the
+computation and instruction ids XlaBuilder assigns are global to the process
+and depend on the order in which computations were built.
+
+Each entry stores the serialized HLO along with the serialized executable, if
+the backend knows how to serialize executables. Note that the jaxlib versions
+currently supported don't, so with them entries only hold the HLO and every
+lookup misses: the cache doesn't save compile time until jaxlib exposes
+executable serialization. HLO-only entries are still useful for inspection and
+offline warmup, and an existing one isn't rewritten on every miss.
+
+Writes go to a temporary file in the cache directory which is then renamed into
+place, so concurrent processes sharing a directory never observe partially
+written entries. The directory is kept under `jax_compilation_cache_max_size`
+bytes by evicting the least-recently-used entries, where use is tracked with
+file modification times so that it is shared across processes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import re
+import tempfile
+import warnings
+
+import six
+from six.moves import cPickle as pickle
+
+from ..config import flags
+from . import xla_bridge as xb
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'jax_compilation_cache_dir',
+    os.getenv('JAX_COMPILATION_CACHE_DIR', ''),
+    'Directory for the persistent compilation cache. Disabled if empty.')
+flags.DEFINE_integer(
+    'jax_compilation_cache_max_size',
+    int(os.getenv('JAX_COMPILATION_CACHE_MAX_SIZE', str(2 ** 30))),
+    'Maximum size in bytes of the persistent compilation cache directory.')
+
+_ENTRY_SUFFIX = '.jaxcache'
+_FORMAT_VERSION = 1
+
+
+def is_enabled():
+  return bool(FLAGS.jax_compilation_cache_dir)
+
+
+def compile(built_c, arg_shapes, compile_options=None):
+  """Compile `built_c`, consulting the persistent cache if it is enabled.
+
+  Args:
+    built_c: a built XLA Computation.
+    arg_shapes: a sequence of xla_client.Shapes for the computation parameters.
+    compile_options: optional xla_client.CompileOptions.
+
+  Returns:
+    A compiled executable, as returned by `built_c.Compile`.
+  """
+  backend = xb.get_backend()
+  if not is_enabled():
+    return built_c.Compile(arg_shapes, compile_options, backend=backend)
+
+  cache = get_cache()
+  hlo = built_c.GetSerializedProto()
+  key = fingerprint(canonical_hlo(built_c), arg_shapes, compile_options,
+                    backend.platform)
+  if key is None:
+    return built_c.Compile(arg_shapes, compile_options, backend=backend)
+  entry = cache.get(key)
+  if entry is not None and entry.get('executable') is not None:
+    compiled = _deserialize_executable(backend, entry['executable'],
+                                       compile_options)
+    if compiled is not None:
+      stats['hits'] += 1
+      return compiled
+
+  stats['misses'] += 1
+  compiled = built_c.Compile(arg_shapes, compile_options, backend=backend)
+  serialized = _serialize_executable(backend, compiled)
+  if serialized is not None or entry is None:
+    entry = {'version': _FORMAT_VERSION, 'platform': backend.platform,
+             'hlo': hlo, 'executable': serialized}
+    cache.put(key, entry)
+  return compiled
+
+stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+def reset_stats():
+  for k in stats:
+    stats[k] = 0
+
+
+# Names in HLO text, like `add.17` or `jaxpr_computation.3`, end in a process
+# global id.
+_HLO_NAME_RE = re.compile(r'\b([A-Za-z_][\w\-]*)\.(\d+)\b')
+
+def canonical_hlo(built_c):
+  """Returns the HLO text of `built_c`, as bytes, with the ids in the names of
+  computations and instructions renumbered in order of appearance, so that it
+  doesn't depend on what else the process has built."""
+  ids = {}
+  def renumber(match):
+    return '{}.{}'.format(match.group(1),
+                          ids.setdefault(match.group(0), len(ids)))
+  return _HLO_NAME_RE.sub(renumber, built_c.GetHloText()).encode('utf-8')
+
+def fingerprint(hlo, arg_shapes, compile_options, platform):
+  """Return a stable hex digest identifying a compilation, or None if the
+  compile options can't be fingerprinted stably."""
+  options = _options_fingerprint(compile_options)
+  if options is None:
+    return None
+  h = hashlib.sha256()
+  h.update(hlo)
+  for shape in arg_shapes:
+    h.update(_shape_fingerprint(shape).encode('utf-8'))
+  h.update(options.encode('utf-8'))
+  h.update(platform.encode('utf-8'))
+  h.update(_jaxlib_version().encode('utf-8'))
+  return h.hexdigest()
+
+def _shape_fingerprint(shape):
+  if shape.is_tuple():
+    return '({})'.format(','.join(map(_shape_fingerprint, shape.tuple_shapes())))
+  else:
+    return '{}{}'.format(shape.element_type(), list(shape.dimensions()))
+
+# The CompileOptions fields that affect compilation. Only scalar values are
+# fingerprinted, since the reprs of other objects can contain memory addresses
+# that differ between processes. Argument and result layouts are left to XLA,
+# and are determined by the HLO and the argument shapes.
+_OPTIONS_FIELDS = ('num_replicas', 'num_partitions', 'hlo_profile',
+                   'xla_dump_to', 'dump_hlo_pass_re', 'dump_hlo_module_re')
+_SCALAR_TYPES = (type(None), bool, float) + six.integer_types + six.string_types
+
+def _options_fingerprint(compile_options):
+  if compile_options is None:
+    return 'None'
+  fields = []
+  for name in _OPTIONS_FIELDS:
+    value = getattr(compile_options, name, None)
+    if not isinstance(value, _SCALAR_TYPES):
+      return None
+    fields.append((name, value))
+  return repr(fields)
+
+def _jaxlib_version():
+  return xb.jaxlib_version.__version__
+
+
+# Older jaxlib backends can't (de)serialize executables, in which case we only
+# persist the HLO.
+def _serialize_executable(backend, compiled):
+  if not hasattr(backend, 'serialize_executable'):
+    return None
+  try:
+    return backend.serialize_executable(compiled)
+  except Exception as e:  # pylint: disable=broad-except
+    warnings.warn('Could not serialize executable for compilation cache: {}'
+                  .format(e))
+    return None
+
+def _deserialize_executable(backend, serialized, compile_options):
+  if not hasattr(backend, 'deserialize_executable'):
+    return None
+  try:
+    return backend.deserialize_executable(serialized, compile_options)
+  except Exception as e:  # pylint: disable=broad-except
+    warnings.warn('Could not deserialize cached executable: {}'.format(e))
+    return None
+
+
+class FileSystemCache(object):
+  """A directory of pickled cache entries with a byte budget and LRU eviction.
+
+  Entries are written atomically by renaming a temporary file into place, and
+  recency of use is tracked with file modification times, so that several
+  processes can safely share one directory.
+  """
+
+  def __init__(self, path, max_size):
+    self.path = path
+    self.max_size = max_size
+    if not os.path.isdir(path):
+      try:
+        os.makedirs(path)
+      except OSError:
+        if not os.path.isdir(path):  # lost a race with another process is fine
+          raise
+
+  def _entry_path(self, key):
+    return os.path.join(self.path, key + _ENTRY_SUFFIX)
+
+  def get(self, key):
+    path = self._entry_path(key)
+    try:
+      with open(path, 'rb') as f:
+        entry = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+      return None
+    if entry.get('version') != _FORMAT_VERSION:
+      return None
+    try:
+      os.utime(path, None)  # mark as recently used
+    except OSError:
+      pass
+    return entry
+
+  def put(self, key, entry):
+    fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp_path, self._entry_path(key))
+    except OSError:
+      # on some platforms rename fails if the destination exists, which just
+      # means another process wrote the same entry first
+      _remove_quietly(tmp_path)
+      return
+    stats['writes'] += 1
+    self.evict()
+
+  def entries(self):
+    """Return a list of (mtime, size, path) triples for all entries."""
+    out = []
+    for name in os.listdir(self.path):
+      if name.endswith(_ENTRY_SUFFIX):
+        path = os.path.join(self.path, name)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue  # evicted concurrently
+        out.append((st.st_mtime, st.st_size, path))
+    return out
+
+  def size(self):
+    return sum(size for _, size, _ in self.entries())
+
+  def evict(self):
+    entries = sorted(self.entries())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+      if total <= self.max_size:
+        break
+      if _remove_quietly(path):
+        stats['evictions'] += 1
+      total -= size
+
+  def clear(self):
+    for _, _, path in self.entries():
+      _remove_quietly(path)
+
+def _remove_quietly(path):
+  try:
+    os.remove(path)
+  except OSError:
+    return False
+  else:
+    return True
+
+
+_cache = None
+
+def get_cache():
+  global _cache
+  path = FLAGS.jax_compilation_cache_dir
+  max_size = FLAGS.jax_compilation_cache_max_size
+  if _cache is None or _cache.path != path or _cache.max_size != max_size:
+    _cache = FileSystemCache(path, max_size)
+  return _cache
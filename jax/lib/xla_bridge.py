@@ -23,6 +23,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import inspect
 import os
 import warnings
 from distutils.util import strtobool
@@ -160,6 +161,10 @@ def device_count():
 
 
 def device_put(pyval, device_num=0):
+  if may_alias_host_array(pyval):
+    return xla_client.LocalBuffer.from_pyval(pyval, device_num,
+                                             backend=get_backend(),
+                                             force_copy=False)
   return xla_client.LocalBuffer.from_pyval(pyval, device_num,
                                            backend=get_backend())
 
@@ -172,6 +177,102 @@ def device_put_many(pyvals_and_devices):
   else:
     return [device_put(pyval, device) for (pyval, device) in pyvals_and_devices]
 
+def copy_to_device(buf, device_num):
+  """Copies the device buffer `buf` to device number `device_num`.
+
+  Uses a direct device-to-device copy when the backend supports one, and
+  otherwise falls back to a round trip through the host.
+  """
+  if device_copy_supported(buf):
+    return buf.copy_to_device(device_num)
+  else:
+    return device_put(buf.to_py(), device_num)
+
+def device_copy_supported(buf):
+  # Tuple buffers could be copied elementwise, but destructuring a tuple buffer
+  # invalidates it on the jaxlib versions we support.
+  return hasattr(buf, "copy_to_device") and not buf.shape().is_tuple()
+
+
+# On the CPU backend device buffers live in host memory, so numpy arrays and
+# device buffers can share memory rather than being copied. Reading a CPU buffer
+# back gives a read-only view of it (through the buffer protocol), and
+# device_put builds buffers aliasing numpy arrays that can't be modified, such
+# as read-only memmaps, when they're suitably aligned. Both need jaxlib support,
+# and fall back to copying without it.
+
+# The alignment XLA's CPU backend uses for the buffers it allocates.
+_CPU_BUFFER_ALIGNMENT = 64
+
+def _is_cpu():
+  return get_backend().platform == 'cpu'
+
+@memoize_thunk
+def _aliasing_device_put_supported():
+  getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+  try:
+    return 'force_copy' in getargspec(xla_client.LocalBuffer.from_pyval).args
+  except TypeError:
+    return False
+
+def may_alias_host_array(x):
+  """Whether device_put may place `x` without copying it."""
+  return (isinstance(x, onp.ndarray) and _is_immutable(x) and
+          x.flags.c_contiguous and x.ctypes.data % _CPU_BUFFER_ALIGNMENT == 0
+          and _is_cpu() and _aliasing_device_put_supported())
+
+def _is_immutable(x):
+  # A read-only array can be a view of a writeable one, so every array along the
+  # chain of bases must be read-only, ending in memory nothing else can write to.
+  while isinstance(x, onp.ndarray):
+    if isinstance(x, onp.memmap) and x.mode == 'r':
+      return True  # the file is mapped read-only
+    if x.flags.writeable:
+      return False
+    x = x.base
+  return x is None or isinstance(x, bytes)
+
+def host_view(buf):
+  """Returns a read-only ndarray sharing the memory of `buf`, or None.
+
+  Only array buffers on the CPU backend can be viewed, and only with a jaxlib
+  whose buffers support the buffer protocol.
+  """
+  if not _is_cpu() or buf.shape().is_tuple():
+    return None
+  try:
+    view = onp.asarray(memoryview(buf))
+  except (TypeError, ValueError, BufferError):
+    return None
+  shape = buf.shape()
+  if (view.shape != tuple(shape.dimensions()) or
+      view.dtype != onp.dtype(shape.element_type())):
+    return None
+  view.flags.writeable = False
+  return view
+
+def is_host_view(x):
+  """Whether the ndarray `x` was returned by host_view."""
+  return isinstance(x, onp.ndarray) and isinstance(x.base, memoryview)
+
+def _xla_extension():
+  return getattr(xla_client, '_xla', None)
+
+def buffer_to_dlpack(buf):
+  """Returns a DLPack capsule sharing the memory of the array buffer `buf`."""
+  to_dlpack = getattr(_xla_extension(), 'BufferToDLPackManagedTensor', None)
+  if to_dlpack is None:
+    raise NotImplementedError("DLPack export requires a newer jaxlib.")
+  return to_dlpack(buf)
+
+def dlpack_to_buffer(capsule):
+  """Returns a device buffer sharing the memory of a DLPack capsule."""
+  from_dlpack = getattr(_xla_extension(), 'DLPackManagedTensorToBuffer', None)
+  if from_dlpack is None:
+    raise NotImplementedError("DLPack import requires a newer jaxlib.")
+  return from_dlpack(capsule, get_backend().client)
+
+
 def make_tuple(bufs, device_num=0):
   return xla_client.Buffer.make_tuple(bufs, device=device_num,
                                       backend=get_backend())
@@ -69,7 +69,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from .util import curry, partial, OrderedDict
+from .util import curry, partial, LRUCache, cache_name
 
 
 def thunk(f):
@@ -194,19 +194,24 @@ def wrap_init(f, params={}):
   return WrappedFun(f, [], params)
 
 
-def memoize(call, max_size=4096):
-  cache = OrderedDict()
+def memoize(call, max_size=None, sizeof=None):
+  cache = LRUCache(cache_name(call), max_size,
+                   sizeof=sizeof and (lambda entry: sizeof(entry[0])))
   def memoized_fun(f, *args):
     key = (f, args)
-    if key in cache:
-      ans, f_prev = cache[key]
-      cache.move_to_end(key)
+    entry = cache.get(key)
+    if entry is not None:
+      ans, f_prev = entry
       f.populate_stores(f_prev)
     else:
-      if len(cache) > max_size:
-        cache.popitem(last=False)
       ans = call(f, *args)
-      cache[key] = (ans, f)
+      cache.put(key, (ans, f))
     return ans
 
+  def insert(ans, f, *args):
+    """Caches `ans` as the result for `f` and `args`. `f` must have been run."""
+    cache.put((f, args), (ans, f))
+
+  memoized_fun.cache = cache
+  memoized_fun.insert = insert
   return memoized_fun
@@ -0,0 +1,290 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Accounting of the device memory held by live DeviceValues.
+
+When tracking is enabled, every DeviceArray, DeviceTuple, ShardedDeviceArray
+and ShardedDeviceTuple created is registered along with the number of bytes it
+holds on each device and the computation that produced it, as a (kind, name)
+pair like ('jit', 'update') or ('primitive', 'add'). Values are unregistered
+when they're garbage collected or donated. For example:
+
+  >>> with jax.memory.tracking():
+  ...   with jax.memory.peak() as p:
+  ...     y = f(x)
+  ...   print(p.bytes)
+  ...   print(jax.memory_stats())
+  ...   jax.memory.print_snapshot()
+
+Sizes are computed from shapes and dtypes, so they don't include padding or
+the memory held by compiled executables (see jax.cache_info for an estimate of
+the latter). Host copies cached by DeviceArrays, e.g. by printing them, are
+reported separately as host bytes. Iterating over a DeviceTuple moves its
+accounting to the elements, which share its memory.
+
+Tracking is off by default, and costs only a flag check per value when off.
+Only values created while tracking is enabled are accounted for.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import threading
+import weakref
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+from .core import JaxTuple
+from .lib import xla_bridge as xb
+
+_enabled = False
+_lock = threading.RLock()  # reentrant, as weakref callbacks can run under it
+_records = {}  # id of a DeviceValue -> _Record
+_in_use = defaultdict(int)  # device number -> bytes
+_peak_in_use = defaultdict(int)
+_peak_trackers = []
+_local = threading.local()  # the stack of registration contexts, see _context
+
+
+def start():
+  """Start registering DeviceValues as they're created."""
+  global _enabled
+  _enabled = True
+
+def stop():
+  """Stop registering DeviceValues. Registered values are still accounted for
+  until they're garbage collected."""
+  global _enabled
+  _enabled = False
+
+def is_enabled():
+  return _enabled
+
+def reset_peak():
+  """Reset the peak bytes in use on each device to the current bytes in use."""
+  with _lock:
+    _peak_in_use.clear()
+    _peak_in_use.update(_in_use)
+
+@contextmanager
+def tracking():
+  """Context manager that registers DeviceValues created within its scope."""
+  was_enabled = _enabled
+  start()
+  try:
+    yield
+  finally:
+    if not was_enabled:
+      stop()
+
+class Peak(object):
+  """The peak bytes in use on each device within a `peak` context."""
+
+  def __init__(self, in_use):
+    self.bytes = dict(in_use)  # device number -> bytes
+
+  def _update(self, device, in_use):
+    if in_use > self.bytes.get(device, 0):
+      self.bytes[device] = in_use
+
+@contextmanager
+def peak():
+  """Context manager measuring the peak device memory in use within its scope.
+
+  Yields a `Peak` whose `bytes` attribute maps device numbers to the largest
+  number of bytes held by tracked DeviceValues on that device while the context
+  was active, including values created before it.
+  """
+  with _lock:
+    tracker = Peak(_in_use)
+    _peak_trackers.append(tracker)
+  try:
+    yield tracker
+  finally:
+    with _lock:
+      _peak_trackers.remove(tracker)
+
+
+BufferRecord = namedtuple('BufferRecord', ['type', 'shape', 'dtype', 'bytes',
+                                           'devices', 'origin', 'host_bytes'])
+
+def snapshot():
+  """Return a list of `BufferRecord`s for the live values, largest first.
+
+  Each record has the value's 'type' name, its 'shape' and 'dtype' (None for
+  tuples), the total device 'bytes' it holds, a dict 'devices' mapping device
+  numbers to bytes, the (kind, name) 'origin' of the computation producing it
+  (None if unknown), and the 'host_bytes' of its cached host copy.
+  """
+  with _lock:
+    records = list(_records.values())
+  out = []
+  for record in records:
+    x = record.ref()
+    if x is None:
+      continue
+    devices = defaultdict(int)
+    for device, nbytes in record.footprint:
+      devices[device] += nbytes
+    out.append(BufferRecord(type(x).__name__, getattr(x, 'shape', None),
+                            getattr(x, 'dtype', None), sum(devices.values()),
+                            dict(devices), record.origin, _host_bytes(x)))
+  out.sort(key=lambda r: -r.bytes)
+  return out
+
+def stats():
+  """Return a dict mapping device numbers to memory statistics.
+
+  Each value is a dict with the number of 'live_values' holding memory on the
+  device, their 'bytes_in_use', the 'peak_bytes_in_use' since tracking started
+  or `reset_peak` was called, and the 'host_bytes' of the host copies cached
+  by those values.
+  """
+  out = defaultdict(lambda: dict(live_values=0, bytes_in_use=0,
+                                 peak_bytes_in_use=0, host_bytes=0))
+  for record in snapshot():
+    for device in record.devices:
+      out[device]['live_values'] += 1
+    if record.devices:
+      out[min(record.devices)]['host_bytes'] += record.host_bytes
+  with _lock:
+    for device, nbytes in _in_use.items():
+      out[device]['bytes_in_use'] = nbytes
+      out[device]['peak_bytes_in_use'] = _peak_in_use[device]
+  return dict(out)
+
+def summary():
+  """Return a dict mapping origins to the 'live_values' and total device
+  'bytes' of the values they produced, and the 'host_bytes' of their copies."""
+  out = defaultdict(lambda: dict(live_values=0, bytes=0, host_bytes=0))
+  for record in snapshot():
+    s = out[record.origin]
+    s['live_values'] += 1
+    s['bytes'] += record.bytes
+    s['host_bytes'] += record.host_bytes
+  return dict(out)
+
+def print_snapshot(file=None, limit=20):
+  """Print the `limit` largest live values in `snapshot()`."""
+  file = file or sys.stdout
+  header = "{:>12} {:>12} {:<20} {:<24} {:<10} {:<24}"
+  print(header.format("bytes", "host bytes", "type", "shape", "dtype",
+                      "origin"), file=file)
+  for r in snapshot()[:limit]:
+    origin = "{}({})".format(*r.origin) if r.origin else "<unknown>"
+    dtype = '' if r.dtype is None else str(r.dtype)
+    print(header.format(r.bytes, r.host_bytes, r.type[:20], str(r.shape)[:24],
+                        dtype[:10], origin[:24]), file=file)
+
+
+# Instrumentation used by the interpreters.
+
+_Record = namedtuple('_Record', ['ref', 'footprint', 'origin'])
+
+def register(x, footprint):
+  """Account for the DeviceValue `x` until it's garbage collected.
+
+  Args:
+    x: the value.
+    footprint: a list of (device number, bytes) pairs for its buffers.
+  """
+  contexts = getattr(_local, 'contexts', None)
+  tracked, origin = contexts[-1] if contexts else (True, None)
+  if not tracked:
+    return
+  key = id(x)
+  ref = weakref.ref(x, lambda ref: _release(key, ref))
+  with _lock:
+    old = _records.get(key)
+    if old is not None:
+      _subtract(old.footprint)
+    _records[key] = _Record(ref, footprint, origin)
+    for device, nbytes in footprint:
+      in_use = _in_use[device] = _in_use[device] + nbytes
+      if in_use > _peak_in_use[device]:
+        _peak_in_use[device] = in_use
+      for tracker in _peak_trackers:
+        tracker._update(device, in_use)
+
+def unregister(x):
+  """Stop accounting for `x`, e.g. because its buffers were donated."""
+  with _lock:
+    record = _records.pop(id(x), None)
+    if record is not None:
+      _subtract(record.footprint)
+
+def untracked():
+  """Context manager in which DeviceValues aren't registered, e.g. because they
+  share their buffers with a value that's already accounted for."""
+  return _context(False, None)
+
+def transfer(x):
+  """Context manager in which registered DeviceValues take over the accounting
+  of the DeviceValue `x`, whose buffers they share, like the elements of a
+  destructured DeviceTuple.
+
+  `x` stops being accounted for before the new values are registered, so they
+  aren't counted twice, and they get its origin. If `x` isn't tracked neither
+  are they. With tracking disabled, when no values are registered, `x` keeps
+  being accounted for.
+  """
+  if not _enabled:
+    return _context(True, None)
+  with _lock:
+    record = _records.get(id(x))
+    if record is not None and record.ref() is x:
+      del _records[id(x)]
+      _subtract(record.footprint)
+      return _context(True, record.origin)
+  return untracked()
+
+@contextmanager
+def _context(tracked, origin):
+  contexts = _local.__dict__.setdefault('contexts', [])
+  contexts.append((tracked, origin))
+  try:
+    yield
+  finally:
+    contexts.pop()
+
+def set_origin(x, origin):
+  """Record `origin` as the producer of the tracked values in `x`, which may be
+  a DeviceValue or a tuple of them."""
+  if type(x) in (tuple, JaxTuple):
+    for elt in x:
+      set_origin(elt, origin)
+    return
+  with _lock:
+    record = _records.get(id(x))
+    if record is not None and record.ref() is x:
+      _records[id(x)] = record._replace(origin=origin)
+
+def _release(key, ref):
+  with _lock:
+    record = _records.get(key)
+    if record is not None and record.ref is ref:
+      del _records[key]
+      _subtract(record.footprint)
+
+def _subtract(footprint):
+  for device, nbytes in footprint:
+    _in_use[device] -= nbytes
+
+def _host_bytes(x):
+  value = getattr(x, '_npy_value', None)
+  if value is None or xb.is_host_view(value):
+    return 0
+  return value.nbytes
@@ -14,5 +14,7 @@
 
 from __future__ import absolute_import
 from .lax_numpy import *
-from . import fft
-from . import linalg
+from ..util import LazyModule
+
+fft = LazyModule(__name__ + '.fft')
+linalg = LazyModule(__name__ + '.linalg')
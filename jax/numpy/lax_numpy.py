@@ -24,7 +24,6 @@ import warnings
 import types
 
 import numpy as onp
-import opt_einsum
 import six
 from six.moves import builtins, xrange
 
@@ -1623,6 +1622,7 @@ def einsum(*operands, **kwargs):
   if kwargs:
     msg = 'invalid keyword arguments for einsum: {}'
     raise TypeError(msg.format(', '.join(kwargs)))
+  import opt_einsum  # slow to import, and not needed by most programs
   # using einsum_call=True here is an internal api for opt_einsum
   operands, contractions = opt_einsum.contract_path(
       *operands, einsum_call=True, use_blas=True, optimize=optimize)
@@ -1632,6 +1632,7 @@ def einsum(*operands, **kwargs):
 @_wraps(onp.einsum_path)
 def einsum_path(subscripts, *operands, **kwargs):
   optimize = kwargs.pop('optimize', 'greedy')
+  import opt_einsum  # slow to import, and not needed by most programs
   # using einsum_call=True here is an internal api for opt_einsum
   return opt_einsum.contract_path(subscripts, *operands, optimize=optimize)
 
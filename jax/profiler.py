@@ -0,0 +1,234 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Profiling of tracing, lowering, and compilation.
+
+When profiling is enabled, every lookup in the compilation caches of `jit`,
+`pmap`, and op-by-op primitive application is recorded as an event, along with
+whether it hit the cache and, on a miss, the wall time spent in each phase of
+building the executable:
+
+  - "trace": tracing the Python function to a jaxpr,
+  - "lower": translating the jaxpr (or primitive) to an XLA computation,
+  - "compile": compiling the XLA computation.
+
+Misses also record the number of jaxpr equations and the size of the
+serialized HLO. For example:
+
+  >>> with jax.profiler.profile():
+  ...   f(x)
+  >>> jax.profiler.print_summary()
+  >>> jax.profiler.export_chrome_trace('/tmp/trace.json')
+
+The exported file can be loaded in chrome://tracing or Perfetto.
+
+Profiling is off by default, and costs only a flag check per lookup when off.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import functools
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_enabled = False
+_events = []
+_thread_local = threading.local()
+
+
+def start():
+  """Start recording compilation events."""
+  global _enabled
+  _enabled = True
+
+def stop():
+  """Stop recording compilation events. Recorded events are kept."""
+  global _enabled
+  _enabled = False
+
+def is_enabled():
+  return _enabled
+
+def reset():
+  """Discard all recorded events."""
+  del _events[:]
+
+@contextmanager
+def profile():
+  """Context manager that records compilation events within its scope."""
+  was_enabled = _enabled
+  start()
+  try:
+    yield
+  finally:
+    if not was_enabled:
+      stop()
+
+
+def events():
+  """Return a list of the recorded events, as dicts.
+
+  Each event has keys 'kind' ('jit', 'pmap', or 'primitive'), 'name',
+  'cache_hit', 'start' and 'duration' (in seconds), 'thread', and for cache
+  misses 'phases' (a dict mapping phase names to seconds), 'spans' (a list of
+  (phase, start, duration) triples), 'num_eqns' and 'hlo_size' where
+  applicable.
+  """
+  return [dict(e) for e in _events]
+
+def summary():
+  """Return per-function statistics aggregated over the recorded events.
+
+  Returns:
+    A dict mapping (kind, name) pairs to dicts with keys 'calls',
+    'cache_hits', 'cache_misses', 'total_time', the phase times
+    'trace_time', 'lower_time' and 'compile_time', and the maximum
+    'num_eqns' and 'hlo_size' over the misses.
+  """
+  out = defaultdict(lambda: dict(calls=0, cache_hits=0, cache_misses=0,
+                                 total_time=0., trace_time=0., lower_time=0.,
+                                 compile_time=0., num_eqns=0, hlo_size=0))
+  for e in _events:
+    s = out[(e['kind'], e['name'])]
+    s['calls'] += 1
+    s['cache_hits' if e['cache_hit'] else 'cache_misses'] += 1
+    s['total_time'] += e['duration']
+    for phase, t in e.get('phases', {}).items():
+      s[phase + '_time'] += t
+    s['num_eqns'] = max(s['num_eqns'], e.get('num_eqns', 0))
+    s['hlo_size'] = max(s['hlo_size'], e.get('hlo_size', 0))
+  return dict(out)
+
+def print_summary(file=None):
+  """Print a table of `summary()`, sorted by total time spent."""
+  file = file or sys.stdout
+  rows = sorted(summary().items(), key=lambda kv: -kv[1]['total_time'])
+  header = "{:<10} {:<32} {:>6} {:>6} {:>10} {:>10} {:>10} {:>7} {:>9}"
+  print(header.format("kind", "name", "hits", "misses", "trace ms", "lower ms",
+                      "compile ms", "eqns", "hlo bytes"), file=file)
+  row = ("{:<10} {:<32} {:>6d} {:>6d} {:>10.2f} {:>10.2f} {:>10.2f} {:>7d} "
+         "{:>9d}")
+  for (kind, name), s in rows:
+    print(row.format(kind, name[:32], s['cache_hits'], s['cache_misses'],
+                     1e3 * s['trace_time'], 1e3 * s['lower_time'],
+                     1e3 * s['compile_time'], s['num_eqns'], s['hlo_size']),
+          file=file)
+
+def export_chrome_trace(path):
+  """Write the recorded events to `path` in the Chrome trace event format."""
+  trace_events = []
+  for e in _events:
+    args = {k: e[k] for k in ('cache_hit', 'num_eqns', 'hlo_size') if k in e}
+    trace_events.append(_chrome_event(e['name'], e['kind'], e['start'],
+                                      e['duration'], e['thread'], args))
+    for phase, start, duration in e.get('spans', ()):
+      trace_events.append(_chrome_event(phase, e['kind'], start, duration,
+                                        e['thread'], {}))
+  with open(path, 'w') as f:
+    json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+def _chrome_event(name, category, start, duration, thread, args):
+  return {'name': name, 'cat': category, 'ph': 'X', 'pid': 0, 'tid': thread,
+          'ts': 1e6 * start, 'dur': 1e6 * duration, 'args': args}
+
+
+# Instrumentation used by the interpreters. A cache lookup pushes a frame that
+# phases and annotations inside the lookup (i.e. on a cache miss) write to.
+
+def _frames():
+  try:
+    return _thread_local.frames
+  except AttributeError:
+    _thread_local.frames = []
+    return _thread_local.frames
+
+def instrument_cache(kind, get_name):
+  """Decorator recording lookups in a memoized callable-building function.
+
+  Args:
+    kind: the kind of the events recorded, e.g. 'jit'.
+    get_name: function applied to the decorated function's arguments that
+      returns a name for the event.
+  """
+  def decorator(memoized_fun):
+    @functools.wraps(memoized_fun)
+    def instrumented(*args, **kwargs):
+      if not _enabled:
+        return memoized_fun(*args, **kwargs)
+      event = {'kind': kind, 'name': get_name(*args, **kwargs),
+               'cache_hit': True, 'thread': threading.current_thread().ident}
+      frames = _frames()
+      frames.append(event)
+      event['start'] = start = time.time()
+      try:
+        return memoized_fun(*args, **kwargs)
+      finally:
+        event['duration'] = time.time() - start
+        frames.pop()
+        _events.append(event)
+    return instrumented
+  return decorator
+
+def record_cache_hit(kind, name):
+  """Record a cache hit that doesn't go through an instrumented function."""
+  if _enabled:
+    _events.append({'kind': kind, 'name': name, 'cache_hit': True,
+                    'start': time.time(), 'duration': 0.,
+                    'thread': threading.current_thread().ident})
+
+@contextmanager
+def phase(name):
+  """Context manager timing a phase of building an executable."""
+  if not _enabled or not _frames():
+    yield
+    return
+  event = _frames()[-1]
+  event['cache_hit'] = False
+  start = time.time()
+  try:
+    yield
+  finally:
+    duration = time.time() - start
+    phases = event.setdefault('phases', {})
+    phases[name] = phases.get(name, 0.) + duration
+    event.setdefault('spans', []).append((name, start, duration))
+
+def annotate(**kwargs):
+  """Attach statistics to the innermost event being recorded, if any."""
+  if _enabled and _frames():
+    _frames()[-1].update(kwargs)
+
+def annotate_jaxpr(jaxpr):
+  if _enabled and _frames():
+    annotate(num_eqns=count_eqns(jaxpr))
+
+def annotate_hlo(built_c):
+  if _enabled and _frames():
+    annotate(hlo_size=len(built_c.GetSerializedProto()))
+
+def function_name(fun):
+  """Best-effort name of a `linear_util.WrappedFun`."""
+  return getattr(fun.f, '__name__', '<unnamed function>')
+
+def count_eqns(jaxpr):
+  """Number of equations in `jaxpr`, including those of bound subjaxprs."""
+  return sum(1 + sum(count_eqns(subjaxpr) for subjaxpr, _, _
+                     in eqn.bound_subjaxprs)
+             for eqn in jaxpr.eqns)
@@ -13,7 +13,9 @@
 # limitations under the License.
 
 from __future__ import absolute_import
-from . import linalg
-from . import misc
-from . import special
-from . import stats
+from ..util import LazyModule
+
+linalg = LazyModule(__name__ + '.linalg')
+misc = LazyModule(__name__ + '.misc')
+special = LazyModule(__name__ + '.special')
+stats = LazyModule(__name__ + '.stats')
@@ -13,14 +13,16 @@
 # limitations under the License.
 
 from __future__ import absolute_import
-from . import bernoulli
-from . import beta
-from . import cauchy
-from . import expon
-from . import gamma
-from . import laplace
-from . import multivariate_normal
-from . import norm
-from . import pareto
-from . import t
-from . import uniform
+from ...util import LazyModule
+
+bernoulli = LazyModule(__name__ + '.bernoulli')
+beta = LazyModule(__name__ + '.beta')
+cauchy = LazyModule(__name__ + '.cauchy')
+expon = LazyModule(__name__ + '.expon')
+gamma = LazyModule(__name__ + '.gamma')
+laplace = LazyModule(__name__ + '.laplace')
+multivariate_normal = LazyModule(__name__ + '.multivariate_normal')
+norm = LazyModule(__name__ + '.norm')
+pareto = LazyModule(__name__ + '.pareto')
+t = LazyModule(__name__ + '.t')
+uniform = LazyModule(__name__ + '.uniform')
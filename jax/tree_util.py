@@ -39,7 +39,7 @@ from collections import namedtuple
 import itertools as it
 from six.moves import reduce
 
-from .util import unzip2, concatenate, partial, safe_map
+from .util import partial, safe_map
 
 map = safe_map
 
@@ -58,9 +58,9 @@ def tree_map(f, tree):
   """
   node_type = node_types.get(type(tree))
   if node_type:
-    children, node_spec = node_type.to_iterable(tree)
+    children, node_spec = _to_iterable(node_type, tree)
     new_children = [tree_map(f, child) for child in children]
-    return node_type.from_iterable(node_spec, new_children)
+    return _from_iterable(node_type, node_spec, new_children)
   else:
     return f(tree)
 
@@ -79,23 +79,9 @@ def tree_multimap(f, tree, *rest):
     leaf given by `f(x, *xs)` where `x` is the value at the corresponding leaf
     in `tree` and `xs` is the tuple of values at corresponding leaves in `rest`.
   """
-  node_type = node_types.get(type(tree))
-  if node_type:
-    children, aux_data = node_type.to_iterable(tree)
-    all_children = [children]
-    for other_tree in rest:
-      other_node_type = node_types.get(type(other_tree))
-      if node_type != other_node_type:
-        raise TypeError('Mismatch: {} != {}'.format(other_node_type, node_type))
-      other_children, other_aux_data = node_type.to_iterable(other_tree)
-      if other_aux_data != aux_data:
-        raise TypeError('Mismatch: {} != {}'.format(other_aux_data, aux_data))
-      all_children.append(other_children)
-
-    new_children = [tree_multimap(f, *xs) for xs in zip(*all_children)]
-    return node_type.from_iterable(aux_data, new_children)
-  else:
-    return f(tree, *rest)
+  leaves, treedef = tree_flatten(tree)
+  all_leaves = [leaves] + [_flatten_up_to(treedef, other) for other in rest]
+  return tree_unflatten(treedef, [f(*xs) for xs in zip(*all_leaves)])
 
 
 def tree_reduce(f, tree):
@@ -113,37 +99,120 @@ def process_pytree(process_node, tree):
 
 
 def walk_pytree(f_node, f_leaf, tree):
-  node_type = node_types.get(type(tree))
-  if node_type:
-    children, node_spec = node_type.to_iterable(tree)
-    proc_children, child_specs = unzip2([walk_pytree(f_node, f_leaf, child)
-                                         for child in children])
-    tree_def = PyTreeDef(node_type, node_spec, child_specs)
-    return f_node(proc_children), tree_def
-  else:
-    return f_leaf(tree), leaf
+  """Applies `f_leaf` to the leaves of `tree`, and `f_node` to the tuples of
+  processed children of its nodes, returning the result and `tree`'s treedef."""
+  get_node_type = node_types.get
+  nodes = []
+  processed = []
+  stack = [tree]
+  while stack:
+    x = stack.pop()
+    if type(x) is _NodeEnd:
+      n = len(processed) - x.arity
+      children = tuple(processed[n:])
+      del processed[n:]
+      processed.append(f_node(children))
+      continue
+    node_type = get_node_type(type(x))
+    if node_type is None:
+      nodes.append(_LEAF)
+      processed.append(f_leaf(x))
+    else:
+      children, node_data = _to_iterable(node_type, x)
+      nodes.append((node_type, node_data, len(children)))
+      stack.append(_NodeEnd(len(children)))
+      stack.extend(children[::-1])
+  return processed[0], _make_treedef(nodes)
+
+class _NodeEnd(object):
+  __slots__ = ('arity',)
+
+  def __init__(self, arity):
+    self.arity = arity
 
 
 def build_tree(treedef, xs):
   if treedef is leaf:
     return xs
   else:
-    # We use 'iter' for clearer error messages
-    children = map(build_tree, iter(treedef.children), iter(xs))
-    return treedef.node_type.from_iterable(treedef.node_data, children)
-
-
-tree_flatten = partial(walk_pytree, concatenate, lambda x: [x])
+    return _build_tree(treedef._nodes, 0, xs)[0]
+
+def _build_tree(nodes, i, xs):
+  node_type, node_data, arity = nodes[i]
+  if node_type is None:
+    return xs, i + 1
+  xs = list(xs)
+  assert len(xs) == arity, 'length mismatch: {}'.format([arity, len(xs)])
+  children = []
+  i += 1
+  for x in xs:
+    child, i = _build_tree(nodes, i, x)
+    children.append(child)
+  return _from_iterable(node_type, node_data, children), i
+
+
+def tree_flatten(tree):
+  """Flattens a pytree into a list of leaves and a treedef."""
+  get_node_type = node_types.get
+  leaves = []
+  nodes = []
+  stack = [tree]
+  while stack:
+    x = stack.pop()
+    node_type = get_node_type(type(x))
+    if node_type is None:
+      leaves.append(x)
+      nodes.append(_LEAF)
+    else:
+      children, node_data = _to_iterable(node_type, x)
+      nodes.append((node_type, node_data, len(children)))
+      stack.extend(children[::-1])
+  return leaves, _make_treedef(nodes, len(leaves))
 
 def tree_unflatten(treedef, xs):
-  return _tree_unflatten(iter(xs), treedef)
-
-def _tree_unflatten(xs, treedef):
   if treedef is leaf:
-    return next(xs)
-  else:
-    children = map(partial(_tree_unflatten, xs), treedef.children)
-    return treedef.node_type.from_iterable(treedef.node_data, children)
+    return next(iter(xs))
+  xs = list(xs)
+  n = treedef.num_leaves
+  if len(xs) < n:
+    msg = "Too few leaves for {}: expected {}, got {}."
+    raise ValueError(msg.format(treedef, n, len(xs)))
+  stack = []
+  for node_type, node_data, arity in reversed(treedef._nodes):
+    if node_type is None:
+      n -= 1
+      stack.append(xs[n])
+    elif node_type is _tuple_node:
+      children = stack[len(stack) - arity:]
+      del stack[len(stack) - arity:]
+      stack.append(tuple(children[::-1]))
+    else:
+      children = stack[len(stack) - arity:]
+      del stack[len(stack) - arity:]
+      children.reverse()
+      stack.append(_from_iterable(node_type, node_data, children))
+  return stack[0]
+
+def _flatten_up_to(treedef, tree):
+  """Flattens `tree` into the subtrees at the leaves of `treedef`."""
+  leaves = []
+  stack = [tree]
+  for node_type, node_data, arity in treedef._nodes:
+    x = stack.pop()
+    if node_type is None:
+      leaves.append(x)
+      continue
+    other_node_type = node_types.get(type(x))
+    if node_type != other_node_type:
+      raise TypeError('Mismatch: {} != {}'.format(other_node_type, node_type))
+    children, other_node_data = _to_iterable(node_type, x)
+    if other_node_data != node_data:
+      raise TypeError('Mismatch: {} != {}'.format(other_node_data, node_data))
+    if len(children) != arity:
+      msg = 'Mismatch: {} != {} children'
+      raise TypeError(msg.format(len(children), arity))
+    stack.extend(children[::-1])
+  return leaves
 
 
 def tree_transpose(outer_treedef, inner_treedef, pytree_to_transpose):
@@ -152,36 +221,65 @@ def tree_transpose(outer_treedef, inner_treedef, pytree_to_transpose):
   if treedef != expected_treedef:
     raise TypeError("Mismatch\n{}\n != \n{}".format(treedef, expected_treedef))
 
-  inner_size = _num_leaves(inner_treedef)
-  outer_size = _num_leaves(outer_treedef)
+  inner_size = inner_treedef.num_leaves
+  outer_size = outer_treedef.num_leaves
   flat = iter(flat)
   lol = [[next(flat) for _ in range(inner_size)] for __ in range(outer_size)]
   transposed_lol = zip(*lol)
   subtrees = map(partial(tree_unflatten, outer_treedef), transposed_lol)
   return tree_unflatten(inner_treedef, subtrees)
 
-def _num_leaves(treedef):
-  return 1 if treedef is leaf else sum(map(_num_leaves, treedef.children))
-
 def _nested_treedef(inner, outer):
   # just used in tree_transpose error checking
-  if outer is leaf:
-    return inner
-  else:
-    children = map(partial(_nested_treedef, inner), outer.children)
-    return PyTreeDef(outer.node_type, outer.node_data, tuple(children))
+  nodes = []
+  for node in outer._nodes:
+    if node is _LEAF:
+      nodes.extend(inner._nodes)
+    else:
+      nodes.append(node)
+  return _make_treedef(nodes, inner.num_leaves * outer.num_leaves)
 
 
 def tree_structure(tree):
-  _, spec = process_pytree(lambda _: None, tree)
+  _, spec = tree_flatten(tree)
   return spec
 
 
 class PyTreeDef(object):
+  """The structure of a pytree.
+
+  Stores a flat tuple with a `(node_type, node_data, num_children)` triple for
+  each node of the tree in preorder, where leaves are `(None, None, 0)`, so that
+  treedefs can be built, hashed and compared without recursion. Trees consisting
+  of a single leaf are represented by `leaf` instead.
+  """
+  __slots__ = ('_nodes', 'num_leaves', '_hash')
+
   def __init__(self, node_type, node_data, children):
-    self.node_type = node_type
-    self.node_data = node_data
-    self.children = children
+    nodes = [(node_type, node_data, len(children))]
+    for child in children:
+      nodes.extend(child._nodes)
+    self._nodes = tuple(nodes)
+    self.num_leaves = sum(child.num_leaves for child in children)
+    self._hash = None
+
+  @property
+  def node_type(self):
+    return self._nodes[0][0]
+
+  @property
+  def node_data(self):
+    return self._nodes[0][1]
+
+  @property
+  def children(self):
+    children = []
+    start = 1
+    for _ in range(self._nodes[0][2]):
+      end = start + _subtree_size(self._nodes, start)
+      children.append(_make_treedef(self._nodes[start:end]))
+      start = end
+    return children
 
   def __repr__(self):
     if self.node_data is None:
@@ -193,26 +291,54 @@ class PyTreeDef(object):
                                      ','.join(map(repr, self.children)))
 
   def __hash__(self):
-    return hash((self.node_type, self.node_data, tuple(self.children)))
+    if self._hash is None:
+      self._hash = hash(self._nodes)
+    return self._hash
 
   def __eq__(self, other):
-    if other is leaf:
+    if self is other:
+      return True
+    elif type(other) is not PyTreeDef:
       return False
     else:
-      return (self.node_type == other.node_type and
-              self.node_data == other.node_data and
-              self.children == other.children)
+      return (self.num_leaves == other.num_leaves and
+              self._nodes == other._nodes)
 
   def __ne__(self, other):
     return not self == other
 
 
+_LEAF = (None, None, 0)
+
 class PyLeaf(object):
+  __slots__ = ()
+  _nodes = (_LEAF,)
+  num_leaves = 1
+
   def __repr__(self):
     return '*'
 
 leaf = PyLeaf()
 
+def _make_treedef(nodes, num_leaves=None):
+  if nodes[0] is _LEAF:
+    return leaf
+  treedef = PyTreeDef.__new__(PyTreeDef)
+  treedef._nodes = nodes = tuple(nodes)
+  if num_leaves is None:
+    num_leaves = nodes.count(_LEAF)
+  treedef.num_leaves = num_leaves
+  treedef._hash = None
+  return treedef
+
+def _subtree_size(nodes, start):
+  """Number of nodes in the subtree of `nodes` starting at index `start`."""
+  end, pending = start, 1
+  while pending:
+    pending += nodes[end][2] - 1
+    end += 1
+  return end - start
+
 def dict_to_iterable(xs):
   keys = tuple(sorted(xs.keys()))
   return tuple(map(xs.get, keys)), keys
@@ -236,3 +362,26 @@ register_pytree_node(tuple, lambda xs: (xs, None), lambda _, xs: tuple(xs))
 register_pytree_node(list, lambda xs: (tuple(xs), None), lambda _, xs: list(xs))
 register_pytree_node(dict, dict_to_iterable, lambda keys, xs: dict(zip(keys, xs)))
 register_pytree_node(type(None), lambda z: ((), None), lambda _, xs: None)
+
+_tuple_node = node_types[tuple]
+_list_node = node_types[list]
+
+# Fast paths for the most common node types, which skip the registered
+# functions.
+def _to_iterable(node_type, x):
+  if node_type is _tuple_node:
+    return x, None
+  elif node_type is _list_node:
+    return tuple(x), None
+  children, node_data = node_type.to_iterable(x)
+  if type(children) is not tuple:
+    children = tuple(children)
+  return children, node_data
+
+def _from_iterable(node_type, node_data, children):
+  if node_type is _tuple_node:
+    return tuple(children)
+  elif node_type is _list_node:
+    return list(children)
+  else:
+    return node_type.from_iterable(node_data, children)
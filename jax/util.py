@@ -18,13 +18,18 @@ from __future__ import print_function
 
 import collections
 import functools
+import importlib
 import itertools as it
 from operator import mul
+import os
 import types
+import weakref
 import numpy as onp
 
 import six
 
+from .config import flags
+
 allow_memoize_hash_failures = False
 
 
@@ -155,24 +160,122 @@ else:
 
 _NO_MEMO_ENTRY = object()
 
-def memoize(fun, max_size=4096):
-  cache = OrderedDict()
+FLAGS = flags.FLAGS
+flags.DEFINE_integer(
+    'jax_cache_max_entries',
+    int(os.getenv('JAX_CACHE_MAX_ENTRIES', '4096')),
+    'Maximum number of entries kept in each in-memory compilation cache.')
+flags.DEFINE_integer(
+    'jax_cache_max_bytes',
+    int(os.getenv('JAX_CACHE_MAX_BYTES', str(2 ** 30))),
+    'Maximum estimated size in bytes of the entries kept in each in-memory '
+    'compilation cache that tracks entry sizes. Unbounded if 0.')
+
+
+# All caches created by `memoize` (and `linear_util.memoize`) are registered
+# here, so that they can be inspected with `cache_info` and emptied with
+# `clear_caches`. Registration doesn't keep a cache alive.
+_cache_registry = weakref.WeakValueDictionary()
+
+class LRUCache(object):
+  """A least-recently-used cache bounded in number of entries and bytes.
+
+  The byte budget only applies if `sizeof` is given, which is called on each
+  inserted value to estimate the memory it holds. Budgets of None are read from
+  the jax_cache_max_entries and jax_cache_max_bytes flags on every insertion.
+  """
+
+  def __init__(self, name, max_size=None, max_bytes=None, sizeof=None):
+    self.name = name
+    self.max_size = max_size
+    self.max_bytes = max_bytes
+    self.sizeof = sizeof
+    self.entries = OrderedDict()  # key -> (value, size)
+    self.nbytes = 0
+    self.hits = self.misses = self.evictions = 0
+    while self.name in _cache_registry:
+      self.name = _next_cache_name(self.name)
+    _cache_registry[self.name] = self
+
+  def get(self, key, default=None):
+    entry = self.entries.get(key, _NO_MEMO_ENTRY)
+    if entry is _NO_MEMO_ENTRY:
+      self.misses += 1
+      return default
+    self.hits += 1
+    self.entries.move_to_end(key)
+    return entry[0]
+
+  def put(self, key, value):
+    size = self.sizeof(value) if self.sizeof else 0
+    if key in self.entries:
+      self.nbytes -= self.entries.pop(key)[1]
+    self.entries[key] = (value, size)
+    self.nbytes += size
+    self._evict()
+
+  def _evict(self):
+    max_size = FLAGS.jax_cache_max_entries if self.max_size is None else self.max_size
+    max_bytes = FLAGS.jax_cache_max_bytes if self.max_bytes is None else self.max_bytes
+    # The most recent entry is always kept, even if it exceeds the byte budget.
+    while len(self.entries) > 1 and (
+        len(self.entries) > max_size or (max_bytes and self.nbytes > max_bytes)):
+      _, (_, size) = self.entries.popitem(last=False)
+      self.nbytes -= size
+      self.evictions += 1
+
+  def clear(self):
+    self.entries.clear()
+    self.nbytes = 0
+
+  def info(self):
+    return {'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions, 'entries': len(self.entries),
+            'bytes': self.nbytes}
+
+  def __len__(self):
+    return len(self.entries)
+
+def cache_info():
+  """Return a dict mapping cache names to dicts of cache statistics.
+
+  The statistics are the counts of 'hits', 'misses' and 'evictions' since the
+  cache was created, and the current number of 'entries' and estimated 'bytes'.
+  """
+  return {name: cache.info() for name, cache in list(_cache_registry.items())}
+
+def clear_caches():
+  """Empty all registered caches, releasing the executables they hold."""
+  for cache in list(_cache_registry.values()):
+    cache.clear()
+
+def _next_cache_name(name):
+  base, _, count = name.rpartition('#')
+  if base and count.isdigit():
+    return '{}#{}'.format(base, int(count) + 1)
+  return name + '#1'
+
+def cache_name(fun):
+  return '{}.{}'.format(getattr(fun, '__module__', None),
+                        getattr(fun, '__name__', repr(fun)))
+
+
+def memoize(fun, max_size=None, sizeof=None):
+  cache = LRUCache(cache_name(fun), max_size, sizeof=sizeof)
   def memoized_fun(*args, **kwargs):
     key = (args, tuple(kwargs and sorted(kwargs.items())))
     try:
       ans = cache.get(key, _NO_MEMO_ENTRY)
-      if ans != _NO_MEMO_ENTRY:
-        cache.move_to_end(key)
-        return ans
     except TypeError:
       if not allow_memoize_hash_failures:
         raise
-
-    if len(cache) > max_size:
-      cache.popitem(last=False)
-
-    ans = cache[key] = fun(*args, **kwargs)
+      return fun(*args, **kwargs)
+    if ans is not _NO_MEMO_ENTRY:
+      return ans
+    ans = fun(*args, **kwargs)
+    cache.put(key, ans)
     return ans
+  memoized_fun.cache = cache
   return memoized_fun
 
 
@@ -214,6 +317,29 @@ class Hashable(object):
 
 
 
+class LazyModule(types.ModuleType):
+  """A placeholder for a module that imports it on first attribute access.
+
+  Package `__init__` files bind submodules that are slow to import to
+  `LazyModule`s, so that e.g. `jax.scipy.special.gammaln` works without
+  `import jax.scipy` importing all of `jax.scipy`'s submodules.
+  """
+
+  def _load(self):
+    module = importlib.import_module(self.__name__)
+    self.__dict__.update(module.__dict__)
+    return module
+
+  def __getattr__(self, name):
+    return getattr(self._load(), name)
+
+  def __dir__(self):
+    return dir(self._load())
+
+  def __repr__(self):
+    return "<lazily imported module '{}'>".format(self.__name__)
+
+
 def get_module_functions(module):
   """Finds functions in module.
   Args:
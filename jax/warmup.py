@@ -0,0 +1,223 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Record-and-replay warmup of the `jit` and `pmap` compilation caches.
+
+While recording, every signature compiled for a top-level call of a `jit`- or
+`pmap`-ed function is appended to a manifest file: the function's module and
+qualified name, its options, the shapes and dtypes of its array arguments, and
+its static arguments. A new process can then replay the manifest before serving
+traffic:
+
+  >>> jax.warmup.start_recording('/tmp/manifest.jsonl')  # in a previous run
+  ...
+  >>> jax.warmup.warmup('/tmp/manifest.jsonl')  # at startup
+
+Replaying traces and lowers each entry on the calling thread, compiles the
+computations concurrently in a thread pool (XLA releases the GIL while
+compiling), and then populates the in-memory compilation caches, so that the
+first calls with the recorded signatures don't compile.
+
+Only functions that can be imported by name are recorded, i.e. not lambdas or
+functions defined in other functions, and only if their arguments are (nested
+tuples, lists and dicts of) arrays and their static arguments are (nested
+tuples of) None, bools, ints, floats and strings. Functions `pmap`-ed
+without an `axis_name` can only be replayed if the module attribute with their
+name is the `pmap`-ed function itself.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import importlib
+import json
+import multiprocessing
+import threading
+import warnings
+from multiprocessing.pool import ThreadPool
+
+import numpy as onp
+import six
+
+from .interpreters import xla
+
+_manifest_path = None
+_recorded = set()
+_lock = threading.Lock()
+
+
+def start_recording(path):
+  """Append the signatures compiled from now on to the manifest at `path`."""
+  global _manifest_path
+  with _lock:
+    _manifest_path = path
+    _recorded.clear()
+
+def stop_recording():
+  global _manifest_path
+  with _lock:
+    _manifest_path = None
+
+def is_recording():
+  return _manifest_path is not None
+
+
+def record_jit(fun, static_argnums, donate_argnums, device_values, args,
+               kwargs):
+  try:
+    args = [{'static': _encode_static(x)} if i in static_argnums
+            else _encode_tree(x) for i, x in enumerate(args)]
+    kwargs = _encode_tree(kwargs)
+  except _Unrecordable:
+    return
+  _record(fun, kind='jit', static_argnums=sorted(static_argnums),
+          donate_argnums=sorted(donate_argnums), device_values=device_values,
+          args=args, kwargs=kwargs)
+
+def record_pmap(fun, axis_name, args, kwargs):
+  if not isinstance(axis_name, six.string_types):
+    axis_name = None
+  try:
+    args = [_encode_tree(x) for x in args]
+    kwargs = _encode_tree(kwargs)
+  except _Unrecordable:
+    return
+  _record(fun, kind='pmap', axis_name=axis_name, args=args, kwargs=kwargs)
+
+def _record(fun, **entry):
+  name = getattr(fun, '__qualname__', getattr(fun, '__name__', None))
+  module = getattr(fun, '__module__', None)
+  if not name or not module or '<' in name:
+    return
+  entry['module'], entry['name'] = module, name
+  line = json.dumps(entry, sort_keys=True)
+  with _lock:
+    if _manifest_path is None or line in _recorded:
+      return
+    _recorded.add(line)
+    with open(_manifest_path, 'a') as f:
+      f.write(line + '\n')
+
+class _Unrecordable(Exception): pass
+
+def _encode_tree(x):
+  if type(x) is tuple:
+    return {'tuple': [_encode_tree(y) for y in x]}
+  elif type(x) is list:
+    return {'list': [_encode_tree(y) for y in x]}
+  elif type(x) is dict:
+    return {'dict': [[k, _encode_tree(x[k])] for k in sorted(x)]}
+  else:
+    try:
+      aval = xla.abstractify(x)
+    except TypeError:
+      raise _Unrecordable(type(x))
+    if not hasattr(aval, 'shape'):
+      raise _Unrecordable(type(x))
+    return {'shape': list(aval.shape), 'dtype': onp.dtype(aval.dtype).name}
+
+def _encode_static(x):
+  if x is None or isinstance(x, (bool, int, float) + six.string_types):
+    return {'value': x}
+  elif type(x) is tuple:
+    return {'tuple': [_encode_static(y) for y in x]}
+  else:
+    # Unhashable static arguments, like lists, are keyed by identity by jit, so
+    # a replayed signature could never match a later call.
+    raise _Unrecordable(type(x))
+
+def _decode(x):
+  from .api import ShapeDtypeStruct
+  if 'shape' in x:
+    return ShapeDtypeStruct(x['shape'], x['dtype'])
+  elif 'static' in x:
+    return _decode(x['static'])
+  elif 'value' in x:
+    return x['value']
+  elif 'tuple' in x:
+    return tuple(map(_decode, x['tuple']))
+  elif 'list' in x:
+    return list(map(_decode, x['list']))
+  else:
+    return {k: _decode(v) for k, v in x['dict']}
+
+def _has_list(x):
+  return 'list' in x or any(map(_has_list, x.get('tuple', ())))
+
+
+def warmup(path, num_threads=None):
+  """Compile the signatures recorded in the manifest at `path`.
+
+  Args:
+    path: a manifest written by recording.
+    num_threads: optional size of the thread pool for compilation. Defaults to
+      the number of CPUs.
+
+  Returns:
+    The number of signatures compiled. Entries that can't be replayed, e.g.
+    because their function no longer exists, are skipped with a warning.
+  """
+  with open(path) as f:
+    entries = [json.loads(line) for line in sorted(set(f)) if line.strip()]
+  thunks = [thunk for thunk in map(_prepare, entries) if thunk is not None]
+  if not thunks:
+    return 0
+  pool = ThreadPool(min(num_threads or multiprocessing.cpu_count(),
+                        len(thunks)))
+  try:
+    inserts = pool.map(_compile, thunks)
+  finally:
+    pool.close()
+  inserts = [insert for insert in inserts if insert is not None]
+  for insert in inserts:
+    insert()
+  return len(inserts)
+
+def _prepare(entry):
+  try:
+    from . import api
+    obj = importlib.import_module(entry['module'])
+    for attr in entry['name'].split('.'):
+      obj = getattr(obj, attr)
+    if any(_has_list(x['static']) for x in entry['args'] if 'static' in x):
+      raise ValueError("static arguments containing lists can't be replayed")
+    args = list(map(_decode, entry['args']))
+    kwargs = _decode(entry['kwargs'])
+    if entry['kind'] == 'pmap' and entry['axis_name'] is None:
+      if not hasattr(obj, '_precompile'):
+        raise ValueError("pmap axis name wasn't recorded")
+      return obj._precompile(*args, **kwargs)
+    fun = obj.__wrapped__ if hasattr(obj, '_precompile') else obj
+    if entry['kind'] == 'jit':
+      jitted = api._jit(fun, tuple(entry['static_argnums']),
+                        device_values=entry['device_values'],
+                        donate_argnums=tuple(entry['donate_argnums']))
+    else:
+      jitted = api.pmap(fun, entry['axis_name'])
+    return jitted._precompile(*args, **kwargs)
+  except Exception as e:
+    _warn_skipped(entry, e)
+    return None
+
+def _compile(thunk):
+  try:
+    return thunk()
+  except Exception as e:
+    warnings.warn("Skipping warmup entry that failed to compile: {}".format(e))
+    return None
+
+def _warn_skipped(entry, e):
+  warnings.warn("Skipping warmup entry for {}.{}: {}".format(
+      entry.get('module'), entry.get('name'), e))
@@ -16,19 +16,35 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import SkipTest
+
 import six
 
 import numpy as onp
 from absl.testing import absltest
+from absl.testing import flagsaver
 from jax import test_util as jtu
 
 import jax.numpy as np
 from jax import jit, grad, device_get, device_put, jacfwd, jacrev, hessian
 from jax import api
+from jax import dlpack
+from jax import memory
+from jax import linear_util as lu
+from jax import util
 from jax.core import Primitive, pack, JaxTuple
 from jax.interpreters.ad import defjvp, defvjp, defvjp2, defvjp_all
+from jax.interpreters import ad
+from jax.interpreters import xla
 from jax.interpreters.xla import DeviceArray, DeviceTuple
 from jax.abstract_arrays import concretization_err_msg
+from jax.lib import xla_bridge as xb
 
 from jax.config import config
 config.parse_flags_with_absl()
@@ -132,6 +148,55 @@ class APITest(jtu.JaxTestCase):
     assert g(2.0) == 4.0
     assert len(side) == 1
 
+  def test_jit_signature_cache(self):
+    side = []
+
+    @jit
+    def f(x):
+      side.append(None)
+      return x + 1
+
+    self.assertAllClose(f(onp.ones(3, onp.float32)), 2 * onp.ones(3),
+                        check_dtypes=False)
+    self.assertAllClose(f(np.ones(3)), 2 * onp.ones(3), check_dtypes=False)
+    assert len(side) == 1
+    f(onp.ones(4, onp.float32))
+    assert len(side) == 2
+    f(onp.ones(4, onp.int32))
+    assert len(side) == 3
+    f(onp.ones(4, onp.int32))
+    assert len(side) == 3
+
+  def test_jit_closing_over_tracer(self):
+    def outer(x):
+      @jit
+      def inner(y):
+        return x * y
+      return inner(2.)
+
+    assert grad(outer)(1.) == 2.
+
+  def test_jit_donate_argnums(self):
+    f = jit(lambda x, y: x + y, donate_argnums=0)
+    x = device_put(onp.ones(3, onp.float32))
+    y = device_put(onp.ones(3, onp.float32))
+    self.assertAllClose(f(x, y), 2 * onp.ones(3), check_dtypes=False)
+    self.assertAllClose(y, onp.ones(3), check_dtypes=False)
+    jtu.check_raises(lambda: x + 1, RuntimeError,
+                     "DeviceArray was donated to a jit-compiled computation")
+
+    z = onp.ones(3, onp.float32)
+    self.assertAllClose(f(z, z), 2 * onp.ones(3), check_dtypes=False)
+    self.assertAllClose(z, onp.ones(3), check_dtypes=False)
+
+    x = device_put(onp.ones(3, onp.float32))
+    jtu.check_raises(lambda: f(x, x), ValueError,
+                     "A donated argument can't also be passed")
+
+  def test_jit_donate_static_argnums_error(self):
+    jtu.check_raises(lambda: jit(lambda x: x, static_argnums=(0,),
+                                 donate_argnums=(0,)),
+                     ValueError, "jit arguments can't be both static and donated")
 
   def test_bad_input(self):
     def f(x):
@@ -568,6 +633,464 @@ class APITest(jtu.JaxTestCase):
     self.assertIsInstance(x, DeviceArray)
     repr(x)  # doesn't crash
 
+  def test_block_until_ready(self):
+    x = device_put(onp.arange(3.))
+    self.assertIs(x.block_until_ready(), x)
+    tup = device_put(pack((1, 2)))
+    self.assertIs(tup.block_until_ready(), tup)
+
+  @flagsaver.flagsaver(jax_async_dispatch=True)
+  def test_async_dispatch(self):
+    x = onp.arange(4, dtype=onp.float32)
+    y = jit(lambda x: 2 * x)(x)
+    z = np.sin(y)
+    self.assertIsInstance(y, DeviceArray)
+    self.assertIs(z.block_until_ready(), z)
+    self.assertIsNot(type(z._device_buffer), xla._PendingBuffer)
+    self.assertAllClose(y, 2 * x, check_dtypes=True)
+    self.assertAllClose(z, onp.sin(2 * x), check_dtypes=True)
+
+    tup = jit(lambda x: (x + 1, x - 1))(x)
+    self.assertAllClose(tup, (x + 1, x - 1), check_dtypes=True)
+
+  @flagsaver.flagsaver(jax_async_dispatch=True)
+  def test_async_dispatch_error(self):
+    # a value whose computation fails on the dispatch thread
+    pending = xla._PendingBuffer()
+    x = DeviceArray(((3,), onp.float32, 1, 3), pending)
+    def fail():
+      raise RuntimeError("device error")
+    xla._dispatcher.submit(fail, [pending])
+
+    y = jit(lambda x: 2 * x)(x)  # dispatched without waiting on x
+    z = np.sin(y)
+    self.assertIsInstance(y._device_buffer, xla._PendingBuffer)
+    jtu.check_raises(y.block_until_ready, RuntimeError, "device error")
+    jtu.check_raises(z.block_until_ready, RuntimeError, "device error")
+    jtu.check_raises(lambda: onp.asarray(z), RuntimeError, "device error")
+
+  def test_pending_device_values(self):
+    x = device_put(onp.arange(3, dtype=onp.float32))
+    pending = xla._PendingBuffer()
+    y = DeviceArray((x.shape, x.dtype, x.ndim, x.size), pending)
+    xla._dispatcher.submit(lambda: [x.device_buffer], [pending])
+    self.assertAllClose(np.sin(y), onp.sin(onp.arange(3.)), check_dtypes=False)
+
+    tup = device_put(pack((1., 2.)))
+    pending = xla._PendingBuffer()
+    tup2 = DeviceTuple((tup.aval, tup.result_shapes), pending)
+    elts = tuple(tup2)  # doesn't wait for the tuple buffer
+    xla._dispatcher.submit(lambda: [tup.device_buffer], [pending])
+    self.assertAllClose(elts, (1., 2.), check_dtypes=False)
+
+  def test_pending_device_value_error(self):
+    pending = xla._PendingBuffer()
+    x = DeviceArray(((3,), onp.float32, 1, 3), pending)
+    def fail():
+      raise RuntimeError("device error")
+    xla._dispatcher.submit(fail, [pending])
+    jtu.check_raises(x.block_until_ready, RuntimeError, "device error")
+
+  @flagsaver.flagsaver(jax_lazy_eager=True)
+  def test_lazy_eager(self):
+    x = device_put(onp.arange(4.))
+    y = np.exp(np.sin(x))
+    z = np.cos(y)
+    self.assertIsInstance(z._device_buffer, xla._LazyBuffer)
+    self.assertIsInstance(y._device_buffer, xla._LazyBuffer)
+    self.assertAllClose(z, onp.cos(onp.exp(onp.sin(onp.arange(4.)))),
+                        check_dtypes=False)
+    self.assertIsNotNone(y._device_buffer._buffer)  # computed with z
+    self.assertAllClose(y, onp.exp(onp.sin(onp.arange(4.))), check_dtypes=False)
+
+    w = np.sin(y)
+    self.assertAllClose(jit(lambda w: w * 2)(w), 2 * onp.sin(y),
+                        check_dtypes=False)
+    self.assertTrue(bool(np.sin(x)[0] == 0))
+
+  @flagsaver.flagsaver(jax_lazy_eager=True)
+  def test_lazy_eager_without_abstract_eval(self):
+    p = Primitive('lazy_eager_no_abstract_eval')
+    p.def_impl(lambda x: xla.apply_primitive(p, x))
+    xla.translations[p] = lambda c, x: c.Neg(x)
+    x = device_put(onp.arange(3.))
+    self.assertAllClose(p.bind(x), -onp.arange(3.), check_dtypes=False)
+
+  @flagsaver.flagsaver(jax_lazy_eager=True)
+  def test_lazy_eager_memory_tracking(self):
+    x = device_put(onp.arange(4, dtype=onp.float32))
+    with memory.tracking():
+      before = api.memory_stats().get(0, {}).get('bytes_in_use', 0)
+      y = np.sin(x)
+      self.assertIsInstance(y._device_buffer, xla._LazyBuffer)
+      self.assertEqual(api.memory_stats().get(0, {}).get('bytes_in_use', 0),
+                       before)
+      self.assertAllClose(y, onp.sin(onp.arange(4)), check_dtypes=False)
+      self.assertEqual(api.memory_stats()[0]['bytes_in_use'], before + 16)
+      self.assertIn(('primitive', 'sin'), memory.summary())
+      del y
+      gc.collect()
+      self.assertEqual(api.memory_stats()[0]['bytes_in_use'], before)
+
+  @flagsaver.flagsaver(jax_lazy_eager=True, jax_lazy_eager_max_ops=3)
+  def test_lazy_eager_max_ops(self):
+    x = device_put(onp.float32(1.))
+    ys = [x]
+    for _ in range(10):
+      ys.append(np.sin(ys[-1]))
+    self.assertIsNotNone(ys[3]._device_buffer._buffer)
+    self.assertIsNone(ys[4]._device_buffer._buffer)
+    expected = 1.
+    for y in ys[1:]:
+      expected = onp.sin(expected)
+      self.assertAllClose(y, expected, check_dtypes=False)
+
+  @flagsaver.flagsaver(jax_debug_nans=True)
+  def test_debug_nans(self):
+    x = onp.array([0., 1.], onp.float32)
+    self.assertAllClose(np.log(x + 1.), onp.log(x + 1.), check_dtypes=False)
+    jtu.check_raises(lambda: np.log(x - 1.), FloatingPointError,
+                     "invalid value (nan or inf) encountered in log")
+    jtu.check_raises(lambda: np.log(x) * 2., FloatingPointError,
+                     "invalid value (nan or inf) encountered in log")
+    self.assertEqual(np.argmax(x), 1)  # no floating-point outputs to check
+
+  @flagsaver.flagsaver(jax_debug_nans=True)
+  def test_debug_nans_jit_localize(self):
+    f = jit(lambda x: np.sin(np.sqrt(np.cos(x) - 2.)) * 3.)
+    jtu.check_raises(lambda: f(onp.float32(1.)), FloatingPointError,
+                     "invalid value (nan or inf) encountered in sqrt "
+                     "(equation")
+    self.assertAllClose(jit(np.sin)(onp.float32(1.)), onp.sin(1.),
+                        check_dtypes=False)
+
+  @flagsaver.flagsaver(jax_debug_nans=True, jax_debug_nans_localize=False)
+  def test_debug_nans_jit_no_localize(self):
+    f = jit(lambda x: np.sqrt(x) + 1.)
+    jtu.check_raises(lambda: f(onp.float32(-1.)), FloatingPointError,
+                     "invalid value (nan or inf) encountered in jit-compiled "
+                     "computation")
+
+  def test_prefetch_to_device(self):
+    xs = [{'x': onp.arange(3., dtype=onp.float32) + i, 'y': i} for i in range(5)]
+    out = list(api.prefetch_to_device(iter(xs), size=2))
+    self.assertEqual(len(out), 5)
+    for x, y in zip(xs, out):
+      self.assertIsInstance(y['x'], DeviceArray)
+      self.assertAllClose(y['x'], x['x'], check_dtypes=True)
+      self.assertEqual(y['y'], x['y'])
+
+  def test_prefetch_to_device_error(self):
+    def stream():
+      yield onp.ones(3)
+      raise RuntimeError("out of data")
+    batches = api.prefetch_to_device(stream())
+    self.assertAllClose(next(batches), onp.ones(3), check_dtypes=False)
+    jtu.check_raises(lambda: next(batches), RuntimeError, "out of data")
+    jtu.check_raises(lambda: api.prefetch_to_device(iter([]), size=0),
+                     ValueError, "prefetch_to_device size must be positive")
+
+  @jtu.skip_on_devices("gpu", "tpu")
+  def test_host_view_zero_copy(self):
+    x = device_put(onp.arange(4, dtype=onp.float32))
+    if xb.host_view(x.device_buffer) is None:
+      raise SkipTest("jaxlib doesn't support the buffer protocol")
+    y = onp.asarray(x)
+    self.assertTrue(xb.is_host_view(x._value))
+    self.assertEqual(y.ctypes.data, x._value.ctypes.data)
+    self.assertFalse(y.flags.writeable)
+    self.assertAllClose(y, onp.arange(4), check_dtypes=True)
+
+    # donating x mustn't write into the memory y shares with it
+    f = jit(lambda x: x + 1, donate_argnums=0)
+    self.assertAllClose(f(x), onp.arange(1, 5), check_dtypes=False)
+    self.assertAllClose(y, onp.arange(4), check_dtypes=False)
+
+  @jtu.skip_on_devices("gpu", "tpu")
+  def test_device_put_aliasing(self):
+    # a read-only view of a writeable array must be copied
+    a = onp.arange(16, dtype=onp.float32)
+    view = a.view()
+    view.flags.writeable = False
+    self.assertFalse(xb.may_alias_host_array(view))
+    x = device_put(view)
+    a[:] = 0
+    self.assertAllClose(x, onp.arange(16), check_dtypes=False)
+
+    if not xb._aliasing_device_put_supported():
+      raise SkipTest("jaxlib doesn't support aliasing device_put")
+    tmpdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tmpdir)
+    path = os.path.join(tmpdir, 'x.bin')
+    onp.arange(16, dtype=onp.float32).tofile(path)
+    m = onp.memmap(path, dtype=onp.float32, mode='r', shape=(16,))
+    self.assertTrue(xb.may_alias_host_array(m))
+    y = device_put(m)
+    self.assertAllClose(y, onp.arange(16), check_dtypes=False)
+
+    # donating y mustn't write into the memory it shares with m
+    f = jit(lambda x: x + 1, donate_argnums=0)
+    self.assertAllClose(f(y), onp.arange(1, 17), check_dtypes=False)
+    self.assertAllClose(m, onp.arange(16), check_dtypes=False)
+
+  def test_dlpack_round_trip(self):
+    x = device_put(onp.arange(6, dtype=onp.float32).reshape(2, 3))
+    try:
+      capsule = dlpack.to_dlpack(x)
+    except NotImplementedError:
+      raise SkipTest("jaxlib doesn't support DLPack")
+    y = dlpack.from_dlpack(capsule)
+    self.assertIsInstance(y, DeviceArray)
+    self.assertAllClose(y, x, check_dtypes=True)
+    jtu.check_raises(lambda: dlpack.to_dlpack(onp.ones(3)), TypeError,
+                     "to_dlpack expects a DeviceArray")
+
+  def test_memory_tracking(self):
+    @jit
+    def double(x):
+      return 2 * x
+
+    @jit
+    def double_and_triple(x):
+      return 2 * x, 3 * x
+
+    x = onp.ones((4, 8), onp.float32)
+    with memory.tracking():
+      before = api.memory_stats().get(0, {}).get('bytes_in_use', 0)
+      with memory.peak() as p:
+        y = double(x)
+      records = [r for r in memory.snapshot() if r.origin == ('jit', 'double')]
+      self.assertEqual(len(records), 1)
+      self.assertEqual(records[0].bytes, x.nbytes)
+      self.assertEqual(records[0].shape, (4, 8))
+      self.assertGreaterEqual(p.bytes[0], before + x.nbytes)
+      self.assertEqual(api.memory_stats()[0]['bytes_in_use'],
+                       before + x.nbytes)
+      self.assertIn(('jit', 'double'), memory.summary())
+      del y, records
+      gc.collect()
+      self.assertEqual(api.memory_stats()[0]['bytes_in_use'], before)
+
+      # the elements of a tuple output take over its accounting
+      with memory.peak() as p:
+        y, z = double_and_triple(x)
+      records = [r for r in memory.snapshot()
+                 if r.origin == ('jit', 'double_and_triple')]
+      self.assertEqual([r.type for r in records], ['DeviceArray'] * 2)
+      self.assertEqual(p.bytes[0], before + 2 * x.nbytes)
+      self.assertEqual(api.memory_stats()[0]['bytes_in_use'],
+                       before + 2 * x.nbytes)
+      del y, z, records
+      gc.collect()
+      self.assertEqual(api.memory_stats()[0]['bytes_in_use'], before)
+    self.assertFalse(memory.is_enabled())
+
+  def test_jit_lower_compile(self):
+    traced = []
+    def f(x, y):
+      traced.append(None)
+      return {'sum': x + y, 'prod': x * y}
+
+    spec = api.ShapeDtypeStruct((3,), onp.float32)
+    lowered = jit(f).lower(spec, spec)
+    self.assertIn("add", lowered.as_hlo_text())
+    compiled = lowered.compile()
+    self.assertEqual(len(traced), 1)
+
+    x, y = onp.arange(3, dtype=onp.float32), onp.ones(3, onp.float32)
+    out = compiled(x, y)
+    self.assertEqual(len(traced), 1)
+    self.assertAllClose(out['sum'], x + y, check_dtypes=True)
+    self.assertAllClose(out['prod'], x * y, check_dtypes=True)
+
+  def test_jit_lower_static_argnums(self):
+    f = jit(lambda x, n: x * n, static_argnums=(1,))
+    compiled = f.lower(api.ShapeDtypeStruct((), onp.float32), 3).compile()
+    self.assertAllClose(compiled(onp.float32(2.), 3), 6., check_dtypes=False)
+    jtu.check_raises(lambda: compiled(onp.float32(2.), 4), ValueError,
+                     "Compiled function called with different static")
+
+  def test_jit_lower_compile_errors(self):
+    compiled = jit(lambda x: x + 1).lower(onp.ones(3)).compile()
+    jtu.check_raises(lambda: compiled(onp.ones(4)), TypeError,
+                     "Compiled function called with argument types")
+    jtu.check_raises(lambda: compiled((onp.ones(3),)), TypeError,
+                     "Compiled function called with argument structure")
+
+  @flagsaver.flagsaver(jax_hoist_constants_min_bytes=64)
+  def test_jit_hoists_large_constants(self):
+    big = onp.arange(32, dtype=onp.float32)  # 128 bytes, hoisted
+    small = onp.ones(4, onp.float32)  # 16 bytes, inlined
+    f = lambda x: (x * big, x[:4] + small)
+    x = onp.ones(32, onp.float32)
+
+    lowered = jit(f).lower(x)
+    self.assertIn("parameter(1)", lowered.as_hlo_text())
+    self.assertNotIn("parameter(2)", lowered.as_hlo_text())
+    self.assertAllClose(lowered.compile()(x), f(x), check_dtypes=True)
+    self.assertAllClose(jit(f)(x), f(x), check_dtypes=True)
+    self.assertAllClose(jit(f, donate_argnums=0)(onp.ones(32, onp.float32)),
+                        f(x), check_dtypes=True)
+
+    with flagsaver.flagsaver(jax_hoist_constants_min_bytes=-1):
+      self.assertNotIn("parameter(1)", jit(f).lower(x).as_hlo_text())
+
+  def test_jit_bucket_axes(self):
+    def masked_cumsum(x, y, length):
+      mask = np.arange(x.shape[0]) < length
+      return np.cumsum(np.where(mask, x * y, 0.)), np.sum(np.where(mask, x, 0.))
+
+    f = jit(masked_cumsum, bucket_axes=(0, None), bucket_sizes=(4, 8),
+            bucket_out_axes=(0, None))
+    misses = api.cache_info()['jax.interpreters.xla.xla_callable']['misses']
+    for n in range(1, 9):
+      x = onp.arange(n, dtype=onp.float32)
+      cumsum, total = f(x, onp.float32(2.))
+      self.assertEqual(cumsum.shape, (n,))
+      self.assertIsInstance(cumsum, DeviceArray)
+      self.assertAllClose(cumsum, onp.cumsum(2 * x), check_dtypes=False)
+      self.assertAllClose(total, onp.sum(x), check_dtypes=False)
+    self.assertEqual(
+        api.cache_info()['jax.interpreters.xla.xla_callable']['misses'],
+        misses + 2)
+
+  def test_jit_bucket_axes_errors(self):
+    f = jit(lambda x, y, length: x + y, bucket_axes=0)
+    jtu.check_raises(lambda: f(onp.ones(2), onp.ones(3)), ValueError,
+                     "bucketed axes must all have the same size")
+    g = jit(lambda x, y, length: x + y, bucket_axes=(0,))
+    jtu.check_raises(lambda: g(onp.ones(2), onp.ones(2)), ValueError,
+                     "bucket_axes specification must be an int or a tuple")
+    h = jit(lambda x, length: (x, np.sum(x)), bucket_axes=0)
+    jtu.check_raises(lambda: h(onp.ones(3)), ValueError,
+                     "bucket_out_axes names axis 0 of an output of shape ()")
+    h = jit(lambda x, length: (x, np.sum(x)), bucket_axes=0,
+            bucket_out_axes=(0,))
+    jtu.check_raises(lambda: h(onp.ones(3)), ValueError,
+                     "bucket_out_axes specification must be an int, None or")
+
+  def test_jit_bucket_axes_under_grad(self):
+    f = jit(lambda x, length: np.sum(x ** 2), bucket_axes=0)
+    self.assertAllClose(grad(f)(onp.arange(3.)), 2 * onp.arange(3.),
+                        check_dtypes=False)
+
+  def test_lazy_submodules(self):
+    lazy = ['opt_einsum', 'jax.numpy.linalg', 'jax.numpy.fft',
+            'jax.scipy.special', 'jax.scipy.stats.norm']
+    code = ("import sys, jax, jax.scipy, jax.scipy.stats; "
+            "print([m for m in {} if m in sys.modules])".format(lazy))
+    out = subprocess.check_output([sys.executable, '-c', code])
+    self.assertEqual(out.decode().strip(), '[]')
+
+    from jax import scipy as jsp
+    self.assertAllClose(jsp.special.logsumexp(onp.zeros(2)), onp.log(2.),
+                        check_dtypes=False)
+    self.assertTrue(callable(np.linalg.det))
+
+  def test_clear_caches(self):
+    f = jit(lambda x: x * 2)
+    f(1.)
+    info = api.cache_info()['jax.interpreters.xla.xla_callable']
+    self.assertGreater(info['entries'], 0)
+    self.assertGreater(info['bytes'], 0)
+
+    api.clear_caches()
+    info = api.cache_info()['jax.interpreters.xla.xla_callable']
+    self.assertEqual(info['entries'], 0)
+    self.assertEqual(info['bytes'], 0)
+    misses = info['misses']
+    self.assertEqual(f(1.), 2.)
+    self.assertEqual(api.cache_info()['jax.interpreters.xla.xla_callable']
+                     ['misses'], misses + 1)
+
+  def test_jit_fast_path_follows_xla_callable_cache(self):
+    f = jit(lambda x: x * 3)
+    self.assertEqual(f(1.), 3.)
+    xla.xla_callable.cache.clear()
+    gc.collect()
+    misses = api.cache_info()['jax.interpreters.xla.xla_callable']['misses']
+    self.assertEqual(f(1.), 3.)
+    self.assertEqual(api.cache_info()['jax.interpreters.xla.xla_callable']
+                     ['misses'], misses + 1)
+
+  def test_jit_fast_path_flags(self):
+    f = jit(lambda x: x * 3)
+    x = onp.ones(3, onp.float32)
+    self.assertIsInstance(f(x), DeviceArray)
+    with flagsaver.flagsaver(jax_device_values=False):
+      self.assertIsInstance(f(x), onp.ndarray)
+    self.assertIsInstance(f(x), DeviceArray)
+
+  def test_cache_registry_is_weak(self):
+    util.LRUCache('test_cache_registry_is_weak')
+    self.assertNotIn('test_cache_registry_is_weak', api.cache_info())
+
+  @flagsaver.flagsaver(jax_cache_max_entries=2)
+  def test_cache_eviction(self):
+    api.clear_caches()
+    f = jit(lambda x: x + 1)
+    for n in range(1, 5):
+      f(onp.zeros(n))
+    info = api.cache_info()['jax.interpreters.xla.xla_callable']
+    self.assertEqual(info['entries'], 2)
+    self.assertGreaterEqual(info['evictions'], 2)
+
+  def test_lru_cache_byte_budget(self):
+    cache = util.LRUCache('test_lru_cache_byte_budget', max_size=10,
+                          max_bytes=10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    self.assertEqual(cache.get('a'), 'xxxx')  # 'a' is now most recently used
+    cache.put('c', 'xxxx')
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.get('a'), 'xxxx')
+    self.assertEqual(cache.info(), {'hits': 2, 'misses': 1, 'evictions': 1,
+                                    'entries': 2, 'bytes': 8})
+    cache.put('d', 'x' * 20)  # over budget on its own, so kept alone
+    self.assertEqual(len(cache), 1)
+    self.assertEqual(cache.get('d'), 'x' * 20)
+
+  def test_remat_basic(self):
+    f = lambda x: np.sin(np.sin(x))
+    g = api.checkpoint(f)
+    x = onp.arange(3.)
+
+    self.assertAllClose(g(x), f(x), check_dtypes=True)
+    grad_g = lambda x: grad(lambda x: np.sum(g(x)))(x)
+    grad_f = lambda x: grad(lambda x: np.sum(f(x)))(x)
+    self.assertAllClose(grad_g(x), grad_f(x), check_dtypes=True)
+    self.assertAllClose(jit(grad_g)(x), grad_f(x), check_dtypes=True)
+    self.assertAllClose(api.vmap(grad_g)(x), api.vmap(grad_f)(x),
+                        check_dtypes=True)
+    self.assertAllClose(grad(grad(g))(2.), grad(grad(f))(2.),
+                        check_dtypes=False)
+
+  def test_remat_pytrees_and_closures(self):
+    y = np.ones(3)
+    @api.checkpoint
+    def g(x, scale=1.):
+      return {'a': np.sin(x['u'] * y) * scale, 'b': np.cos(x['v'])}
+    def loss(x):
+      out = g(x, scale=2.)
+      return np.sum(out['a']) + np.sum(out['b'])
+    x = {'u': onp.arange(3.), 'v': 2.}
+    ans = grad(loss)(x)
+    self.assertAllClose(ans['u'], 2 * onp.cos(onp.arange(3.)),
+                        check_dtypes=False)
+    self.assertAllClose(ans['v'], -onp.sin(2.), check_dtypes=False)
+
+  def test_remat_residuals(self):
+    x = onp.arange(1., 4.)
+    def residuals(fun):
+      _, _, _, consts = ad.linearize(lu.wrap_init(fun), x)
+      return consts
+    f = lambda x: np.sin(np.sin(x))
+    cos_x = onp.cos(x)
+    is_cos_x = lambda c: (not isinstance(c, JaxTuple) and
+                          onp.shape(c) == x.shape and onp.allclose(c, cos_x))
+    self.assertTrue(any(map(is_cos_x, residuals(f))))
+    self.assertFalse(any(map(is_cos_x, residuals(api.checkpoint(f)))))
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -0,0 +1,130 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as onp
+from absl.testing import absltest
+from absl.testing import flagsaver
+
+from jax import api
+from jax import jit
+from jax import test_util as jtu
+from jax.lib import compilation_cache as cc
+from jax.lib import xla_bridge as xb
+
+from jax.config import config
+config.parse_flags_with_absl()
+
+
+class CompilationCacheTest(jtu.JaxTestCase):
+
+  def setUp(self):
+    super(CompilationCacheTest, self).setUp()
+    self.path = tempfile.mkdtemp()
+    cc.reset_stats()
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+    super(CompilationCacheTest, self).tearDown()
+
+  def testPutGet(self):
+    cache = cc.FileSystemCache(self.path, max_size=2 ** 20)
+    self.assertIsNone(cache.get("abc"))
+    entry = {'version': cc._FORMAT_VERSION, 'hlo': b'hlo', 'executable': None}
+    cache.put("abc", entry)
+    self.assertEqual(cache.get("abc"), entry)
+    self.assertEqual(cc.stats['writes'], 1)
+    self.assertFalse([f for f in os.listdir(self.path) if f.endswith('.tmp')])
+
+  def testLeastRecentlyUsedEviction(self):
+    payload = b'x' * 1000
+    make_entry = lambda: {'version': cc._FORMAT_VERSION, 'hlo': payload,
+                          'executable': None}
+    cache = cc.FileSystemCache(self.path, max_size=2 ** 20)
+    cache.put("a", make_entry())
+    cache.put("b", make_entry())
+    entry_size = cache.size() // 2
+
+    # make "a" the most recently used entry, then shrink the budget
+    past = time.time() - 100
+    os.utime(cache._entry_path("b"), (past, past))
+    os.utime(cache._entry_path("a"), (past - 100, past - 100))
+    cache.get("a")
+    cache.max_size = int(2.5 * entry_size)
+    cache.put("c", make_entry())
+
+    self.assertIsNotNone(cache.get("a"))
+    self.assertIsNone(cache.get("b"))
+    self.assertIsNotNone(cache.get("c"))
+    self.assertEqual(cc.stats['evictions'], 1)
+
+  def testFingerprint(self):
+    shape_a = xb.Shape.array_shape(onp.dtype('float32'), (3, 4))
+    shape_b = xb.Shape.array_shape(onp.dtype('float32'), (4, 3))
+    fp = cc.fingerprint(b'hlo', [shape_a], None, 'cpu')
+    self.assertEqual(fp, cc.fingerprint(b'hlo', [shape_a], None, 'cpu'))
+    self.assertNotEqual(fp, cc.fingerprint(b'hlo', [shape_b], None, 'cpu'))
+    self.assertNotEqual(fp, cc.fingerprint(b'other', [shape_a], None, 'cpu'))
+    self.assertNotEqual(fp, cc.fingerprint(b'hlo', [shape_a], None, 'gpu'))
+
+  def testOptionsFingerprint(self):
+    class Options(object):
+      def __init__(self, num_replicas):
+        self.num_replicas = num_replicas
+        self.argument_layouts = None
+        self.unrelated = object()  # reprs with addresses aren't fingerprinted
+
+    shape = xb.Shape.array_shape(onp.dtype('float32'), (3,))
+    fp = cc.fingerprint(b'hlo', [shape], Options(1), 'cpu')
+    self.assertEqual(fp, cc.fingerprint(b'hlo', [shape], Options(1), 'cpu'))
+    self.assertNotEqual(fp, cc.fingerprint(b'hlo', [shape], Options(2), 'cpu'))
+    self.assertIsNone(cc.fingerprint(b'hlo', [shape], Options(object()), 'cpu'))
+
+  def testEndToEnd(self):
+    f = lambda x: x * 2. + 1.
+    x = onp.arange(3, dtype=onp.float32)
+    with flagsaver.flagsaver(jax_compilation_cache_dir=self.path):
+      api.clear_caches()
+      self.assertAllClose(jit(f)(x), x * 2. + 1., check_dtypes=False)
+      self.assertEqual(cc.stats['writes'], 1)
+
+      # building other computations shifts the process-global HLO ids, which
+      # mustn't change the key
+      api.clear_caches()
+      jit(lambda x: x - 3.)(x)
+      hits, misses = cc.stats['hits'], cc.stats['misses']
+      self.assertAllClose(jit(f)(x), x * 2. + 1., check_dtypes=False)
+
+    backend = xb.get_backend()
+    if hasattr(backend, 'serialize_executable'):
+      self.assertEqual((cc.stats['hits'], cc.stats['misses']),
+                       (hits + 1, misses))
+    else:
+      # only the HLO is stored, and the existing entry isn't rewritten
+      self.assertEqual((cc.stats['hits'], cc.stats['misses']),
+                       (hits, misses + 1))
+    self.assertEqual(cc.stats['writes'], 2)
+    self.assertEqual(len(cc.FileSystemCache(self.path, 2 ** 20).entries()), 2)
+
+
+if __name__ == "__main__":
+  absltest.main()
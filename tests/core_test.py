@@ -30,6 +30,7 @@ from jax import numpy as np
 from jax import test_util as jtu
 from jax.api import jvp, linearize, vjp, jit
 from jax.lax import UnshapedArray, ShapedArray, ConcreteArray
+from jax import tree_util
 from jax.tree_util import tree_flatten, tree_unflatten, tree_multimap, tree_reduce
 from jax.util import partial
 from jax.interpreters import partial_eval as pe
@@ -205,6 +206,31 @@ class CoreTest(jtu.JaxTestCase):
     nodes_equal = tree_multimap(operator.eq, tree, tree2)
     assert tree_reduce(operator.and_, nodes_equal)
 
+  def test_treedef(self):
+    tree = [(1, 2), {"roy": (3, [4, 5, ()])}, None]
+    _, treedef = tree_flatten(tree)
+    _, roy_treedef = tree_flatten((3, [4, 5, ()]))
+    children = [tree_util.tree_structure((1, 2)),
+                tree_util.PyTreeDef(tree_util.node_types[dict], ("roy",),
+                                    [roy_treedef]),
+                tree_util.tree_structure(None)]
+    treedef2 = tree_util.PyTreeDef(tree_util.node_types[list], None, children)
+    self.assertEqual(treedef, treedef2)
+    self.assertEqual(hash(treedef), hash(treedef2))
+    self.assertEqual(treedef.children, children)
+    self.assertEqual(treedef.num_leaves, 5)
+    self.assertNotEqual(treedef, tree_util.tree_structure([(1, 2), {}, None]))
+    self.assertIs(tree_util.tree_structure(1), tree_util.leaf)
+    nested = ((1, 2), ((3, (4, 5, ())),), ())
+    self.assertEqual(tree_util.build_tree(treedef, nested), tree)
+    self.assertRaises(ValueError, lambda: tree_unflatten(treedef, [1, 2]))
+
+  def test_tree_multimap_prefix(self):
+    xs = [1, (2, 3)]
+    ys = [[4], (5, {'a': 6})]
+    self.assertEqual(tree_multimap(lambda x, y: (x, y), xs, ys),
+                     [(1, [4]), ((2, 5), (3, {'a': 6}))])
+
   @parameterized.parameters(test_specs)
   def test_jit(self, f, args):
     jtu.check_eq(jit(f)(*args), f(*args))
@@ -0,0 +1,128 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as onp
+from absl.testing import absltest
+from absl.testing import flagsaver
+
+import jax.numpy as np
+from jax import api, core, lax
+from jax import jaxpr_passes
+from jax import test_util as jtu
+from jax.core import Jaxpr, JaxprEqn, Literal, pack_p, identity_p
+
+from jax.config import config
+config.parse_flags_with_absl()
+
+
+def _eqn(invars, outvars, primitive, destructure=False):
+  return JaxprEqn(invars, outvars, primitive, (), False, destructure, {})
+
+def _primitives(jaxpr):
+  return [eqn.primitive for eqn in jaxpr.eqns]
+
+
+class JaxprPassesTest(jtu.JaxTestCase):
+
+  def testEliminateTuples(self):
+    f = api.grad(lambda x: np.sin(np.cos(x)))
+    jaxpr = api.make_jaxpr(f)(3.)
+    self.assertIn(pack_p, _primitives(jaxpr))
+    opt = jaxpr_passes.eliminate_tuples(jaxpr)
+    self.assertNotIn(pack_p, _primitives(opt))
+    self.assertNotIn(identity_p, _primitives(opt))
+    self.assertEqual(len(opt.eqns), len(jaxpr.eqns) - 4)
+
+  def testRepackUnpackedTuple(self):
+    jaxpr = Jaxpr([], [], ['a'], 'd', [_eqn(['a'], ['b', 'c'], identity_p, True),
+                                       _eqn(['b', 'c'], ['d'], pack_p)])
+    opt = jaxpr_passes.optimize_jaxpr(jaxpr, jaxpr_passes.default_passes)
+    self.assertEqual(opt.eqns, [])
+    self.assertEqual(opt.outvar, 'a')
+
+  def testEliminateCommonSubexpressions(self):
+    jaxpr = api.make_jaxpr(lambda x: np.sin(x) * np.sin(x))(3.)
+    opt = jaxpr_passes.eliminate_common_subexpressions(jaxpr)
+    self.assertEqual(_primitives(opt), [lax.sin_p, lax.mul_p])
+    self.assertEqual(opt.eqns[1].invars[0], opt.eqns[1].invars[1])
+
+  def testEliminateCommonSubexpressionsLiterals(self):
+    nan = float('nan')
+    jaxpr = Jaxpr([], [], ['a'], 'f',
+                  [_eqn(['a', Literal(-0.)], ['b'], lax.mul_p),
+                   _eqn(['a', Literal(0.)], ['c'], lax.mul_p),
+                   _eqn(['a', Literal(nan)], ['d'], lax.mul_p),
+                   _eqn(['a', Literal(nan)], ['e'], lax.mul_p),
+                   _eqn(['b', 'c'], ['g'], lax.add_p),
+                   _eqn(['d', 'e'], ['h'], lax.add_p),
+                   _eqn(['g', 'h'], ['f'], lax.add_p)])
+    opt = jaxpr_passes.eliminate_common_subexpressions(jaxpr)
+    self.assertEqual(_primitives(opt).count(lax.mul_p), 3)
+    self.assertEqual(opt.eqns[-3].invars, ['b', 'c'])
+    self.assertEqual(opt.eqns[-2].invars, ['d', 'd'])
+
+  def testEliminateDeadCode(self):
+    jaxpr = Jaxpr([], [], ['a'], 'b', [_eqn(['a'], ['b'], lax.sin_p),
+                                       _eqn(['a'], ['c'], lax.cos_p),
+                                       _eqn(['c', 'a'], ['d'], lax.mul_p)])
+    opt = jaxpr_passes.eliminate_dead_code(jaxpr)
+    self.assertEqual(_primitives(opt), [lax.sin_p])
+    self.assertEqual(len(jaxpr.eqns), 3)  # the input isn't modified
+
+  def testFoldLiterals(self):
+    jaxpr = Jaxpr([], [], ['a'], 'c',
+                  [_eqn([Literal(2.), Literal(3.)], ['b'], lax.add_p),
+                   _eqn(['a', 'b'], ['c'], lax.mul_p)])
+    opt = jaxpr_passes.fold_literals(jaxpr)
+    self.assertEqual(_primitives(opt), [lax.mul_p])
+    self.assertEqual(opt.eqns[0].invars[1].val, 5.)
+    x = 1.5
+    self.assertAllClose(core.eval_jaxpr(opt, (), (), x),
+                        core.eval_jaxpr(jaxpr, (), (), x), check_dtypes=True)
+
+  def testFoldLiteralsKeepsOutvar(self):
+    jaxpr = Jaxpr([], [], ['a'], 'b',
+                  [_eqn([Literal(2.), Literal(3.)], ['b'], lax.add_p)])
+    opt = jaxpr_passes.fold_literals(jaxpr)
+    self.assertEqual(opt.outvar, 'b')
+    self.assertEqual(_primitives(opt), [lax.add_p])
+
+  @flagsaver.flagsaver(jax_optimize_jaxprs=False)
+  def testDisabled(self):
+    jaxpr = api.make_jaxpr(lambda x: np.sin(x) * np.sin(x))(3.)
+    self.assertIs(jaxpr_passes.optimize_jaxpr(jaxpr), jaxpr)
+
+  def testNumerics(self):
+    def f(x, y):
+      z = np.tanh(x) * np.tanh(x) + y
+      return np.sum(z * np.tanh(x))
+
+    x, y = onp.arange(4.), onp.ones(4)
+    fs = [api.grad(f), api.grad(f, (0, 1)),
+          api.vmap(api.grad(f), (0, None)),
+          api.jit(api.grad(api.grad(lambda x: np.sin(np.tanh(x)))))]
+    for fun, args in zip(fs, [(x, y), (x, y), (onp.ones((3, 4)), y), (2.,)]):
+      expected = api.jit(fun)(*args)
+      with flagsaver.flagsaver(jax_optimize_jaxprs=False):
+        api.clear_caches()
+        actual = api.jit(fun)(*args)
+      self.assertAllClose(expected, actual, check_dtypes=True)
+
+
+if __name__ == "__main__":
+  absltest.main()
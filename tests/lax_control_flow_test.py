@@ -546,6 +546,66 @@ class LaxControlFlowTest(jtu.JaxTestCase):
     expected = api.grad(lambda c, as_: list(scan_reference(f, c, as_))[0].sum())(c, as_)
     self.assertAllClose(ans, expected, check_dtypes=False)
 
+  def testWhileLoopMaxSteps(self):
+    def f(x, max_steps):
+      return lax.while_loop(lambda x: x < 10., lambda x: x * 1.5, x,
+                            max_steps=max_steps)
+
+    self.assertAllClose(f(1., 20), lax.while_loop(lambda x: x < 10.,
+                                                  lambda x: x * 1.5, 1.),
+                        check_dtypes=False)
+    self.assertAllClose(f(1., 3), 1.5 ** 3, check_dtypes=False)
+    self.assertAllClose(f(1., 0), 1., check_dtypes=False)
+    self.assertAllClose(api.jit(f, static_argnums=(1,))(1., 20), f(1., 20),
+                        check_dtypes=False)
+    # the loop runs 6 iterations, so x -> x * 1.5 ** 6
+    self.assertAllClose(api.grad(f)(1., 20), 1.5 ** 6, check_dtypes=False)
+
+  def testWhileLoopMaxStepsError(self):
+    body = lambda x: x + 1
+    jtu.check_raises(lambda: lax.while_loop(lambda x: x < 3, body, 0,
+                                            max_steps=-1),
+                     ValueError, "while_loop max_steps must be non-negative")
+    jtu.check_raises(lambda: lax.while_loop(lambda x: x < 3, body, 0,
+                                            max_steps=1.5),
+                     TypeError, "while_loop max_steps must be a non-negative")
+
+  def testForiLoopMaxStepsGrad(self):
+    def f(x, num_steps):
+      body = lambda i, x: np.sin(x) * (1. + 0.1 * i)
+      return lax.fori_loop(0, num_steps, body, x, max_steps=num_steps)
+
+    def f_reference(x, num_steps):
+      for i in range(num_steps):
+        x = np.sin(x) * (1. + 0.1 * i)
+      return x
+
+    x = onp.linspace(0., 1., 3)
+    loss = lambda f, num_steps: lambda x: np.sum(f(x, num_steps))
+    for num_steps in [1, 2, 7, 16]:
+      self.assertAllClose(f(x, num_steps), f_reference(x, num_steps),
+                          check_dtypes=False)
+      ans = api.grad(loss(f, num_steps))(x)
+      expected = api.grad(loss(f_reference, num_steps))(x)
+      self.assertAllClose(ans, expected, check_dtypes=False)
+    ans = api.jit(api.grad(loss(f, 7)))(x)
+    expected = api.grad(loss(f_reference, 7))(x)
+    self.assertAllClose(ans, expected, check_dtypes=False)
+
+  def testScanRemat(self):
+    def f(c, a):
+      b = np.sum(np.sin(a)) + np.sum(np.sin(c))
+      c = np.sin(c * b)
+      return c, b
+
+    as_ = np.ones((5, 3))
+    c = np.ones(4)
+
+    loss = lambda f: lambda c, as_: list(lax.scan(f, c, as_))[0].sum()
+    ans = api.grad(loss(api.checkpoint(f)))(c, as_)
+    expected = api.grad(loss(f))(c, as_)
+    self.assertAllClose(ans, expected, check_dtypes=False)
+
   def testScanRnn(self):
     r = npr.RandomState(0)
 
@@ -21,16 +21,19 @@ from unittest import SkipTest
 
 import numpy as onp
 from absl.testing import absltest
+from absl.testing import flagsaver
 from absl.testing import parameterized
 
 import jax.numpy as np
 from jax import test_util as jtu
 from jax import core
 from jax import lax
-from jax.api import pmap, jit, vmap, jvp, grad, make_jaxpr, linearize, device_put
+from jax.api import (pmap, jit, vmap, jvp, grad, make_jaxpr, linearize,
+                     device_put, prefetch_to_device)
 from jax.lib import xla_bridge
 from jax.util import prod
 from jax.interpreters import pxla
+from jax.interpreters import xla
 
 from jax.config import config
 config.parse_flags_with_absl()
@@ -260,6 +263,122 @@ class PmapTest(jtu.JaxTestCase):
     self.assertEqual((tuple(sorted(groups[0])),),
                      ((0, 1, 2, 3, 4, 5, 6, 7,),))  # order doesn't matter
 
+  @parameterized.named_parameters(
+      {"testcase_name": "_mesh={}".format(device_mesh_shape),
+       "device_mesh_shape": device_mesh_shape}
+      for device_mesh_shape in [(1, 1), (2, -1), (-1, 2)])
+  def testMeshPsum(self, device_mesh_shape):
+    mesh_shape = self._getMeshShape(device_mesh_shape)
+    f = lambda x: (lax.psum(x, 'data'), lax.psum(x, 'model'),
+                   lax.psum(x, ('data', 'model')))
+    f = pmap(f, axis_name=('data', 'model'))
+
+    shape = mesh_shape + (4,)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+    by_data, by_model, by_both = f(x)
+
+    def sum_and_broadcast(x, axis):
+      return onp.repeat(onp.sum(x, axis, keepdims=True), x.shape[axis], axis)
+    self.assertIsInstance(by_data, pxla.ShardedDeviceArray)
+    self.assertEqual(by_data.shape, shape)
+    self.assertAllClose(by_data, sum_and_broadcast(x, 0), check_dtypes=False)
+    self.assertAllClose(by_model, sum_and_broadcast(x, 1), check_dtypes=False)
+    self.assertAllClose(by_both, sum_and_broadcast(sum_and_broadcast(x, 0), 1),
+                        check_dtypes=False)
+    self.assertEqual(len(by_data.shards), prod(mesh_shape))
+
+    # mesh-sharded results can be passed back in without resharding
+    g = pmap(lambda x: lax.psum(x, 'model'), axis_name=('data', 'model'))
+    self.assertAllClose(g(by_data), sum_and_broadcast(by_data, 1),
+                        check_dtypes=False)
+
+  def testMeshGrad(self):
+    mesh_shape = self._getMeshShape((-1, 1))
+    f = pmap(np.sin, axis_name=('data', 'model'))
+
+    shape = mesh_shape + (4,)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+    ans = grad(lambda x: np.sum(f(x)))(x)
+    expected = grad(lambda x: np.sum(np.sin(x)))(x)
+    self.assertAllClose(ans, expected, check_dtypes=False)
+
+  def testMeshShapeError(self):
+    f = pmap(lambda x, y: x + y, axis_name=('data', 'model'))
+    self.assertRaises(ValueError, lambda: f(onp.ones((1, 1)), onp.ones((1, 2))))
+    self.assertRaises(ValueError, lambda: f(onp.ones(1), onp.ones(1)))
+
+  def testMeshDeviceArrayInput(self):
+    mesh_shape = self._getMeshShape((-1, 1))
+    f = pmap(lambda x: 2 * x, axis_name=('data', 'model'))
+
+    shape = mesh_shape + (4,)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+    ans = f(device_put(x))
+    self.assertIsInstance(ans, pxla.ShardedDeviceArray)
+    self.assertEqual(ans.shape, shape)
+    self.assertAllClose(ans, 2 * x, check_dtypes=False)
+
+  def testMeshTupleOutputError(self):
+    mesh_shape = self._getMeshShape((-1, 1))
+    f = pmap(lambda x: core.pack((x, x)), axis_name=('data', 'model'))
+    x = onp.ones(mesh_shape + (4,), onp.float32)
+    jtu.check_raises(lambda: f(x), TypeError,
+                     "pmap over a device mesh doesn't support tuple outputs.")
+
+  @jtu.skip_on_devices("cpu", "gpu")
+  def testMeshPswapaxes(self):
+    mesh_shape = self._getMeshShape((-1, 2))
+    f = lambda x: lax.pswapaxes(x, 'model', 0)
+    f = pmap(f, axis_name=('data', 'model'))
+
+    shape = mesh_shape + (2, 3)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+    ans = f(x)
+    expected = onp.swapaxes(x, 1, 2)
+    self.assertAllClose(ans, expected, check_dtypes=False)
+
+  def testPmapInsideJit(self):
+    f = pmap(lambda x: x - lax.psum(x, 'i'), axis_name='i')
+
+    @jit
+    def step(x):
+      return 2 * np.sum(f(np.sin(x)), 0)
+
+    device_count = xla_bridge.device_count()
+    shape = (device_count, 4)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+    y = onp.sin(x)
+    expected = 2 * onp.sum(y - onp.sum(y, 0), 0)
+    self.assertAllClose(step(x), expected, check_dtypes=False)
+
+    # the whole step is one executable replicated over the pmapped devices
+    self.assertEqual(xla.jaxpr_replicas(make_jaxpr(step)(x)), device_count)
+    lowered = step.lower(x)
+    self.assertEqual(lowered._nreps, device_count)
+    self.assertAllClose(lowered.compile()(x), expected, check_dtypes=False)
+
+  def testPmapInsideJitDebugNansAndAsync(self):
+    f = jit(pmap(np.log))
+
+    shape = (xla_bridge.device_count(), 4)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape) + 1.
+    with flagsaver.flagsaver(jax_debug_nans=True):
+      self.assertAllClose(f(x), onp.log(x), check_dtypes=False)
+      jtu.check_raises(lambda: f(-x), FloatingPointError,
+                       "invalid value (nan or inf) encountered in "
+                       "jit-compiled computation")
+    with flagsaver.flagsaver(jax_async_dispatch=True):
+      y = f(x)
+      self.assertIs(y.block_until_ready(), y)
+      self.assertAllClose(y, onp.log(x), check_dtypes=False)
+
+  def testCollectiveInsideJitInsidePmap(self):
+    f = pmap(jit(lambda x: x - lax.psum(x, 'i')), axis_name='i')
+
+    shape = (xla_bridge.device_count(), 4)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+    self.assertAllClose(f(x), x - onp.sum(x, 0), check_dtypes=False)
+
   def testShardedDeviceTuple(self):
     f = lambda x: core.pack((x, x))
     f = pmap(f)
@@ -280,6 +399,95 @@ class PmapTest(jtu.JaxTestCase):
     w = jit(lambda x: list(x)[0])(y)
     self.assertAllClose(w, x, check_dtypes=False)
 
+  def testShardDeviceArray(self):
+    f = pmap(lambda x: 2 * x)
+
+    shape = (xla_bridge.device_count(), 4)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+    ans = f(device_put(x))
+    self.assertIsInstance(ans, pxla.ShardedDeviceArray)
+    self.assertAllClose(ans, 2 * x, check_dtypes=False)
+
+  def testShardedDeviceArrayShards(self):
+    f = pmap(lambda x: 2 * x)
+
+    shape = (xla_bridge.device_count(), 4)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+    y = f(x)
+    self.assertEqual(len(y.shards), shape[0])
+    for shard, expected in zip(y.shards, 2 * x):
+      self.assertIsInstance(shard, xla.DeviceArray)
+      self.assertAllClose(shard, expected, check_dtypes=False)
+
+    self.assertAllClose(y[0], 2 * x[0], check_dtypes=False)
+    self.assertAllClose(y[-1], 2 * x[-1], check_dtypes=False)
+    self.assertAllClose(y[:, 1], 2 * x[:, 1], check_dtypes=False)
+    self.assertRaises(IndexError, lambda: y[shape[0]])
+    self.assertAllClose(onp.asarray(y), 2 * x, check_dtypes=False)
+
+  def testDonateShardedDeviceArrayShards(self):
+    f = pmap(lambda x: 2 * x)
+    g = jit(lambda x: x + 1, donate_argnums=0)
+
+    shape = (xla_bridge.device_count(), 4)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+    y = f(x)
+    shard = y.shards[0]
+    jtu.check_raises(lambda: g(shard), ValueError,
+                     "A DeviceArray that shares its device buffer")
+    self.assertAllClose(y, 2 * x, check_dtypes=False)
+
+    self.assertAllClose(g(y), 2 * x + 1, check_dtypes=False)
+    jtu.check_raises(lambda: y.shards, RuntimeError,
+                     "ShardedDeviceArray was donated")
+
+  def testReshardAcrossReplicaCounts(self):
+    device_count = xla_bridge.device_count()
+    if device_count % 2:
+      raise SkipTest("test requires an even number of devices")
+    shape = (device_count // 2, 2, 4)
+    x = onp.arange(prod(shape), dtype=onp.float32).reshape(shape)
+
+    y = pmap(lambda x: x + 1)(x)  # uses device_count // 2 replicas
+    self.assertIsInstance(y, pxla.ShardedDeviceArray)
+    z = pmap(pmap(lambda x: 2 * x))(y)  # uses device_count replicas
+    self.assertAllClose(z, 2 * (x + 1), check_dtypes=False)
+    w = pmap(lambda x: x - 1)(z)  # back to device_count // 2 replicas
+    self.assertAllClose(w, 2 * (x + 1) - 1, check_dtypes=False)
+
+  def testDeviceToDeviceTransfer(self):
+    # On CPU, run with XLA_FLAGS=--xla_force_host_platform_device_count=2 or
+    # more to exercise this test.
+    if xla_bridge.device_count() < 2:
+      raise SkipTest("test requires at least two devices")
+    x = device_put(onp.arange(4, dtype=onp.float32))
+    self.assertEqual(x.device_buffer.device(), 0)
+
+    buf = xla.device_put(x, 1)
+    self.assertEqual(buf.device(), 1)
+    self.assertAllClose(buf.to_py(), onp.arange(4), check_dtypes=False)
+
+    bufs = xla.device_put_many([(x, 1), (x, 0)])
+    self.assertEqual([b.device() for b in bufs], [1, 0])
+    self.assertAllClose(bufs[0].to_py(), onp.arange(4), check_dtypes=False)
+
+  def testPrefetchToDevices(self):
+    device_count = xla_bridge.device_count()
+    shape = (device_count, 4)
+    xs = [onp.arange(prod(shape), dtype=onp.float32).reshape(shape) + i
+          for i in range(3)]
+    f = pmap(lambda x: 2 * x)
+    batches = prefetch_to_device(iter(xs), size=2, devices=range(device_count))
+    for x, batch in zip(xs, batches):
+      self.assertIsInstance(batch, pxla.ShardedDeviceArray)
+      self.assertEqual([buf.device() for buf in batch.device_buffers],
+                       list(range(device_count)))
+      self.assertAllClose(f(batch), 2 * x, check_dtypes=False)
+
+    bad = iter([onp.zeros((device_count + 1, 4))])
+    batches = prefetch_to_device(bad, devices=range(device_count))
+    self.assertRaises(ValueError, lambda: next(batches))
+
   @jtu.skip_on_devices("cpu", "gpu")
   def testCollectivePermute(self):
     device_count = xla_bridge.device_count()
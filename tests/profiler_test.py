@@ -0,0 +1,102 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as onp
+from absl.testing import absltest
+
+import jax.numpy as np
+from jax import jit, lax
+from jax import profiler
+from jax import test_util as jtu
+
+from jax.config import config
+config.parse_flags_with_absl()
+
+
+class ProfilerTest(jtu.JaxTestCase):
+
+  def setUp(self):
+    super(ProfilerTest, self).setUp()
+    profiler.reset()
+
+  def tearDown(self):
+    profiler.stop()
+    profiler.reset()
+    super(ProfilerTest, self).tearDown()
+
+  def testJitCompileEvents(self):
+    def profiled_fun(x):
+      return np.sin(x) * 2.
+
+    f = jit(profiled_fun)
+    x = onp.arange(3.)
+    with profiler.profile():
+      f(x)
+      f(x)
+    f(x)  # not recorded
+
+    stats = profiler.summary()[('jit', 'profiled_fun')]
+    self.assertEqual(stats['calls'], 2)
+    self.assertEqual(stats['cache_misses'], 1)
+    self.assertEqual(stats['cache_hits'], 1)
+    self.assertGreater(stats['num_eqns'], 0)
+    self.assertGreater(stats['hlo_size'], 0)
+
+    miss, = [e for e in profiler.events()
+             if e['name'] == 'profiled_fun' and not e['cache_hit']]
+    self.assertEqual(set(miss['phases']), {'trace', 'lower', 'compile'})
+    self.assertGreaterEqual(miss['duration'], sum(miss['phases'].values()))
+
+  def testPrimitiveEvents(self):
+    x = onp.arange(4.)
+    with profiler.profile():
+      lax.neg(x)
+      lax.neg(x)
+    stats = profiler.summary()[('primitive', 'neg')]
+    self.assertEqual(stats['calls'], 2)
+    self.assertEqual(stats['cache_hits'] + stats['cache_misses'], 2)
+    self.assertGreaterEqual(stats['cache_hits'], 1)
+
+  def testDisabledByDefault(self):
+    jit(lambda x: x + 1)(1.)
+    self.assertEqual(profiler.events(), [])
+
+  def testExportChromeTrace(self):
+    with profiler.profile():
+      jit(lambda x: x * 3)(onp.ones(2))
+    path = tempfile.mkdtemp()
+    try:
+      trace_path = os.path.join(path, 'trace.json')
+      profiler.export_chrome_trace(trace_path)
+      with open(trace_path) as f:
+        trace = json.load(f)
+    finally:
+      shutil.rmtree(path)
+    names = [e['name'] for e in trace['traceEvents']]
+    self.assertIn('<lambda>', names)
+    self.assertIn('compile', names)
+    self.assertTrue(all(e['ph'] == 'X' for e in trace['traceEvents']))
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,151 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+import warnings
+
+import numpy as onp
+from absl.testing import absltest
+
+import jax.numpy as np
+from jax import api, jit, pmap
+from jax import warmup
+from jax import test_util as jtu
+
+from jax.config import config
+config.parse_flags_with_absl()
+
+
+def scaled_sum(x, scale, inputs):
+  return scale * (x + np.sum(inputs['y']))
+
+@jit
+def decorated(x):
+  return x * 2
+
+def mean_over_devices(x):
+  return x - np.mean(x)
+
+
+class WarmupTest(jtu.JaxTestCase):
+
+  def setUp(self):
+    super(WarmupTest, self).setUp()
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'manifest.jsonl')
+
+  def tearDown(self):
+    warmup.stop_recording()
+    shutil.rmtree(self.dir)
+    super(WarmupTest, self).tearDown()
+
+  def xla_callable_info(self):
+    return api.cache_info()['jax.interpreters.xla.xla_callable']
+
+  def testRecordAndReplay(self):
+    f = jit(scaled_sum, static_argnums=(1,))
+    args = [(onp.ones(3, onp.float32), 2., {'y': onp.ones((2, 2))}),
+            (onp.ones((), onp.float32), 3., {'y': onp.ones(4)})]
+    warmup.start_recording(self.path)
+    for x, scale, inputs in args:
+      f(x, scale, inputs)
+      f(x, scale, inputs)
+    decorated(onp.arange(3.))
+    jit(lambda x: x)(1.)  # not importable by name, so not recorded
+    warmup.stop_recording()
+
+    with open(self.path) as manifest:
+      entries = [json.loads(line) for line in manifest]
+    self.assertEqual(len(entries), 3)
+    self.assertEqual(set(e['name'] for e in entries),
+                     {'scaled_sum', 'decorated'})
+
+    api.clear_caches()
+    self.assertEqual(warmup.warmup(self.path), 3)
+    info = self.xla_callable_info()
+    self.assertEqual(info['entries'], 3)
+    for x, scale, inputs in args:
+      self.assertAllClose(f(x, scale, inputs), scaled_sum(x, scale, inputs),
+                          check_dtypes=False)
+    self.assertAllClose(decorated(onp.arange(3.)), 2 * onp.arange(3.),
+                        check_dtypes=False)
+    self.assertEqual(self.xla_callable_info()['misses'], info['misses'])
+
+  def testRecordsWarmFunctions(self):
+    x = onp.arange(3.)
+    decorated(x)  # compiled, and cached by the fast path, before recording
+    warmup.start_recording(self.path)
+    decorated(x)
+    warmup.stop_recording()
+
+    with open(self.path) as manifest:
+      entries = [json.loads(line) for line in manifest]
+    self.assertEqual([e['name'] for e in entries], ['decorated'])
+
+  def testSkipsMissingFunctions(self):
+    with open(self.path, 'w') as manifest:
+      entry = {'kind': 'jit', 'module': __name__, 'name': 'no_such_function',
+               'static_argnums': [], 'donate_argnums': [],
+               'device_values': True, 'args': [], 'kwargs': {'dict': []}}
+      manifest.write(json.dumps(entry) + '\n')
+    with warnings.catch_warnings(record=True) as caught:
+      warnings.simplefilter('always')
+      self.assertEqual(warmup.warmup(self.path), 0)
+    self.assertIn("Skipping warmup entry", str(caught[0].message))
+
+  def testSkipsListStaticArgs(self):
+    f = jit(scaled_sum, static_argnums=(1,))
+    warmup.start_recording(self.path)
+    f(onp.ones(3), [2.], {'y': onp.ones(2)})
+    warmup.stop_recording()
+    self.assertFalse(os.path.exists(self.path))
+
+    with open(self.path, 'w') as manifest:
+      entry = {'kind': 'jit', 'module': __name__, 'name': 'scaled_sum',
+               'static_argnums': [1], 'donate_argnums': [],
+               'device_values': True, 'kwargs': {'dict': []},
+               'args': [{'shape': [3], 'dtype': 'float32'},
+                        {'static': {'list': [{'value': 2.}]}},
+                        {'dict': [['y', {'shape': [2], 'dtype': 'float32'}]]}]}
+      manifest.write(json.dumps(entry) + '\n')
+    with warnings.catch_warnings(record=True) as caught:
+      warnings.simplefilter('always')
+      self.assertEqual(warmup.warmup(self.path), 0)
+    self.assertIn("static arguments containing lists", str(caught[0].message))
+
+  def testPmap(self):
+    f = pmap(mean_over_devices, 'i')
+    x = onp.arange(api.device_count() * 3.).reshape(api.device_count(), 3)
+    warmup.start_recording(self.path)
+    f(x)
+    warmup.stop_recording()
+
+    api.clear_caches()
+    self.assertEqual(warmup.warmup(self.path), 1)
+    info = api.cache_info()['jax.interpreters.pxla.parallel_callable']
+    self.assertAllClose(f(x), x - x.mean(1, keepdims=True), check_dtypes=False)
+    self.assertEqual(
+        api.cache_info()['jax.interpreters.pxla.parallel_callable']['misses'],
+        info['misses'])
+
+
+if __name__ == "__main__":
+  absltest.main()